@@ -0,0 +1,111 @@
+# batch_runner.py
+# Modo não interativo (headless) de mini_doc_analyzer: configuração por flags ou ficheiro JSON, e partição
+# determinística da matriz (modelo × documento) em shards para distribuir uma avaliação por várias máquinas.
+import os
+import json
+import socket
+import hashlib
+import datetime
+
+SHARD_SUMMARY_FILENAME_TEMPLATE = "shard_summary_{index:03d}_of_{count:03d}.json"
+RAG_TYPE_ALIASES = {
+    "none": "none",
+    "simple": "simple_docs_llamaindex", "simple_docs_llamaindex": "simple_docs_llamaindex",
+    "multi_step": "multi_step_qa_llamaindex", "multi_step_qa_llamaindex": "multi_step_qa_llamaindex",
+}
+# Chaves aceites no ficheiro de configuração (iguais às flags, com '_' em vez de '-')
+HEADLESS_CONFIG_KEYS = ("models", "rag", "schema_dir", "output_dir", "shard_index", "shard_count", "resume", "journal_file")
+
+
+def add_headless_arguments(parser):
+    parser.add_argument("--headless", action="store_true", default=None, help="Não fazer perguntas interativas (usa flags/--config).")
+    parser.add_argument("--config", default=None, help="Ficheiro JSON com as mesmas opções das flags (as flags prevalecem).")
+    parser.add_argument("--models", nargs="+", default=None, help="Modelos a usar, ou 'all' para todos os disponíveis.")
+    parser.add_argument("--rag", choices=sorted(RAG_TYPE_ALIASES), default=None, help="Tipo de RAG (por omissão, 'none').")
+    parser.add_argument("--schema-dir", default=None, help="Diretório dos ficheiros JSON a analisar.")
+    parser.add_argument("--output-dir", default=None, help="Diretório para logs, journal e sumário do shard.")
+    parser.add_argument("--shard-index", type=int, default=None, help="Índice deste shard (0..shard-count-1).")
+    parser.add_argument("--shard-count", type=int, default=None, help="Nº total de shards (máquinas).")
+
+
+def load_headless_config(cli_args):
+    """
+    Combina o ficheiro --config (se houver) com as flags. Devolve um dicionário com todas as HEADLESS_CONFIG_KEYS.
+    Uma flag dada prevalece mesmo com valor 0 (ex: --shard-index 0); as flags store_true usam default=None para isso.
+    """
+    config = {key: None for key in HEADLESS_CONFIG_KEYS}
+    if cli_args.config:
+        with open(cli_args.config, "r", encoding="utf-8") as f:
+            file_config = json.load(f)
+        unknown_keys = sorted(set(file_config) - set(HEADLESS_CONFIG_KEYS))
+        if unknown_keys:
+            raise ValueError(f"Chaves desconhecidas em '{cli_args.config}': {', '.join(unknown_keys)}")
+        config.update(file_config)
+    for key in HEADLESS_CONFIG_KEYS:
+        cli_value = getattr(cli_args, key, None)
+        if cli_value is not None:
+            config[key] = cli_value
+    if isinstance(config["models"], str):
+        config["models"] = [config["models"]]
+    config["rag"] = config["rag"] or "none"
+    if config["rag"] not in RAG_TYPE_ALIASES:
+        raise ValueError(f"Tipo de RAG desconhecido: {config['rag']}")
+    config["shard_index"] = config["shard_index"] or 0
+    config["shard_count"] = config["shard_count"] or 1
+    if not 0 <= config["shard_index"] < config["shard_count"]:
+        raise ValueError(f"shard-index {config['shard_index']} fora do intervalo 0..{config['shard_count'] - 1}")
+    return config
+
+
+def is_headless_requested(cli_args):
+    return bool(cli_args.headless or cli_args.config or cli_args.models)
+
+
+def build_headless_run_configuration(config, available_models):
+    """Mesma estrutura que prompt_user_for_run_mode; devolve None se nenhum modelo pedido estiver disponível."""
+    requested = config["models"] or []
+    run_all_models = requested in (["all"], ["*"])
+    if run_all_models:
+        models_to_run = list(available_models)
+    else:
+        missing = [name for name in requested if name not in available_models]
+        if missing:
+            print(f"[HEADLESS WARNING] Modelos não disponíveis no Ollama (ignorados): {', '.join(missing)}")
+        models_to_run = [name for name in requested if name in available_models]
+    if not models_to_run:
+        print("[HEADLESS ERROR] Nenhum modelo para executar (use --models <nome...> ou --models all).")
+        return None
+    rag_type = RAG_TYPE_ALIASES[config["rag"]]
+    return {"models_to_run": models_to_run, "use_rag": rag_type != "none", "rag_type": rag_type, "run_all_models_flag": run_all_models}
+
+
+def shard_of_unit(model_name, doc_name, shard_count):
+    """Shard de uma unidade (modelo, documento): hash estável, igual em todas as máquinas e execuções."""
+    digest = hashlib.sha256(f"{model_name}\n{doc_name}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def files_for_shard(model_name, json_files, shard_index, shard_count):
+    if shard_count <= 1:
+        return list(json_files)
+    return [path for path in json_files if shard_of_unit(model_name, os.path.basename(path), shard_count) == shard_index]
+
+
+def write_shard_summary(output_dir, config, model_document_results, total_duration_seconds):
+    """Guarda o sumário deste shard (resultados por documento e por modelo) para o passo de merge."""
+    summary = {
+        "shard_index": config["shard_index"], "shard_count": config["shard_count"],
+        "host": socket.gethostname(), "finished_at": datetime.datetime.now().isoformat(),
+        "total_duration_seconds": total_duration_seconds,
+        "config": {key: config[key] for key in ("models", "rag", "schema_dir")},
+        "models": {
+            model: [{key: result.get(key) for key in ("doc_name", "status", "llm_duration", "llm_metrics", "resumed")}
+                    for result in document_results]
+            for model, document_results in model_document_results.items()
+        },
+    }
+    path = os.path.join(output_dir, SHARD_SUMMARY_FILENAME_TEMPLATE.format(index=config["shard_index"], count=config["shard_count"]))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"[HEADLESS] Sumário do shard guardado em {path}")
+    return path
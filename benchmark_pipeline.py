@@ -0,0 +1,166 @@
+# benchmark_pipeline.py
+# Benchmark offline do pipeline de mini_doc_analyzer contra o servidor Ollama simulado (mock_ollama_server.py).
+# Mede docs/s, latência por documento (p50/p95) e o tempo de cada etapa, separando o overhead do pipeline do tempo LLM.
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+
+import mini_doc_analyzer as analyzer
+import interaction_logger_mini
+from mock_ollama_server import start_mock_server, add_mock_config_arguments, mock_config_from_args
+from ollama_client import OllamaChatModel
+
+BENCHMARK_STAGES = ("read", "rag_context", "prompt_format", "llm", "logging")
+BENCHMARK_FIELD_TYPES = ("string", "integer", "boolean", "number")
+BENCHMARK_FIELD_NAMES = ("email", "first_name", "last_name", "phone", "address", "birth_date", "ip_address", "user_id",
+                         "order_total", "created_at", "country", "is_active", "device_id", "notes", "status")
+
+
+def generate_synthetic_schemas(output_dir, count, properties_per_schema=20, seed=None):
+    """Cria 'count' JSON Schemas sintéticos em output_dir. Devolve a lista de caminhos (ordenada)."""
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for schema_idx in range(count):
+        properties = {}
+        for prop_idx in range(properties_per_schema):
+            name = f"{rng.choice(BENCHMARK_FIELD_NAMES)}_{prop_idx}"
+            properties[name] = {"type": rng.choice(BENCHMARK_FIELD_TYPES), "description": f"Synthetic field {name} of schema {schema_idx}."}
+        schema = {
+            "$schema": "http://json-schema.org/draft-07/schema#",
+            "title": f"SyntheticSchema{schema_idx:04d}",
+            "type": "object",
+            "properties": properties,
+            "required": sorted(properties)[: max(1, properties_per_schema // 4)],
+        }
+        path = os.path.join(output_dir, f"synthetic_schema_{schema_idx:04d}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+        paths.append(path)
+    return paths
+
+
+def percentile(values, fraction):
+    """Percentil por interpolação linear (values não precisa de estar ordenado)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_benchmark(document_results, wall_seconds):
+    """Agrega os resultados de analyze_single_document (com 'stage_timings') num dicionário de métricas."""
+    latencies = [r["stage_timings"]["total"] for r in document_results if "total" in r["stage_timings"]]
+    stages = {}
+    for stage in BENCHMARK_STAGES:
+        values = [r["stage_timings"][stage] for r in document_results if stage in r["stage_timings"]]
+        stages[stage] = {"total": sum(values), "mean": sum(values) / len(values) if values else None,
+                         "p95": percentile(values, 0.95)}
+    non_llm_seconds = sum(stages[stage]["total"] for stage in BENCHMARK_STAGES if stage != "llm")
+    measured_seconds = non_llm_seconds + stages["llm"]["total"]
+    return {
+        "documents": len(document_results),
+        "successes": sum(1 for r in document_results if r["status"] == "success"),
+        "errors": sum(1 for r in document_results if r["status"] == "error"),
+        "wall_seconds": wall_seconds,
+        "docs_per_second": len(document_results) / wall_seconds if wall_seconds > 0 else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "stages": stages,
+        "pipeline_overhead_fraction": non_llm_seconds / measured_seconds if measured_seconds > 0 else None,
+        "throughput": analyzer.summarize_generation_metrics([r["llm_metrics"] for r in document_results]),
+    }
+
+
+def print_benchmark_report(summary, label=""):
+    fmt = lambda seconds: f"{seconds * 1000:.1f}ms" if seconds is not None else "N/A"
+    print(f"\n=== Benchmark {label}===")
+    print(f"Documentos: {summary['documents']} (sucessos {summary['successes']}, erros {summary['errors']})")
+    print(f"Tempo total: {summary['wall_seconds']:.2f}s | docs/s: {summary['docs_per_second']:.2f}")
+    print(f"Latência por documento: p50 {fmt(summary['latency_p50'])}, p95 {fmt(summary['latency_p95'])}")
+    print("Etapas (média / p95 / total):")
+    for stage, values in summary["stages"].items():
+        print(f"  - {stage:<14} {fmt(values['mean']):>10} / {fmt(values['p95']):>10} / {values['total']:.2f}s")
+    if summary["pipeline_overhead_fraction"] is not None:
+        print(f"Overhead do pipeline (tudo exceto LLM): {100 * summary['pipeline_overhead_fraction']:.1f}%")
+    print(analyzer.format_throughput_summary(summary["throughput"]))
+
+
+def run_benchmark(args):
+    servers_and_urls = [start_mock_server(mock_config_from_args(args)) for _ in range(max(1, args.endpoints))]
+    # O cliente partilhado é criado na primeira chamada: apontá-lo para os servidores simulados antes de qualquer pedido
+    analyzer.OLLAMA_API_BASE_URL = servers_and_urls[0][1]
+    analyzer.OLLAMA_API_BASE_URLS = [base_url for _, base_url in servers_and_urls] if len(servers_and_urls) > 1 else []
+    analyzer.llm_response_cache.enabled = False # Cada pedido tem de chegar ao servidor
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="analyzer_benchmark_")
+    analyzer.SCRIPT_DIR = work_dir # Logs de interação do benchmark ficam fora do projeto
+    json_files = generate_synthetic_schemas(os.path.join(work_dir, "schemas"), args.documents, args.properties, seed=args.seed)
+    logger_module = interaction_logger_mini if args.logger == "file" else analyzer.DummyLogger()
+
+    use_rag = args.rag != "none"
+    llamaindex_index = aux_llm = None
+    if use_rag:
+        llamaindex_index = analyzer.load_llamaindex_index(analyzer.LLAMA_CHROMA_PERSIST_DIR, analyzer.LLAMA_CHROMA_COLLECTION_NAME,
+                                                          analyzer.LLAMA_EMBED_MODEL_NAME)
+        if not llamaindex_index:
+            print("[BENCHMARK] Índice LlamaIndex não disponível; benchmark sem RAG.")
+            use_rag = False
+        aux_llm = OllamaChatModel(analyzer.AUX_LLM_MODEL_NAME, client=analyzer.get_ollama_client(), request_timeout=120.0)
+    user_template = analyzer.load_prompt_template("user_doc_holistic_task_template_WITHRAG_raw.txt" if use_rag else "user_doc_holistic_task_template_NORAG_raw.txt")
+    system_prompt = analyzer.load_prompt_template("system_doc_holistic_assessor_raw.txt")
+    project_context = analyzer.load_prompt_template("project_context_summary.txt") or "Project context: Not available."
+
+    summaries = []
+    try:
+        for model in args.models[: args.run_models]:
+            for repetition in range(args.repetitions):
+                document_results = []
+                start = time.perf_counter()
+                analyzer.run_analysis_for_model(
+                    model, json_files, system_prompt, user_template, project_context,
+                    use_rag, args.rag if use_rag else "none", llamaindex_index, aux_llm,
+                    analyzer.load_prompt_template("system_subquery_generator.txt"),
+                    analyzer.load_prompt_template("user_subquery_generator_template.txt"),
+                    analyzer.load_prompt_template("prompt_answer_subquestion_template.txt"),
+                    logger_module, f"benchmark_{interaction_logger_mini._clean_name_for_folder(model)}", f"Benchmark com {model}",
+                    rag_context_store=None, max_workers=args.workers, document_results_out=document_results,
+                )
+                summary = summarize_benchmark(document_results, time.perf_counter() - start)
+                summary.update({"model": model, "repetition": repetition + 1, "workers": args.workers, "endpoints": len(servers_and_urls)})
+                summaries.append(summary)
+                print_benchmark_report(summary, label=f"{model} (repetição {repetition + 1}, workers {args.workers}) ")
+    finally:
+        logger_module.flush_logs()
+        if len(servers_and_urls) > 1:
+            print(f"[OLLAMA POOL] {analyzer.get_ollama_client().endpoint_stats_summary()}")
+        analyzer.get_ollama_client().close()
+        for server, _ in servers_and_urls:
+            server.shutdown()
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\n[BENCHMARK] Resultados guardados em {args.output_json}")
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline de run_analysis_for_model contra um Ollama simulado.")
+    parser.add_argument("--documents", type=int, default=50, help="Nº de schemas sintéticos.")
+    parser.add_argument("--properties", type=int, default=20, help="Propriedades por schema.")
+    parser.add_argument("--workers", type=int, default=1, help="Documentos analisados em paralelo (max_workers).")
+    parser.add_argument("--endpoints", type=int, default=1, help="Nº de servidores simulados no pool (OLLAMA_ENDPOINTS).")
+    parser.add_argument("--repetitions", type=int, default=1, help="Repetições por modelo.")
+    parser.add_argument("--run-models", type=int, default=1, help="Quantos dos modelos simulados percorrer.")
+    parser.add_argument("--rag", choices=("none", "simple_docs_llamaindex", "multi_step_qa_llamaindex"), default="none",
+                        help="Modo RAG (usa o índice LlamaIndex real; o LLM auxiliar é simulado).")
+    parser.add_argument("--logger", choices=("file", "dummy"), default="file", help="'file' inclui o custo de escrita de logs.")
+    parser.add_argument("--work-dir", default=None, help="Diretório para schemas e logs (por omissão, um diretório temporário).")
+    parser.add_argument("--output-json", default=None, help="Guardar os resultados em JSON.")
+    add_mock_config_arguments(parser)
+    run_benchmark(parser.parse_args())
@@ -1,8 +1,6 @@
 # document_rag_services.py
 import os
 from dotenv import load_dotenv
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
 load_dotenv()
 
@@ -11,12 +9,20 @@ CHROMA_PERSIST_DIRECTORY_SVC = "./chroma_db_docs"
 CHROMA_COLLECTION_NAME_SVC = "document_embeddings_minilm"
 
 # Modelo de Embedding (deve ser o mesmo da indexação)
+# Carregado apenas na primeira utilização (langchain/sentence-transformers demoram vários segundos a importar)
 MODEL_NAME_SVC = "all-MiniLM-L6-v2"
-embedding_function_svc = HuggingFaceEmbeddings(model_name=MODEL_NAME_SVC, model_kwargs={'device': 'cpu'})
+_embedding_function_svc = None
+
+def get_embedding_function_svc():
+    global _embedding_function_svc
+    if _embedding_function_svc is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        _embedding_function_svc = HuggingFaceEmbeddings(model_name=MODEL_NAME_SVC, model_kwargs={'device': 'cpu'})
+    return _embedding_function_svc
 
 class DocumentRAGRetrieverFactory:
     def __init__(self):
-        self.embedding_model = embedding_function_svc
+        self.embedding_model = None
         self.vector_store = None
         self.is_initialized = False
 
@@ -26,6 +32,8 @@ class DocumentRAGRetrieverFactory:
             return
 
         try:
+            from langchain_community.vectorstores import Chroma
+            self.embedding_model = get_embedding_function_svc()
             print(f"[DOC RAG FACTORY INFO] A carregar base vetorial Chroma de: {CHROMA_PERSIST_DIRECTORY_SVC}")
             self.vector_store = Chroma(
                 collection_name=CHROMA_COLLECTION_NAME_SVC,
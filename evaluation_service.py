@@ -0,0 +1,390 @@
+# evaluation_service.py
+# Serviço HTTP (asyncio/aiohttp) de longa duração para pipelines de CI: o índice LlamaIndex, o modelo de embeddings,
+# o LLM auxiliar e os templates ficam carregados entre pedidos, e cada schema submetido é avaliado sem arranque a frio.
+# Pedidos idênticos em curso (mesmo hash do documento, modelo e modo RAG) partilham uma única avaliação;
+# a fila é limitada e, quando está cheia, os pedidos novos são recusados com HTTP 429.
+#
+#   python evaluation_service.py --port 8088 --preload-rag simple
+#   curl --data-binary @schema.json "http://127.0.0.1:8088/evaluate?model=qwen2:0.5b&rag=simple&name=schema.json"
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import functools
+import tempfile
+import itertools
+import collections
+import concurrent.futures
+
+from aiohttp import web
+
+import mini_doc_analyzer as analyzer
+import interaction_logger_mini
+from batch_runner import RAG_TYPE_ALIASES
+from rag_context_store import RagContextStore
+from run_journal import compute_unit_key, compute_prompt_version
+from ollama_client import OllamaChatModel
+
+SERVICE_DEFAULT_HOST = "127.0.0.1"
+SERVICE_DEFAULT_PORT = 8088
+SERVICE_MAX_QUEUE = int(os.getenv("ANALYZER_SERVICE_MAX_QUEUE", "32")) # Avaliações à espera (além das que estão a correr)
+SERVICE_WORKERS = int(os.getenv("ANALYZER_SERVICE_WORKERS", str(analyzer.ANALYSIS_MAX_WORKERS))) # Avaliações em simultâneo
+SERVICE_CONTROL_WORKERS = 2 # Threads para tarefas de controlo (lista de modelos, logs, índice), separadas das avaliações
+SERVICE_MAX_DOCUMENT_BYTES = 20 * 1024 * 1024
+SERVICE_RETRY_AFTER_SECONDS = 5 # Cabeçalho Retry-After das respostas 429
+SERVICE_RECENT_JOBS_KEPT = 256 # Jobs terminados consultáveis em GET /jobs/{job_id}
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+class EvaluationJob:
+    """Uma avaliação (documento, modelo, modo RAG). Os pedidos idênticos subscrevem o mesmo job e recebem os mesmos eventos."""
+
+    _job_ids = itertools.count(1)
+
+    def __init__(self, unit_key, doc_name, doc_sha256, model, rag_type):
+        self.job_id = f"job-{next(self._job_ids)}"
+        self.unit_key = unit_key
+        self.doc_name = doc_name
+        self.doc_sha256 = doc_sha256
+        self.model = model
+        self.rag_type = rag_type
+        self.spool_path = None
+        self.events = [] # Histórico: um subscritor que chega depois recebe os eventos anteriores
+        self.subscribers = set()
+        self.done = asyncio.Event()
+        self.result = None
+        self.requests = 1
+
+    def publish(self, event_type, **fields):
+        event = {"event": event_type, "job_id": self.job_id, "time": time.time(), **fields}
+        self.events.append(event)
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+
+    def subscribe(self):
+        subscriber = asyncio.Queue()
+        for event in self.events:
+            subscriber.put_nowait(event)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def status(self):
+        return {"job_id": self.job_id, "doc_name": self.doc_name, "doc_sha256": self.doc_sha256, "model": self.model,
+                "rag_type": self.rag_type, "requests": self.requests, "last_event": self.events[-1]["event"] if self.events else None,
+                "result": self.result}
+
+
+class EvaluationService:
+    """Estado residente do serviço (templates, índice, LLM auxiliar, logs) e a fila de avaliações."""
+
+    def __init__(self, default_model=None, max_queue=SERVICE_MAX_QUEUE, workers=SERVICE_WORKERS, log_interactions=True,
+                 output_dir=None, spool_dir=None):
+        self.default_model = default_model
+        self.workers = max(1, workers)
+        self.queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self.logger_module = interaction_logger_mini if log_interactions else analyzer.DummyLogger()
+        self.output_dir = output_dir or analyzer.SCRIPT_DIR
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="evaluation_service_")
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="evaluation")
+        # Tarefas curtas de controlo (lista de modelos, logs, carregamento do índice): não ficam na fila atrás das avaliações
+        self.control_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SERVICE_CONTROL_WORKERS, thread_name_prefix="evaluation_control")
+        self.in_flight = {} # unit_key -> EvaluationJob (em fila ou a correr)
+        self.recent_jobs = collections.OrderedDict() # job_id -> EvaluationJob
+        self.counters = collections.Counter()
+        self.available_models = []
+        self.templates = {}
+        self.prompt_versions = {}
+        self.llamaindex_index = None
+        self.aux_llm = None
+        self.rag_context_store = None
+        self._rag_lock = asyncio.Lock()
+        self._log_filepaths = {}
+        self._log_lock = asyncio.Lock()
+        self._worker_tasks = []
+        self.started_at = time.time()
+
+    # --- Arranque e estado residente ---
+    async def start(self, preload_rag_type=None):
+        loop = asyncio.get_running_loop()
+        self.available_models = await loop.run_in_executor(self.control_executor, analyzer.list_ollama_models)
+        if analyzer.schema_ref_resolver is not None: # Versão do espelho (usada em cada submit) calculada fora do event loop
+            await loop.run_in_executor(self.control_executor, analyzer.schema_ref_resolver.version)
+        for template_name in ("system_doc_holistic_assessor_raw.txt", "user_doc_holistic_task_template_NORAG_raw.txt",
+                              "user_doc_holistic_task_template_WITHRAG_raw.txt", "project_context_summary.txt",
+                              "system_subquery_generator.txt", "user_subquery_generator_template.txt", "prompt_answer_subquestion_template.txt"):
+            self.templates[template_name] = analyzer.load_prompt_template(template_name)
+        if not self.templates["system_doc_holistic_assessor_raw.txt"] or not self.templates["user_doc_holistic_task_template_NORAG_raw.txt"]:
+            raise RuntimeError("Ficheiros de prompt base críticos em falta.")
+        self.templates["project_context_summary.txt"] = self.templates["project_context_summary.txt"] or "Project context: Not available."
+        if preload_rag_type and preload_rag_type != "none":
+            await self.ensure_rag_loaded()
+        self._worker_tasks = [asyncio.create_task(self._worker(), name=f"evaluation_worker_{i}") for i in range(self.workers)]
+        analyzer.print_startup_breakdown()
+        print(f"[SERVICE] Pronto: {self.workers} workers, fila máxima {self.queue.maxsize}, {len(self.available_models)} modelos.")
+
+    async def ensure_rag_loaded(self):
+        """Carrega o índice LlamaIndex (e o modelo de embeddings) uma única vez; pedidos concorrentes esperam pelo mesmo carregamento."""
+        async with self._rag_lock:
+            if self.llamaindex_index is None:
+                loop = asyncio.get_running_loop()
+                self.llamaindex_index = await loop.run_in_executor(
+                    self.control_executor, analyzer.load_llamaindex_index,
+                    analyzer.LLAMA_CHROMA_PERSIST_DIR, analyzer.LLAMA_CHROMA_COLLECTION_NAME, analyzer.LLAMA_EMBED_MODEL_NAME)
+                if self.llamaindex_index is not None:
+                    self.aux_llm = OllamaChatModel(analyzer.AUX_LLM_MODEL_NAME, client=analyzer.get_ollama_client(), request_timeout=120.0)
+                    self.rag_context_store = RagContextStore(analyzer.SCRIPT_DIR, persist_to_disk=analyzer.RAG_CONTEXT_STORE_PERSIST,
+                                                             max_bytes=analyzer.RAG_CONTEXT_STORE_MAX_BYTES,
+                                                             max_entries=analyzer.RAG_CONTEXT_STORE_MAX_ENTRIES)
+            return self.llamaindex_index is not None
+
+    def analysis_settings(self, rag_type):
+        """Argumentos de analyze_single_document para o modo RAG (iguais aos de main para o mesmo modo)."""
+        use_rag = rag_type != "none"
+        multi_step = rag_type == "multi_step_qa_llamaindex"
+        settings = {
+            "system_prompt_base": self.templates["system_doc_holistic_assessor_raw.txt"],
+            "user_template_base": self.templates["user_doc_holistic_task_template_WITHRAG_raw.txt" if use_rag else "user_doc_holistic_task_template_NORAG_raw.txt"],
+            "project_context": self.templates["project_context_summary.txt"],
+            "use_rag_flag": use_rag, "rag_type": rag_type,
+            "llamaindex_index": self.llamaindex_index if use_rag else None,
+            "aux_llm_llamaindex": self.aux_llm if use_rag else None,
+            "system_subquery_gen_prompt": self.templates["system_subquery_generator.txt"] if multi_step else None,
+            "user_subquery_gen_template": self.templates["user_subquery_generator_template.txt"] if multi_step else None,
+            "prompt_answer_subquestion_text": self.templates["prompt_answer_subquestion_template.txt"] if multi_step else None,
+            "rag_context_store": self.rag_context_store if use_rag else None,
+        }
+        return settings
+
+    def prompt_version(self, rag_type):
+        if rag_type not in self.prompt_versions:
+            settings = self.analysis_settings(rag_type)
+            self.prompt_versions[rag_type] = compute_prompt_version(
+                settings["system_prompt_base"], settings["user_template_base"], settings["project_context"],
+                settings["system_subquery_gen_prompt"], settings["user_subquery_gen_template"], settings["prompt_answer_subquestion_text"],
+                analyzer.AUX_LLM_MODEL_NAME, analyzer.JSON_PROMPT_MODE, analyzer.JSON_PROMPT_BUDGET_CHARS,
+                analyzer.TOKEN_BUDGET_ENABLED, analyzer.TOKEN_BUDGET_NUM_CTX, analyzer.ASSESSMENT_MODE, analyzer.ASSESSMENT_THINK)
+        # O índice pode ser reindexado com o serviço em execução: a versão do índice não fica em cache
+        return compute_prompt_version(self.prompt_versions[rag_type], *analyzer.analysis_environment_version_parts(rag_type != "none"))
+
+    async def log_filepath(self, model, rag_type):
+        """Um ficheiro de log de interações por (modelo, modo RAG), criado no primeiro pedido."""
+        async with self._log_lock:
+            if (model, rag_type) not in self._log_filepaths:
+                loop = asyncio.get_running_loop()
+                self._log_filepaths[(model, rag_type)] = await loop.run_in_executor(
+                    self.control_executor, self.logger_module.initialize_logger, model, f"service_{rag_type}", self.output_dir)
+            return self._log_filepaths[(model, rag_type)]
+
+    async def is_model_available(self, model):
+        """Modelo conhecido pelo Ollama; um modelo desconhecido faz reler a lista (pode ter sido descarregado depois do arranque)."""
+        if model not in self.available_models:
+            loop = asyncio.get_running_loop()
+            self.available_models = await loop.run_in_executor(self.control_executor, analyzer.list_ollama_models)
+        return model in self.available_models
+
+    # --- Submissão (coalescência e admissão) ---
+    def submit(self, content_bytes, doc_name, model, rag_type):
+        """Devolve (job, coalescido). Lança asyncio.QueueFull se a fila estiver cheia."""
+        doc_sha256 = hashlib.sha256(content_bytes).hexdigest()
+        # O nome do documento entra nos prompts: só pedidos com o mesmo conteúdo e nome partilham a avaliação
+        unit_key = compute_unit_key(model, f"{doc_name}\n{doc_sha256}", rag_type, self.prompt_version(rag_type))
+        self.counters["requests"] += 1
+        job = self.in_flight.get(unit_key)
+        if job is not None:
+            job.requests += 1
+            self.counters["coalesced"] += 1
+            return job, True
+        if self.queue.full():
+            self.counters["rejected"] += 1
+            raise asyncio.QueueFull()
+        job = EvaluationJob(unit_key, doc_name, doc_sha256, model, rag_type)
+        job_dir = os.path.join(self.spool_dir, job.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        job.spool_path = os.path.join(job_dir, doc_name) # O nome do documento entra nos prompts
+        with open(job.spool_path, "wb") as f:
+            f.write(content_bytes)
+        self.queue.put_nowait(job)
+        self.in_flight[unit_key] = job
+        self.counters["accepted"] += 1
+        job.publish("queued", position=self.queue.qsize(), doc_name=doc_name, model=model, rag_type=rag_type)
+        return job, False
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run_job(job, loop)
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job, loop):
+        job.publish("started")
+        try:
+            if job.rag_type != "none" and not await self.ensure_rag_loaded():
+                raise RuntimeError("Índice LlamaIndex não disponível para RAG.")
+            log_filepath = await self.log_filepath(job.model, job.rag_type)
+            on_progress = lambda doc_name, stage, seconds: loop.call_soon_threadsafe(functools.partial(job.publish, "stage", stage=stage, seconds=seconds))
+            document_result = await loop.run_in_executor(
+                self.executor, lambda: analyzer.analyze_single_document(
+                    1, 1, job.spool_path, job.model, logger_module=self.logger_module,
+                    current_analysis_description=f"Serviço de avaliação ({job.rag_type})", log_filepath=log_filepath,
+                    progress_callback=on_progress, **self.analysis_settings(job.rag_type)))
+            job.result = {key: document_result.get(key) for key in ("doc_name", "status", "assessment", "llm_duration", "llm_metrics", "stage_timings", "token_report")}
+            if analyzer.ASSESSMENT_MODE == "structured" and document_result["status"] == "success":
+                try:
+                    job.result["assessment_json"] = json.loads(document_result["assessment"])
+                except ValueError as e_json:
+                    job.result.update(status="warning", assessment_json=None)
+                    print(f"[SERVICE WARNING] Avaliação de '{job.doc_name}' não é JSON válido: {e_json}")
+        except Exception as e:
+            print(f"[SERVICE ERROR] Falha na avaliação de '{job.doc_name}' com '{job.model}': {e}")
+            job.result = {"doc_name": job.doc_name, "status": "error", "error": str(e)}
+        finally:
+            self.counters[f"status_{job.result['status'] if job.result else 'error'}"] += 1
+            job.publish("result", result=job.result, requests=job.requests)
+            job.done.set()
+            self.in_flight.pop(job.unit_key, None)
+            self.recent_jobs[job.job_id] = job
+            while len(self.recent_jobs) > SERVICE_RECENT_JOBS_KEPT:
+                self.recent_jobs.popitem(last=False)
+            try:
+                os.remove(job.spool_path)
+                os.rmdir(os.path.dirname(job.spool_path))
+            except OSError:
+                pass
+
+    def find_job(self, job_id):
+        return self.recent_jobs.get(job_id) or next((job for job in self.in_flight.values() if job.job_id == job_id), None)
+
+    def health(self):
+        return {
+            "status": "ok", "uptime_seconds": time.time() - self.started_at,
+            "queue_depth": self.queue.qsize(), "queue_capacity": self.queue.maxsize,
+            "in_flight": len(self.in_flight), "workers": self.workers,
+            "index_loaded": self.llamaindex_index is not None, "models": self.available_models,
+        }
+
+    def stats(self):
+        return {**self.health(), "counters": dict(self.counters), "llm_cache": analyzer.llm_response_cache.stats_summary(),
+                "ollama_endpoints": analyzer.get_ollama_client().endpoint_stats_summary(),
+                "rag_context_store": self.rag_context_store.stats_summary() if self.rag_context_store else None,
+                "retrieval_cache": analyzer.retrieval_cache.stats_summary() if self.llamaindex_index is not None else None,
+                "semantic_answer_cache": analyzer.subquestion_answer_cache.stats_summary() if self.llamaindex_index is not None else None}
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.control_executor.shutdown(wait=False, cancel_futures=True)
+        self.logger_module.flush_logs()
+        analyzer.subquestion_answer_cache.save()
+        analyzer.get_ollama_client().close()
+
+
+# --- Rotas HTTP ---
+def clean_document_name(name):
+    name = os.path.basename(name or "").strip() or "document.json"
+    name = re.sub(r"[^\w.\-]", "_", name)
+    return name if name.lower().endswith(".json") else name + ".json"
+
+
+async def handle_evaluate(request):
+    """
+    POST /evaluate?model=...&rag=none|simple|multi_step&name=...&stream=1 com o schema JSON no corpo.
+    stream=1 (por omissão): eventos NDJSON (queued, started, stage, result); stream=0: só o resultado final em JSON.
+    """
+    service = request.app["service"]
+    model = request.query.get("model") or service.default_model
+    rag = request.query.get("rag", "none")
+    if not model:
+        return web.json_response({"error": "Parâmetro 'model' em falta."}, status=400)
+    if not await service.is_model_available(model):
+        return web.json_response({"error": f"Modelo não disponível no Ollama: {model}", "models": service.available_models}, status=400)
+    if rag not in RAG_TYPE_ALIASES:
+        return web.json_response({"error": f"Modo RAG desconhecido: {rag} (use {', '.join(sorted(RAG_TYPE_ALIASES))})."}, status=400)
+    content_bytes = await request.read()
+    try:
+        json.loads(content_bytes)
+    except ValueError as e:
+        return web.json_response({"error": f"O corpo não é JSON válido: {e}"}, status=400)
+    try:
+        job, coalesced = service.submit(content_bytes, clean_document_name(request.query.get("name")), model, RAG_TYPE_ALIASES[rag])
+    except asyncio.QueueFull:
+        return web.json_response({"error": "Fila de avaliações cheia; tente mais tarde."}, status=429,
+                                 headers={"Retry-After": str(SERVICE_RETRY_AFTER_SECONDS)})
+
+    if request.query.get("stream", "1") in ("0", "false", "no"):
+        await job.done.wait()
+        return web.json_response({"job_id": job.job_id, "coalesced": coalesced, **job.result})
+
+    response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE, "X-Job-Id": job.job_id, "X-Coalesced": str(coalesced).lower()})
+    await response.prepare(request)
+    subscriber = job.subscribe()
+    try:
+        while True:
+            event = await subscriber.get()
+            await response.write((json.dumps({**event, "coalesced": coalesced}, ensure_ascii=False) + "\n").encode("utf-8"))
+            if event["event"] == "result":
+                break
+    except ConnectionResetError:
+        pass # O cliente desligou-se: a avaliação continua para os restantes subscritores
+    finally:
+        job.subscribers.discard(subscriber)
+    await response.write_eof()
+    return response
+
+
+async def handle_job(request):
+    job = request.app["service"].find_job(request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Job desconhecido ou já esquecido."}, status=404)
+    return web.json_response(job.status())
+
+
+async def handle_health(request):
+    return web.json_response(request.app["service"].health())
+
+
+async def handle_stats(request):
+    return web.json_response(request.app["service"].stats())
+
+
+def create_app(service, preload_rag_type=None):
+    app = web.Application(client_max_size=SERVICE_MAX_DOCUMENT_BYTES)
+    app["service"] = service
+    app.router.add_post("/evaluate", handle_evaluate)
+    app.router.add_get("/jobs/{job_id}", handle_job)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/stats", handle_stats)
+
+    async def on_startup(app):
+        await service.start(preload_rag_type)
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP de avaliação de schemas (índice e templates residentes).")
+    parser.add_argument("--host", default=SERVICE_DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_DEFAULT_PORT)
+    parser.add_argument("--model", default=None, help="Modelo usado quando o pedido não indica 'model'.")
+    parser.add_argument("--preload-rag", choices=sorted(RAG_TYPE_ALIASES), default="none",
+                        help="Carregar o índice LlamaIndex no arranque (por omissão, só no primeiro pedido com RAG).")
+    parser.add_argument("--max-queue", type=int, default=SERVICE_MAX_QUEUE, help="Avaliações em espera antes de responder 429.")
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Avaliações em simultâneo.")
+    parser.add_argument("--output-dir", default=None, help="Base dos logs de interação (por omissão, a pasta do projeto).")
+    parser.add_argument("--no-log", action="store_true", help="Não escrever logs de interação.")
+    cli_args = parser.parse_args()
+    evaluation_service = EvaluationService(cli_args.model, cli_args.max_queue, cli_args.workers,
+                                           log_interactions=not cli_args.no_log, output_dir=cli_args.output_dir)
+    web.run_app(create_app(evaluation_service, cli_args.preload_rag), host=cli_args.host, port=cli_args.port)
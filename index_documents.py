@@ -1,12 +1,17 @@
 # index_documents.py
 import os
 import json
+import time
+import concurrent.futures
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, JSONLoader, UnstructuredHTMLLoader # , UnstructuredFileLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 
+from mmap_vector_index import export_mmap_vector_index, default_export_dtype, MMAP_INDEX_DIR_NAME
+from index_manifest import compute_index_version
+
 load_dotenv()
 
 # Configurações
@@ -14,78 +19,159 @@ DOCUMENTS_PATH = "./document"  # <<< CRIE ESTA PASTA E COLOQUE SEUS PDFS, TXTS,
 CHROMA_PERSIST_DIRECTORY = "./chroma_db_docs"
 CHROMA_COLLECTION_NAME = "document_embeddings_minilm"
 
-# Modelo de Embedding
+# Modelo de Embedding (carregado apenas quando é preciso embutir; os processos de parsing não o carregam)
 MODEL_NAME = "all-MiniLM-L6-v2"
-embedding_function = HuggingFaceEmbeddings(model_name=MODEL_NAME, model_kwargs={'device': 'cpu'})
-print(f"Usando Sentence Transformer: {MODEL_NAME}")
+_embedding_function = None
+
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        _embedding_function = HuggingFaceEmbeddings(model_name=MODEL_NAME, model_kwargs={'device': 'cpu'})
+        print(f"Usando Sentence Transformer: {MODEL_NAME}")
+    return _embedding_function
 
 # Text Splitter
 # Ajuste chunk_size e chunk_overlap conforme necessário para os seus documentos
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 
-def load_and_split_documents(docs_path):
+# Parsing em paralelo (PyPDFLoader/UnstructuredHTMLLoader são CPU-bound e single-threaded)
+LOADING_MAX_PROCESSES = int(os.getenv("INDEXING_MAX_PROCESSES", "0")) or (os.cpu_count() or 1)
+
+# Exportação só de leitura (mmap_vector_index.py) depois da indexação: vetores float16/float32 e, opcionalmente,
+# códigos int8 ou de 1 bit para a 1ª passagem da pesquisa ('none', 'int8', 'binary')
+MMAP_EXPORT_ENABLED = os.getenv("INDEXING_MMAP_EXPORT", "1") == "1"
+MMAP_EXPORT_QUANTIZATION = os.getenv("INDEXING_MMAP_QUANTIZATION", "none")
+MMAP_EXPORT_DTYPE = os.getenv("INDEXING_MMAP_DTYPE") or default_export_dtype(MMAP_EXPORT_QUANTIZATION) # float32 com quantização
+
+SUPPORTED_EXTENSIONS = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+    ".json": JSONLoader,
+    ".html": UnstructuredHTMLLoader, # <<< LOADER PARA HTML
+    ".htm": UnstructuredHTMLLoader, 
+}
+
+def load_and_split_single_file(filepath):
+    """
+    Carrega e divide um único ficheiro (executado num processo do pool).
+    Nunca lança exceções: retorna um dicionário com 'filename', 'chunks', 'num_documents', 'duration' e 'error'.
+    """
+    filename = os.path.basename(filepath)
+    ext = os.path.splitext(filename)[1].lower()
+    start_time = time.perf_counter()
+    result = {"filename": filename, "chunks": [], "num_documents": 0, "duration": 0.0, "error": None}
+    try:
+        if ext == ".json":
+            # JSONLoader requer um jq_schema. Para um carregamento genérico de todo o texto:
+            # Pode ser mais simples tratar JSON como texto ou usar uma estratégia específica
+            # Aqui, vamos tentar carregar o conteúdo principal como texto.
+            # Exemplo de jq_schema para extrair todo o conteúdo textual: '.[] | select(type=="string")'
+            # Ou, para extrair tudo: '.' que retorna o JSON inteiro como string (pode precisar de split depois)
+            # A abordagem mais simples para JSON é lê-lo e convertê-lo para string, depois passar para TextSplitter
+            # loader = JSONLoader(file_path=filepath, jq_schema='.', text_content=False) # Carrega metadados
+            # documents = loader.load()
+            # Se quiser todo o conteúdo do JSON como texto para embedding:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                try:
+                    data = json.load(f)
+                    text_content = json.dumps(data, ensure_ascii=False, indent=2) # Converte todo o JSON em string formatada
+                    # Criar um Documento LangChain manualmente
+                    from langchain_core.documents import Document
+                    documents = [Document(page_content=text_content, metadata={"source": filename, "type": "json"})]
+                except json.JSONDecodeError:
+                    print(f"    Aviso: Falha ao fazer parse do JSON {filename}. A tentar como TXT.")
+                    loader = TextLoader(filepath, encoding='utf-8')
+                    documents = loader.load()
+
+        else: # PDF, TXT
+            loader_class = SUPPORTED_EXTENSIONS[ext]
+            loader = loader_class(filepath)
+            documents = loader.load()
+
+        if documents:
+            chunks = text_splitter.split_documents(documents)
+            # Adicionar metadados úteis a cada chunk
+            for i, chunk in enumerate(chunks):
+                chunk.metadata["source_filename"] = filename
+                chunk.metadata["chunk_index"] = i
+                chunk.metadata["document_type"] = ext.replace('.', '')
+            result["chunks"] = chunks
+            result["num_documents"] = len(documents)
+    except Exception as e:
+        result["error"] = str(e)
+    result["duration"] = time.perf_counter() - start_time
+    return result
+
+def _report_file_result(file_result):
+    if file_result["error"]:
+        print(f"  ERRO ao processar {file_result['filename']}: {file_result['error']} ({file_result['duration']:.2f}s)")
+    elif file_result["chunks"]:
+        print(f"  {file_result['filename']}: {file_result['num_documents']} documento(s) carregados, divididos em {len(file_result['chunks'])} chunks ({file_result['duration']:.2f}s).")
+    else:
+        print(f"  {file_result['filename']}: nenhum conteúdo carregado ({file_result['duration']:.2f}s).")
+
+def load_and_split_documents(docs_path, max_processes=None):
+    """
+    Carrega e divide os documentos num pool de processos. Os chunks são acrescentados pela ordem (estável)
+    dos nomes dos ficheiros; um erro num ficheiro não afeta os restantes. Se um processo terminar abruptamente,
+    os ficheiros que ficaram sem resultado são reprocessados um a um, para identificar o que provoca o crash.
+    """
     all_docs_chunks = []
-    supported_extensions = {
-        ".pdf": PyPDFLoader,
-        ".txt": TextLoader,
-        ".json": JSONLoader,
-        ".html": UnstructuredHTMLLoader, # <<< LOADER PARA HTML
-        ".htm": UnstructuredHTMLLoader, 
-    }
     print(f"A carregar documentos de: {docs_path}")
     if not os.path.exists(docs_path):
         print(f"ERRO: Diretório de documentos '{docs_path}' não encontrado.")
         return []
 
-    for filename in os.listdir(docs_path):
+    filepaths_to_process = []
+    for filename in sorted(os.listdir(docs_path)):
         filepath = os.path.join(docs_path, filename)
         if os.path.isfile(filepath):
             ext = os.path.splitext(filename)[1].lower()
-            if ext in supported_extensions:
-                print(f"  A processar: {filename}")
-                try:
-                    if ext == ".json":
-                        # JSONLoader requer um jq_schema. Para um carregamento genérico de todo o texto:
-                        # Pode ser mais simples tratar JSON como texto ou usar uma estratégia específica
-                        # Aqui, vamos tentar carregar o conteúdo principal como texto.
-                        # Exemplo de jq_schema para extrair todo o conteúdo textual: '.[] | select(type=="string")'
-                        # Ou, para extrair tudo: '.' que retorna o JSON inteiro como string (pode precisar de split depois)
-                        # A abordagem mais simples para JSON é lê-lo e convertê-lo para string, depois passar para TextSplitter
-                        # loader = JSONLoader(file_path=filepath, jq_schema='.', text_content=False) # Carrega metadados
-                        # documents = loader.load()
-                        # Se quiser todo o conteúdo do JSON como texto para embedding:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            try:
-                                data = json.load(f)
-                                text_content = json.dumps(data, ensure_ascii=False, indent=2) # Converte todo o JSON em string formatada
-                                # Criar um Documento LangChain manualmente
-                                from langchain_core.documents import Document
-                                documents = [Document(page_content=text_content, metadata={"source": filename, "type": "json"})]
-                            except json.JSONDecodeError:
-                                print(f"    Aviso: Falha ao fazer parse do JSON {filename}. A tentar como TXT.")
-                                loader = TextLoader(filepath, encoding='utf-8')
-                                documents = loader.load()
-
-                    else: # PDF, TXT
-                        loader_class = supported_extensions[ext]
-                        loader = loader_class(filepath)
-                        documents = loader.load()
-
-                    if documents:
-                        chunks = text_splitter.split_documents(documents)
-                        # Adicionar metadados úteis a cada chunk
-                        for i, chunk in enumerate(chunks):
-                            chunk.metadata["source_filename"] = filename
-                            chunk.metadata["chunk_index"] = i
-                            chunk.metadata["document_type"] = ext.replace('.', '')
-                        all_docs_chunks.extend(chunks)
-                        print(f"    {len(documents)} documento(s) carregados, divididos em {len(chunks)} chunks.")
-                except Exception as e:
-                    print(f"    ERRO ao processar {filename}: {e}")
+            if ext in SUPPORTED_EXTENSIONS:
+                filepaths_to_process.append(filepath)
             else:
                 print(f"  A ignorar ficheiro com extensão não suportada: {filename}")
 
-    print(f"\nTotal de chunks gerados de todos os documentos: {len(all_docs_chunks)}")
+    loading_start_time = time.perf_counter()
+    workers = max(1, min(max_processes or LOADING_MAX_PROCESSES, len(filepaths_to_process)))
+    print(f"A processar {len(filepaths_to_process)} ficheiro(s) com {workers} processo(s)...")
+    results_by_path = {}
+    crashed_pool_files = []
+    if filepaths_to_process:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(filepath, executor.submit(load_and_split_single_file, filepath)) for filepath in filepaths_to_process]
+            for filepath, future in futures:
+                try:
+                    results_by_path[filepath] = future.result()
+                except concurrent.futures.BrokenExecutor:
+                    # Um processo terminou abruptamente (ex: crash do parser): todos os ficheiros ainda por
+                    # recolher falham com o pool, não apenas o culpado. São reprocessados um a um abaixo.
+                    crashed_pool_files.append(filepath)
+                    continue
+                _report_file_result(results_by_path[filepath])
+    if crashed_pool_files:
+        print(f"  O pool de processos terminou abruptamente: a reprocessar {len(crashed_pool_files)} ficheiro(s) isoladamente...")
+    for filepath in crashed_pool_files:
+        # Um processo por ficheiro: se voltar a terminar abruptamente, o culpado é este ficheiro
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                file_result = executor.submit(load_and_split_single_file, filepath).result()
+            except concurrent.futures.BrokenExecutor as e_pool:
+                file_result = {"filename": os.path.basename(filepath), "chunks": [], "num_documents": 0,
+                               "duration": 0.0, "error": f"Processo de parsing terminou abruptamente ({e_pool})"}
+        results_by_path[filepath] = file_result
+        _report_file_result(file_result)
+
+    failed_files = []
+    for filepath in filepaths_to_process:
+        file_result = results_by_path[filepath]
+        if file_result["error"]:
+            failed_files.append(file_result["filename"])
+        all_docs_chunks.extend(file_result["chunks"])
+
+    print(f"\nTotal de chunks gerados de todos os documentos: {len(all_docs_chunks)} (carregamento: {time.perf_counter() - loading_start_time:.2f}s)")
+    if failed_files:
+        print(f"Ficheiros com erro ({len(failed_files)}): {', '.join(failed_files)}")
     return all_docs_chunks
 
 
@@ -102,7 +188,7 @@ def build_vector_store(documents_chunks):
     # e para verificar a compatibilidade se a coleção já existir.
     vector_db = Chroma.from_documents(
         documents=documents_chunks,
-        embedding=embedding_function,
+        embedding=get_embedding_function(),
         collection_name=CHROMA_COLLECTION_NAME,
         persist_directory=CHROMA_PERSIST_DIRECTORY
     )
@@ -111,6 +197,18 @@ def build_vector_store(documents_chunks):
     print(f"Total de itens na coleção '{CHROMA_COLLECTION_NAME}': {vector_db._collection.count()}")
     return vector_db
 
+def export_mmap_index(vector_db):
+    """Exporta a coleção para CHROMA_PERSIST_DIRECTORY/mmap_index (ver mmap_vector_index.py)."""
+    mmap_dir = os.path.join(CHROMA_PERSIST_DIRECTORY, MMAP_INDEX_DIR_NAME)
+    try:
+        collection = vector_db._collection
+        manifest = export_mmap_vector_index(collection, mmap_dir, dtype=MMAP_EXPORT_DTYPE,
+                                            index_version=compute_index_version(CHROMA_PERSIST_DIRECTORY, collection.count()),
+                                            embed_model_name=MODEL_NAME, quantization=MMAP_EXPORT_QUANTIZATION)
+        print(f"Índice mmap exportado para '{mmap_dir}': {manifest['count']} chunks, {manifest['dtype']}, quantização {manifest['quantization']}.")
+    except Exception as e:
+        print(f"Aviso: falha ao exportar o índice mmap: {e}")
+
 if __name__ == "__main__":
     # 1. Criar a pasta DOCUMENTS_PATH se não existir
     if not os.path.exists(DOCUMENTS_PATH):
@@ -125,6 +223,8 @@ if __name__ == "__main__":
             # 3. Construir a base de dados vetorial
             db = build_vector_store(chunks)
             if db:
+                if MMAP_EXPORT_ENABLED:
+                    export_mmap_index(db)
                 print("\nIndexação concluída.")
                 print("Para testar a busca (exemplo):")
                 # test_query = "qual é o princípio da limitação das finalidades?"
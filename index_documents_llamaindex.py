@@ -3,6 +3,9 @@ import os
 import json
 import logging
 import sys
+import hashlib
+import argparse
+import datetime
 
 # Configurar logging básico para LlamaIndex (opcional, mas útil)
 # logging.basicConfig(stream=sys.stdout, level=logging.INFO) # INFO ou DEBUG
@@ -14,6 +17,9 @@ from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb # Necessário para criar o cliente Chroma
 
+from mmap_vector_index import export_mmap_vector_index, default_export_dtype, MMAP_INDEX_DIR_NAME, MMAP_INDEX_DTYPES, MMAP_INDEX_QUANTIZATIONS
+from index_manifest import load_index_manifest, save_index_manifest, compute_index_version
+
 # Configurações
 DOCUMENTS_PATH_LLAMA = "./document"  # Use a mesma pasta de documentos
 LLAMA_CHROMA_PERSIST_DIR = "./llamaindex_chroma_db_docs" # NOVO diretório
@@ -26,7 +32,46 @@ LLAMA_EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2" # Nome complet
 LLAMA_CHUNK_SIZE = 1000
 LLAMA_CHUNK_OVERLAP = 150
 
-def create_llamaindex_vector_store():
+# Indexação incremental: manifest (index_manifest.py) com o hash de cada ficheiro e os IDs (determinísticos) dos seus nós
+LLAMA_SUPPORTED_EXTS = [".pdf", ".txt", ".json", ".html", ".htm", ".md"]
+
+
+def compute_file_sha256(filepath, block_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def make_node_id(relative_path, file_sha256, node_position):
+    """ID determinístico de um nó: mesmo ficheiro, mesmo conteúdo e mesma posição => mesmo ID."""
+    path_hash = hashlib.sha256(relative_path.encode("utf-8")).hexdigest()[:12]
+    return f"{path_hash}-{file_sha256[:12]}-{node_position:05d}"
+
+
+def scan_document_files(docs_path):
+    """Devolve {caminho_relativo: caminho_absoluto} dos ficheiros suportados (recursivo, ordem estável)."""
+    found = {}
+    for root, _dirs, files in os.walk(docs_path):
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in LLAMA_SUPPORTED_EXTS:
+                full_path = os.path.join(root, filename)
+                found[os.path.relpath(full_path, docs_path).replace("\\", "/")] = full_path
+    return dict(sorted(found.items()))
+
+
+def _manifest_settings():
+    return {"embed_model": LLAMA_EMBED_MODEL_NAME, "chunk_size": LLAMA_CHUNK_SIZE,
+            "chunk_overlap": LLAMA_CHUNK_OVERLAP, "collection": LLAMA_CHROMA_COLLECTION_NAME}
+
+
+def create_llamaindex_vector_store(full_reindex=False):
+    """
+    Indexa incrementalmente DOCUMENTS_PATH_LLAMA: só os ficheiros novos ou alterados são carregados e embutidos.
+    Retorna um dicionário com 'index' (VectorStoreIndex, ou None se nada foi embutido) e as listas
+    'added', 'modified', 'removed' e 'unchanged'; retorna None em caso de erro.
+    """
     print(f"[LlamaIndex INFO] Iniciando processo de indexação de documentos de: {DOCUMENTS_PATH_LLAMA}")
 
     if not os.path.exists(DOCUMENTS_PATH_LLAMA):
@@ -35,35 +80,101 @@ def create_llamaindex_vector_store():
         print("  Adicione os seus ficheiros PDF, TXT, JSON, HTML lá e execute este script novamente.")
         return None
 
-    # 1. Carregar Documentos
+    # 1. Configurar ChromaDB como VectorStore
+    print(f"[LlamaIndex INFO] A configurar ChromaDB em: {LLAMA_CHROMA_PERSIST_DIR}, coleção: {LLAMA_CHROMA_COLLECTION_NAME}")
+    if not os.path.exists(LLAMA_CHROMA_PERSIST_DIR):
+        os.makedirs(LLAMA_CHROMA_PERSIST_DIR)
+
+    try:
+        chroma_client = chromadb.PersistentClient(path=LLAMA_CHROMA_PERSIST_DIR)
+        chroma_collection = chroma_client.get_or_create_collection(LLAMA_CHROMA_COLLECTION_NAME)
+    except Exception as e:
+        print(f"[LlamaIndex ERROR] Erro ao configurar ChromaVectorStore: {e}")
+        return None
+
+    # 2. Comparar os ficheiros atuais com o manifest da última indexação
+    manifest = None if full_reindex else load_index_manifest(LLAMA_CHROMA_PERSIST_DIR)
+    if manifest and manifest.get("settings") != _manifest_settings():
+        print("[LlamaIndex INFO] Modelo de embedding ou parâmetros de chunking alterados. Reindexação completa.")
+        manifest = None
+    if manifest is None and chroma_collection.count() > 0:
+        # Sem manifest não é possível saber a que ficheiro pertence cada embedding (execuções antigas usavam IDs
+        # aleatórios e duplicavam embeddings): recriar a coleção.
+        print(f"[LlamaIndex INFO] Coleção sem manifest válido ({chroma_collection.count()} embeddings). A recriar a coleção.")
+        chroma_client.delete_collection(LLAMA_CHROMA_COLLECTION_NAME)
+        chroma_collection = chroma_client.get_or_create_collection(LLAMA_CHROMA_COLLECTION_NAME)
+    previous_files = (manifest or {}).get("files", {})
+
+    current_files = scan_document_files(DOCUMENTS_PATH_LLAMA)
+    current_hashes = {rel_path: compute_file_sha256(full_path) for rel_path, full_path in current_files.items()}
+
+    unchanged = [p for p, h in current_hashes.items() if p in previous_files and previous_files[p].get("sha256") == h]
+    modified = [p for p, h in current_hashes.items() if p in previous_files and previous_files[p].get("sha256") != h]
+    added = [p for p in current_hashes if p not in previous_files]
+    removed = [p for p in previous_files if p not in current_hashes]
+
+    print(f"[LlamaIndex INFO] Ficheiros: {len(added)} novos, {len(modified)} alterados, {len(removed)} removidos, {len(unchanged)} inalterados (ignorados).")
+    for rel_path in unchanged: print(f"  = Ignorado (inalterado): {rel_path}")
+    for rel_path in removed: print(f"  - Removido: {rel_path}")
+    for rel_path in modified: print(f"  ~ Alterado: {rel_path}")
+    for rel_path in added: print(f"  + Novo: {rel_path}")
+
+    # 3. Nós dos ficheiros removidos ou alterados: só são apagados depois de os novos estarem inseridos (antes de
+    # guardar o manifest), para que uma falha a meio deixe a coleção e o manifest anteriores intactos
+    stale_node_ids = [node_id for rel_path in removed + modified for node_id in previous_files[rel_path].get("node_ids", [])]
+    def commit_index_update():
+        new_node_ids = {node_id for entry in files_entries.values() for node_id in entry["node_ids"]}
+        obsolete_node_ids = [node_id for node_id in stale_node_ids if node_id not in new_node_ids]
+        if obsolete_node_ids:
+            chroma_collection.delete(ids=obsolete_node_ids)
+            print(f"[LlamaIndex INFO] {len(obsolete_node_ids)} embeddings obsoletos apagados.")
+        save_index_manifest(LLAMA_CHROMA_PERSIST_DIR, files_entries, _manifest_settings())
+
+    files_entries = {rel_path: previous_files[rel_path] for rel_path in unchanged}
+    to_index = sorted(added + modified)
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    report = {"index": None, "added": added, "modified": modified, "removed": removed, "unchanged": unchanged,
+              "chroma_collection": chroma_collection}
+
+    if not to_index:
+        # Nada para embutir: o modelo de embedding nem chega a ser carregado
+        commit_index_update()
+        print(f"[LlamaIndex INFO] Nada para (re)indexar. Coleção '{LLAMA_CHROMA_COLLECTION_NAME}' tem {chroma_collection.count()} embeddings.")
+        return report
+
+    indexed_at = datetime.datetime.now().isoformat()
+    for rel_path in to_index: # Também regista ficheiros sem nós (ex: vazios) para não serem reprocessados
+        files_entries[rel_path] = {"sha256": current_hashes[rel_path], "node_ids": [], "indexed_at": indexed_at}
+
+    # 4. Carregar apenas os documentos novos/alterados
     # SimpleDirectoryReader pode precisar de dependências extras para certos tipos de ficheiros (ex: pypdf para PDFs)
-    # Verifique a documentação do LlamaIndex para 'file_extractor' se tiver tipos de ficheiros complexos
-    # ou quiser um parsing de JSON mais específico.
     # Para JSON, o SimpleDirectoryReader por defeito trata-o como texto.
     # Para HTML, ele também deve extrair o texto principal.
     try:
-        print(f"[LlamaIndex INFO] A carregar documentos de '{DOCUMENTS_PATH_LLAMA}'...")
-        # Configurar file_metadata para obter o nome do ficheiro
+        print(f"[LlamaIndex INFO] A carregar {len(to_index)} documento(s) de '{DOCUMENTS_PATH_LLAMA}'...")
+        full_path_to_rel = {os.path.abspath(current_files[p]): p for p in to_index}
+        # Configurar file_metadata para obter o nome do ficheiro (e o caminho relativo, para agrupar os nós)
         def filename_fn(filename_path):
             return {"source_filename": os.path.basename(filename_path),
+                    "source_path": full_path_to_rel.get(os.path.abspath(filename_path), os.path.basename(filename_path)),
                     "document_type": os.path.splitext(filename_path)[1].lower()}
 
         reader = SimpleDirectoryReader(
-            input_dir=DOCUMENTS_PATH_LLAMA,
-            required_exts=[".pdf", ".txt", ".json", ".html", ".htm", ".md"], # Adicione as extensões que tem
-            recursive=True, # Ler subdiretórios também, se houver
+            input_files=[current_files[p] for p in to_index],
             file_metadata=filename_fn
         )
         documents = reader.load_data()
         if not documents:
+            # Ficheiros sem conteúdo: registados sem nós (e os nós antigos apagados) para não serem reprocessados
             print("[LlamaIndex WARNING] Nenhum documento carregado. Verifique o diretório e as extensões.")
-            return None
+            commit_index_update()
+            return report
         print(f"[LlamaIndex INFO] {len(documents)} documentos carregados com sucesso.")
     except Exception as e:
         print(f"[LlamaIndex ERROR] Erro ao carregar documentos: {e}")
         return None
 
-    # 2. Configurar Modelo de Embedding
+    # 5. Configurar Modelo de Embedding (só necessário quando há ficheiros para embutir)
     print(f"[LlamaIndex INFO] A configurar modelo de embedding: {LLAMA_EMBED_MODEL_NAME}")
     try:
         # LlamaIndex espera o nome como é usado pela biblioteca sentence-transformers
@@ -73,50 +184,35 @@ def create_llamaindex_vector_store():
         print("  Certifique-se que sentence-transformers está instalado e o nome do modelo é válido.")
         return None
 
-    # 3. Configurar ChromaDB como VectorStore
-    print(f"[LlamaIndex INFO] A configurar ChromaDB em: {LLAMA_CHROMA_PERSIST_DIR}, coleção: {LLAMA_CHROMA_COLLECTION_NAME}")
-    if not os.path.exists(LLAMA_CHROMA_PERSIST_DIR):
-        os.makedirs(LLAMA_CHROMA_PERSIST_DIR)
-
-    try:
-        chroma_client = chromadb.PersistentClient(path=LLAMA_CHROMA_PERSIST_DIR)
-        chroma_collection = chroma_client.get_or_create_collection(LLAMA_CHROMA_COLLECTION_NAME)
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    except Exception as e:
-        print(f"[LlamaIndex ERROR] Erro ao configurar ChromaVectorStore: {e}")
-        return None
-
-    # 4. Configurar NodeParser (Text Splitter)
-    node_parser = SentenceSplitter(chunk_size=LLAMA_CHUNK_SIZE, chunk_overlap=LLAMA_CHUNK_OVERLAP)
-
-    # 5. Criar o StorageContext e o ServiceContext (ou usar global)
-    # O ServiceContext foi depreciado, agora os componentes são passados diretamente ou via Settings global
-    # LlamaIndex.Settings.llm = ... (se precisar de um LLM global)
-    # LlamaIndex.Settings.embed_model = embed_model (pode definir globalmente)
-    # LlamaIndex.Settings.node_parser = node_parser
+    # 6. Dividir em nós com IDs determinísticos (por ficheiro: hash do caminho + hash do conteúdo + posição). Os IDs
+    # são atribuídos pelo parser (id_func), para que as relações PREVIOUS/NEXT entre nós usem os mesmos IDs.
+    node_positions = {}
+    def node_id_func(_, document):
+        rel_path = document.metadata.get("source_path")
+        node_positions[rel_path] = node_positions.get(rel_path, -1) + 1
+        return make_node_id(rel_path, current_hashes[rel_path], node_positions[rel_path])
+    node_parser = SentenceSplitter(chunk_size=LLAMA_CHUNK_SIZE, chunk_overlap=LLAMA_CHUNK_OVERLAP, id_func=node_id_func)
+    nodes = node_parser.get_nodes_from_documents(documents)
+    for node in nodes:
+        files_entries[node.metadata.get("source_path")]["node_ids"].append(node.node_id)
 
+    # 7. Embutir e inserir apenas os novos nós
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    # 6. Criar o Índice
-    # Passar `embed_model` e `transformations` (que inclui o node_parser) diretamente para VectorStoreIndex
-    # se não foram definidos globalmente em `Settings`.
-    print(f"[LlamaIndex INFO] A criar ou atualizar o VectorStoreIndex...")
+    print(f"[LlamaIndex INFO] A embutir e inserir {len(nodes)} nós de {len(to_index)} ficheiro(s)...")
     try:
-        index = VectorStoreIndex.from_documents(
-            documents,
+        index = VectorStoreIndex(
+            nodes,
             storage_context=storage_context,
             embed_model=embed_model, # Passar explicitamente
-            transformations=[node_parser], # Passar explicitamente
             show_progress=True
         )
-        # A persistência com ChromaVectorStore e PersistentClient já deve acontecer,
-        # mas uma chamada explícita ao `persist` do índice pode ser feita se necessário para outros stores.
         # Com ChromaVectorStore configurado com um cliente persistente, a persistência é gerida pelo cliente.
-        print(f"[LlamaIndex INFO] Indexação concluída. Índice com {len(index.docstore.docs)} nós base (documentos originais).")
+        commit_index_update()
+        print("[LlamaIndex INFO] Indexação incremental concluída.")
         print(f"  Coleção Chroma '{LLAMA_CHROMA_COLLECTION_NAME}' agora tem {chroma_collection.count()} embeddings.")
-        # index.storage_context.persist(persist_dir=LLAMA_CHROMA_PERSIST_DIR) # Redundante se Chroma já é persistente
         print(f"[LlamaIndex INFO] Índice LlamaIndex com ChromaDB persistido/atualizado em '{LLAMA_CHROMA_PERSIST_DIR}'.")
-        return index
+        report["index"] = index
+        return report
     except Exception as e:
         print(f"[LlamaIndex ERROR] Erro ao criar o VectorStoreIndex: {e}")
         import traceback
@@ -135,10 +231,36 @@ if __name__ == "__main__":
     # Settings.chunk_size = LLAMA_CHUNK_SIZE # Outra forma de definir globalmente
     # Settings.chunk_overlap = LLAMA_CHUNK_OVERLAP
     
-    index = create_llamaindex_vector_store()
+    parser = argparse.ArgumentParser(description="Indexação (incremental) de documentos com LlamaIndex e ChromaDB.")
+    parser.add_argument("--full-reindex", action="store_true", help="Ignorar o manifest e reindexar todos os ficheiros.")
+    parser.add_argument("--mmap-dtype", choices=MMAP_INDEX_DTYPES, default=None,
+                        help="Tipo dos vetores do índice mmap exportado (usado com ANALYZER_VECTOR_BACKEND=mmap); "
+                             "por omissão float16, ou float32 com --mmap-quantization (reordenação em precisão total).")
+    parser.add_argument("--mmap-quantization", choices=MMAP_INDEX_QUANTIZATIONS, default="none",
+                        help="Códigos int8 ou de 1 bit para a 1ª passagem da pesquisa (os vetores completos ficam em disco para reordenar).")
+    parser.add_argument("--no-mmap-export", action="store_true", help="Não exportar o índice mmap depois da indexação.")
+    args = parser.parse_args()
+
+    indexing_report = create_llamaindex_vector_store(full_reindex=args.full_reindex)
+
+    if indexing_report and not args.no_mmap_export:
+        # Exportação só de leitura para o analisador (mmap_vector_index.py): sempre completa, para ficar igual à coleção
+        collection = indexing_report["chroma_collection"]
+        mmap_dir = os.path.join(LLAMA_CHROMA_PERSIST_DIR, MMAP_INDEX_DIR_NAME)
+        try:
+            mmap_manifest = export_mmap_vector_index(collection, mmap_dir, dtype=args.mmap_dtype or default_export_dtype(args.mmap_quantization),
+                                                     index_version=compute_index_version(LLAMA_CHROMA_PERSIST_DIR, collection.count()),
+                                                     embed_model_name=LLAMA_EMBED_MODEL_NAME, quantization=args.mmap_quantization)
+            print(f"[LlamaIndex INFO] Índice mmap exportado para '{mmap_dir}': {mmap_manifest['count']} nós, "
+                  f"dimensão {mmap_manifest['dimension']}, {mmap_manifest['dtype']}, quantização {mmap_manifest['quantization']}.")
+        except Exception as e:
+            print(f"[LlamaIndex WARNING] Falha ao exportar o índice mmap: {e}")
 
-    if index:
+    if indexing_report:
+        index = indexing_report["index"]
         print("\n[LlamaIndex SUCCESS] Indexação com LlamaIndex e ChromaDB concluída.")
+        print(f"  Novos: {len(indexing_report['added'])}, alterados: {len(indexing_report['modified'])}, "
+              f"removidos: {len(indexing_report['removed'])}, ignorados (inalterados): {len(indexing_report['unchanged'])}")
         # Exemplo de como testar (opcional)
         # try:
         #     print("\n[LlamaIndex TEST] A testar uma query de similaridade...")
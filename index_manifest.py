@@ -0,0 +1,53 @@
+# index_manifest.py
+# Manifest da indexação LlamaIndex/Chroma (escrito por index_documents_llamaindex.py): definições da indexação e,
+# por ficheiro, o hash do conteúdo e os IDs dos nós. Lido também pelo analisador para obter a versão do índice
+# (caches de recuperação, respostas às sub-perguntas, contextos RAG e journal ficam associados a essa versão).
+# Sem dependências pesadas: importado pelo indexador, pelo analisador e pelas caches.
+import os
+import json
+import hashlib
+import datetime
+
+LLAMA_INDEX_MANIFEST_FILENAME = "index_manifest.json"
+LLAMA_INDEX_MANIFEST_VERSION = 1
+
+
+def load_index_manifest(persist_dir):
+    manifest_path = os.path.join(persist_dir, LLAMA_INDEX_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[LlamaIndex WARNING] Manifest '{manifest_path}' inválido ({e}).")
+        return None
+
+
+def save_index_manifest(persist_dir, files_entries, settings):
+    manifest_path = os.path.join(persist_dir, LLAMA_INDEX_MANIFEST_FILENAME)
+    manifest = {"version": LLAMA_INDEX_MANIFEST_VERSION, "settings": settings,
+                "updated": datetime.datetime.now().isoformat(), "files": files_entries}
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def compute_index_version(persist_dir, item_count=None):
+    """
+    Versão do índice vetorial: hash das definições e dos ficheiros (hash e nós) do manifest da indexação.
+    Sem manifest, usa o nº de itens da coleção e a data de modificação do diretório (melhor do que nada).
+    """
+    manifest_path = os.path.join(persist_dir, LLAMA_INDEX_MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        version_material = {"settings": manifest.get("settings"), "files": manifest.get("files")}
+    except (OSError, ValueError):
+        try:
+            persist_dir_mtime = os.path.getmtime(persist_dir)
+        except OSError:
+            persist_dir_mtime = None
+        version_material = {"no_manifest": True, "items": item_count, "mtime": persist_dir_mtime}
+    return hashlib.sha256(json.dumps(version_material, sort_keys=True).encode("utf-8")).hexdigest()[:16]
@@ -5,6 +5,10 @@ import re
 import platform # Para informações do SO
 import psutil   # Para CPU, RAM, Disco (pip install psutil)
 import subprocess # Para executar comandos como wmic se necessário
+import threading
+import queue
+import time
+import atexit
 
 # Tentar importar wmi, mas não tornar uma dependência rígida se não for encontrado
 try:
@@ -14,6 +18,13 @@ except ImportError:
 
 LOG_DIR_NAME = "llm_interaction_logs"
 current_log_filepath = None
+_log_write_lock = threading.Lock() # Entradas de vários documentos analisados em paralelo não se intercalam
+
+# Modo de escrita: "sync" (escreve no momento, na thread de análise) ou "background" (fila + thread de escrita com buffer)
+LOG_WRITER_MODE = os.getenv("ANALYZER_LOG_WRITER", "sync")
+LOG_WRITE_BUFFER_BYTES = 1024 * 1024
+LOG_FLUSH_BYTES = 4 * 1024 * 1024 # Despejar o buffer de um ficheiro depois de tantos bytes em fila
+LOG_FLUSH_INTERVAL_SECONDS = 5.0
 
 def format_duration(seconds):
     if seconds is None or seconds < 0: # Adicionado 'seconds is None'
@@ -236,45 +247,168 @@ def initialize_logger(model_name, analysis_mode_key, base_script_dir):
         print(f"[LOGGER ERROR] Could not initialize log file {temp_log_filepath}: {e}")
     except Exception as e_init:
         print(f"[LOGGER ERROR] Unexpected error during logger initialization or system info: {e_init}")
+    # O caminho devolvido pode ser passado explicitamente (log_filepath=...) pelos workers,
+    # para não depender do global current_log_filepath
+    return current_log_filepath
 
 
-def _log_entry_content(target_document_name, mode_for_log, system_prompt, user_prompt, output_content, is_error=False):
-    global current_log_filepath
-    if not current_log_filepath:
-        return
-
+def _format_entry_content(target_document_name, mode_for_log, system_prompt, user_prompt, output_content, is_error=False, timestamp=None,
+                          llm_metrics=None, prompt_token_report=None):
     entry_type = "ERROR Interaction" if is_error else "Interaction"
     input_type = "INPUT TO LLM (Attempted)" if is_error else "INPUT TO LLM"
     output_section_header = "ERROR DETAILS" if is_error else "OUTPUT FROM LLM (Raw)"
-
+    return "".join([
+        f"--- {entry_type} Start (Document: {target_document_name}) ---\n",
+        f"Timestamp: {timestamp or datetime.datetime.now().isoformat()}\n",
+        f"Analysis Mode Logged As: {mode_for_log}\n\n",
+        f"{input_type}:\n",
+        "-" * 15 + " System Prompt " + "-"*15 + "\n",
+        str(system_prompt) + "\n", # Ensure prompts are strings
+        "-" * 15 + " User Prompt " + "-"*15 + "\n",
+        str(user_prompt) + "\n",
+        "---"*10 + "\n\n",
+        f"{output_section_header}:\n",
+        str(output_content) + "\n", # Ensure output is string
+        (f"LLM Server Metrics: {llm_metrics}\n" if llm_metrics else ""),
+        (f"Prompt Token Budget: {prompt_token_report}\n" if prompt_token_report else ""),
+        "--- Interaction End ---\n\n",
+        "="*50 + "\n\n",
+    ])
+
+def _format_run_summary(total_files_processed_in_run, successful_analyses_in_run, total_pipeline_time_seconds, avg_time_per_file_seconds,
+                        cache_stats=None, throughput_stats=None, pipeline_stats=None):
+    lines = ["--- Run Summary ---\n",
+             f"Total JSON files processed in this run: {total_files_processed_in_run}\n",
+             f"Successful LLM analyses in this run: {successful_analyses_in_run}\n",
+             f"Average processing time per successfully analyzed file: {format_duration(avg_time_per_file_seconds)}\n",
+             f"Total pipeline time for this run: {format_duration(total_pipeline_time_seconds)}\n"]
+    if throughput_stats:
+        lines.append(f"{throughput_stats}\n")
+    if pipeline_stats:
+        lines.append(f"{pipeline_stats}\n")
+    if cache_stats:
+        lines.append(f"{cache_stats}\n")
+    lines.append("="*50 + "\n")
+    lines.append("--- End of Log ---\n")
+    return "".join(lines)
+
+
+class _BackgroundLogWriter(threading.Thread):
+    """
+    Thread única que formata e escreve as entradas em fila, com I/O em buffer.
+    Os ficheiros ficam abertos e o buffer é despejado quando excede LOG_FLUSH_BYTES,
+    quando passam LOG_FLUSH_INTERVAL_SECONDS, ou em flush_logs()/fim da execução.
+    """
+
+    def __init__(self):
+        super().__init__(name="interaction_log_writer", daemon=True)
+        self.entries = queue.Queue()
+        self._open_files = {} # caminho -> [ficheiro, bytes por despejar]
+        self._last_flush = time.monotonic()
+
+    def run(self):
+        while True:
+            try:
+                item = self.entries.get(timeout=LOG_FLUSH_INTERVAL_SECONDS)
+            except queue.Empty:
+                self._flush_all()
+                continue
+            kind, log_filepath, payload = item
+            if kind == "write":
+                formatter, args, kwargs = payload
+                self._write(log_filepath, formatter, args, kwargs)
+            elif kind == "close":
+                self._close(log_filepath)
+            elif kind == "flush":
+                self._flush_all()
+                payload.set()
+            if time.monotonic() - self._last_flush >= LOG_FLUSH_INTERVAL_SECONDS:
+                self._flush_all()
+
+    def _write(self, log_filepath, formatter, args, kwargs):
+        try:
+            text = formatter(*args, **kwargs)
+            if log_filepath not in self._open_files:
+                self._open_files[log_filepath] = [open(log_filepath, 'a', encoding='utf-8', buffering=LOG_WRITE_BUFFER_BYTES), 0]
+            file_state = self._open_files[log_filepath]
+            file_state[0].write(text)
+            file_state[1] += len(text)
+            if file_state[1] >= LOG_FLUSH_BYTES:
+                file_state[0].flush(); file_state[1] = 0
+        except IOError as e:
+            print(f"[LOGGER ERROR] Could not write to log file {log_filepath}: {e}")
+        except Exception as e:
+            print(f"[LOGGER ERROR] Unexpected error during logging: {e}")
+
+    def _close(self, log_filepath):
+        file_state = self._open_files.pop(log_filepath, None)
+        if file_state:
+            try: file_state[0].close()
+            except Exception as e: print(f"[LOGGER ERROR] Could not close log file {log_filepath}: {e}")
+
+    def _flush_all(self):
+        for log_filepath, file_state in self._open_files.items():
+            try:
+                file_state[0].flush(); file_state[1] = 0
+            except Exception as e:
+                print(f"[LOGGER ERROR] Could not flush log file {log_filepath}: {e}")
+        self._last_flush = time.monotonic()
+
+
+_background_writer = None
+_background_writer_lock = threading.Lock()
+
+def _get_background_writer():
+    global _background_writer
+    with _background_writer_lock:
+        if _background_writer is None:
+            _background_writer = _BackgroundLogWriter()
+            _background_writer.start()
+            atexit.register(flush_logs)
+        return _background_writer
+
+def _write_log(log_filepath, formatter, *args, **kwargs):
+    """Escreve (modo 'sync') ou põe em fila (modo 'background') o texto produzido por formatter(*args, **kwargs)."""
+    if LOG_WRITER_MODE == "background":
+        _get_background_writer().entries.put(("write", log_filepath, (formatter, args, kwargs)))
+        return
     try:
-        with open(current_log_filepath, 'a', encoding='utf-8') as f:
-            f.write(f"--- {entry_type} Start (Document: {target_document_name}) ---\n")
-            f.write(f"Timestamp: {datetime.datetime.now().isoformat()}\n")
-            f.write(f"Analysis Mode Logged As: {mode_for_log}\n\n")
-            f.write(f"{input_type}:\n")
-            f.write("-" * 15 + " System Prompt " + "-"*15 + "\n")
-            f.write(str(system_prompt) + "\n") # Ensure prompts are strings
-            f.write("-" * 15 + " User Prompt " + "-"*15 + "\n")
-            f.write(str(user_prompt) + "\n")
-            f.write("---"*10 + "\n\n")
-            f.write(f"{output_section_header}:\n")
-            f.write(str(output_content) + "\n") # Ensure output is string
-            f.write("--- Interaction End ---\n\n")
-            f.write("="*50 + "\n\n")
+        text = formatter(*args, **kwargs)
+        with _log_write_lock, open(log_filepath, 'a', encoding='utf-8') as f:
+            f.write(text)
     except IOError as e:
-        print(f"[LOGGER ERROR] Could not write to log file {current_log_filepath}: {e}")
+        print(f"[LOGGER ERROR] Could not write to log file {log_filepath}: {e}")
     except Exception as e:
         print(f"[LOGGER ERROR] Unexpected error during logging: {e}")
 
-def log_interaction(target_document_name, analysis_mode_description, system_prompt, user_prompt, raw_llm_output):
-    if not current_log_filepath:
+def flush_logs(timeout=30):
+    """Garante que todas as entradas em fila foram escritas em disco (sem efeito no modo 'sync')."""
+    if _background_writer is None:
+        return
+    flushed = threading.Event()
+    _background_writer.entries.put(("flush", None, flushed))
+    flushed.wait(timeout)
+
+def _log_entry_content(target_document_name, mode_for_log, system_prompt, user_prompt, output_content, is_error=False, log_filepath=None,
+                       llm_metrics=None, prompt_token_report=None):
+    log_filepath = log_filepath or current_log_filepath
+    if not log_filepath:
+        return
+    # O timestamp é fixado agora, mesmo que a entrada seja formatada mais tarde pela thread de escrita
+    _write_log(log_filepath, _format_entry_content, target_document_name, mode_for_log, system_prompt, user_prompt,
+               output_content, is_error=is_error, timestamp=datetime.datetime.now().isoformat(), llm_metrics=llm_metrics,
+               prompt_token_report=prompt_token_report)
+
+def log_interaction(target_document_name, analysis_mode_description, system_prompt, user_prompt, raw_llm_output, log_filepath=None,
+                    llm_metrics=None, prompt_token_report=None):
+    if not (log_filepath or current_log_filepath):
         print(f"[LOGGER WARNING] Logger not initialized or failed. Skipping log entry for {target_document_name}.")
         return
-    _log_entry_content(target_document_name, analysis_mode_description, system_prompt, user_prompt, raw_llm_output)
+    _log_entry_content(target_document_name, analysis_mode_description, system_prompt, user_prompt, raw_llm_output, log_filepath=log_filepath,
+                       llm_metrics=llm_metrics, prompt_token_report=prompt_token_report)
 
-def log_error_interaction(target_document_name, analysis_mode_description, system_prompt, user_prompt, error_message, status_code=None):
-    if not current_log_filepath:
+def log_error_interaction(target_document_name, analysis_mode_description, system_prompt, user_prompt, error_message, status_code=None, log_filepath=None):
+    if not (log_filepath or current_log_filepath):
         print(f"[LOGGER WARNING] Logger not initialized or failed. Skipping error log entry for {target_document_name}.")
         return
     error_output_content = (
@@ -282,25 +416,17 @@ def log_error_interaction(target_document_name, analysis_mode_description, syste
         + f"Error Message: {error_message}"
     )
     _log_entry_content(target_document_name, analysis_mode_description, system_prompt, user_prompt,
-                       error_output_content, is_error=True)
+                       error_output_content, is_error=True, log_filepath=log_filepath)
 
-def log_run_summary(total_files_processed_in_run, successful_analyses_in_run, total_pipeline_time_seconds, avg_time_per_file_seconds):
-    global current_log_filepath
-    if not current_log_filepath:
+def log_run_summary(total_files_processed_in_run, successful_analyses_in_run, total_pipeline_time_seconds, avg_time_per_file_seconds,
+                    cache_stats=None, log_filepath=None, throughput_stats=None, pipeline_stats=None):
+    log_filepath = log_filepath or current_log_filepath
+    if not log_filepath:
         return
-
-    try:
-        with open(current_log_filepath, 'a', encoding='utf-8') as f:
-            f.write("--- Run Summary ---\n")
-            f.write(f"Total JSON files processed in this run: {total_files_processed_in_run}\n")
-            f.write(f"Successful LLM analyses in this run: {successful_analyses_in_run}\n")
-            avg_time_str = format_duration(avg_time_per_file_seconds)
-            f.write(f"Average processing time per successfully analyzed file: {avg_time_str}\n")
-            total_time_str = format_duration(total_pipeline_time_seconds)
-            f.write(f"Total pipeline time for this run: {total_time_str}\n")
-            f.write("="*50 + "\n")
-            f.write("--- End of Log ---\n")
-    except IOError as e:
-        print(f"[LOGGER ERROR] Could not write run summary to log file {current_log_filepath}: {e}")
-    except Exception as e:
-        print(f"[LOGGER ERROR] Unexpected error during run summary logging: {e}")
\ No newline at end of file
+    _write_log(log_filepath, _format_run_summary, total_files_processed_in_run, successful_analyses_in_run,
+               total_pipeline_time_seconds, avg_time_per_file_seconds, cache_stats=cache_stats, throughput_stats=throughput_stats,
+               pipeline_stats=pipeline_stats)
+    if LOG_WRITER_MODE == "background":
+        # Fim da execução deste log: fechar o ficheiro e garantir que está em disco
+        _get_background_writer().entries.put(("close", log_filepath, None))
+        flush_logs()
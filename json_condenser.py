@@ -0,0 +1,229 @@
+# json_condenser.py
+# Representação compacta de JSON Schemas e ficheiros de dados para os prompts: mantém nomes de propriedades,
+# tipos, descrições, enums, 'required' e alvos '$ref', dentro de um orçamento de caracteres, e devolve sempre JSON válido.
+import os
+import json
+
+# ijson permite condensar ficheiros muito grandes sem os carregar inteiros (pip install ijson); é opcional
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+JSON_CONDENSER_DEFAULT_BUDGET_CHARS = 60000
+# Limites aplicados durante a leitura em streaming (folgados: 'required' e 'enum' não devem ser cortados aqui)
+JSON_STREAMING_MAX_ARRAY_ITEMS = 1000
+JSON_STREAMING_MAX_STRING_CHARS = 4000
+JSON_SCHEMA_MARKER_KEYS = ("$schema", "properties", "definitions", "$defs", "$ref", "allOf", "anyOf", "oneOf")
+# Chaves de JSON Schema mantidas na forma condensada (o resto — exemplos, defaults, comentários, limites numéricos — é omitido)
+JSON_SCHEMA_KEPT_KEYS = (
+    "$id", "title", "description", "type", "format", "enum", "const", "$ref", "required",
+    "properties", "patternProperties", "additionalProperties", "items", "definitions", "$defs",
+    "allOf", "anyOf", "oneOf", "not",
+)
+JSON_SCHEMA_MAPPING_KEYS = ("properties", "patternProperties", "definitions", "$defs") # Valores são sub-schemas por nome
+OMITTED_KEY = "_omitted"
+
+# Níveis de condensação, do mais fiel ao mais agressivo; é usado o primeiro que cabe no orçamento
+CONDENSE_LEVELS = (
+    {"max_string": 400, "max_enum": 50, "max_array_items": 20, "max_depth": None},
+    {"max_string": 160, "max_enum": 20, "max_array_items": 5, "max_depth": None},
+    {"max_string": 60, "max_enum": 8, "max_array_items": 2, "max_depth": None},
+    {"max_string": 0, "max_enum": 5, "max_array_items": 1, "max_depth": 8},
+    {"max_string": 0, "max_enum": 3, "max_array_items": 1, "max_depth": 5},
+    {"max_string": 0, "max_enum": 0, "max_array_items": 1, "max_depth": 3},
+)
+
+
+def looks_like_json_schema(obj):
+    return isinstance(obj, dict) and any(key in obj for key in JSON_SCHEMA_MARKER_KEYS)
+
+
+def collect_refs(obj, refs=None):
+    """Conjunto de alvos '$ref' presentes no documento."""
+    refs = set() if refs is None else refs
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key == "$ref" and isinstance(value, str):
+                refs.add(value)
+            else:
+                collect_refs(value, refs)
+    elif isinstance(obj, list):
+        for item in obj:
+            collect_refs(item, refs)
+    return refs
+
+
+def _truncate_string(text, max_chars):
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…" if max_chars > 0 else "…"
+
+
+def _condense(obj, level, schema_mode, depth, in_mapping=False):
+    max_depth = level["max_depth"]
+    if isinstance(obj, dict):
+        if max_depth is not None and depth >= max_depth:
+            return {OMITTED_KEY: f"{len(obj)} keys"}
+        condensed = {}
+        for key, value in obj.items():
+            if schema_mode and not in_mapping and key not in JSON_SCHEMA_KEPT_KEYS:
+                continue
+            if schema_mode and not in_mapping and key == "description":
+                if level["max_string"] == 0: continue
+                condensed[key] = _truncate_string(value, level["max_string"]) if isinstance(value, str) else value
+            elif schema_mode and not in_mapping and key == "enum" and isinstance(value, list):
+                total_values = getattr(value, "total_items", len(value))
+                condensed[key] = value[: level["max_enum"]] + ([f"… (+{total_values - level['max_enum']})"] if total_values > level["max_enum"] else [])
+            elif schema_mode and not in_mapping and key in ("required", "type"):
+                condensed[key] = value # Nunca truncados: são a informação essencial
+            else:
+                condensed[key] = _condense(value, level, schema_mode, depth + 1,
+                                           in_mapping=schema_mode and not in_mapping and key in JSON_SCHEMA_MAPPING_KEYS)
+        return condensed
+    if isinstance(obj, list):
+        total_items = getattr(obj, "total_items", len(obj))
+        if max_depth is not None and depth >= max_depth:
+            return [f"{OMITTED_KEY}: {total_items} items"]
+        # Em schemas, as listas são combinadores (allOf/anyOf/oneOf) ou tuplos de 'items': nunca amostradas
+        items_to_keep = obj if schema_mode else obj[: level["max_array_items"]]
+        kept = [_condense(item, level, schema_mode, depth + 1) for item in items_to_keep]
+        if total_items > len(kept):
+            kept.append(f"… (+{total_items - len(kept)} items)")
+        return kept
+    if isinstance(obj, str):
+        # Valores de dados: a amostra basta para o LLM inferir o tipo de informação
+        return obj if schema_mode else _truncate_string(obj, max(level["max_string"], 40))
+    return obj
+
+
+class _SampledList(list):
+    """Lista cortada durante a leitura em streaming; total_items guarda o comprimento original."""
+    total_items = 0
+
+
+def _dumps_compact(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def condense_json_object(obj, max_chars=JSON_CONDENSER_DEFAULT_BUDGET_CHARS):
+    """
+    Condensa um objeto JSON já carregado. Devolve (texto_json, nível_usado).
+    nível_usado é o índice em CONDENSE_LEVELS, ou len(CONDENSE_LEVELS) se foi preciso omitir propriedades de topo.
+    """
+    schema_mode = looks_like_json_schema(obj)
+    refs = sorted(collect_refs(obj)) if schema_mode else []
+    for level_idx, level in enumerate(CONDENSE_LEVELS):
+        condensed = _condense(obj, level, schema_mode, depth=0)
+        text = _dumps_compact(condensed)
+        hidden_refs = [ref for ref in refs if json.dumps(ref, ensure_ascii=False) not in text] # Omitidos pelo limite de profundidade
+        if hidden_refs and isinstance(condensed, dict):
+            condensed["_refs"] = hidden_refs
+            text = _dumps_compact(condensed)
+        if len(text) <= max_chars:
+            return text, level_idx
+    # Último recurso: menos entradas no nível de topo (ou nas 'properties' de topo), indicando quantas foram omitidas
+    if isinstance(condensed, dict) and isinstance(condensed.get("properties"), dict):
+        container = condensed["properties"]
+    else:
+        container = condensed
+    if isinstance(container, dict):
+        total_entries = len(container); kept_keys = list(container)
+        while kept_keys and len(_dumps_compact(condensed)) > max_chars:
+            container.pop(kept_keys.pop())
+            container[OMITTED_KEY] = f"{total_entries - len(kept_keys)} of {total_entries} entries omitted"
+    elif isinstance(container, list):
+        total_items = len(container)
+        while len(container) > 1 and len(_dumps_compact(condensed)) > max_chars:
+            container[-2:] = [f"{OMITTED_KEY}: {total_items - len(container) + 2} items"]
+    text = _dumps_compact(condensed)
+    if len(text) > max_chars:
+        # Marcador cada vez mais curto, sem nunca exceder o orçamento (trim_json_to_tokens depende disso)
+        fallbacks = (_dumps_compact({OMITTED_KEY: f"document too large for a {max_chars}-char budget"}),
+                     _dumps_compact({OMITTED_KEY: "too large"}), "{}", "")
+        text = next(fallback for fallback in fallbacks if len(fallback) <= max_chars)
+    return text, len(CONDENSE_LEVELS)
+
+
+def _build_from_ijson_events(events, max_array_items, max_string):
+    """
+    Constrói o objeto a partir dos eventos de ijson.basic_parse, descartando à medida itens de listas acima de
+    max_array_items e encurtando strings longas (a memória usada não depende do tamanho dos arrays de dados).
+    As listas são _SampledList, com o comprimento original em total_items.
+    """
+    root = None
+    stack = [] # [contentor, chave_pendente, itens_vistos]
+    skip_depth = 0 # >0 enquanto se consome um item descartado
+
+    def attach(value):
+        nonlocal root
+        if not stack:
+            root = value
+            return
+        container, pending_key, _ = stack[-1]
+        if isinstance(container, dict):
+            container[pending_key] = value
+        else:
+            container.append(value)
+
+    def accept_item():
+        """True se o próximo item da lista atual deve ser mantido (conta sempre o item)."""
+        if not stack or isinstance(stack[-1][0], dict):
+            return True
+        stack[-1][2] += 1
+        return stack[-1][2] <= max_array_items
+
+    for event, value in events:
+        if skip_depth:
+            if event in ("start_map", "start_array"): skip_depth += 1
+            elif event in ("end_map", "end_array"): skip_depth -= 1
+            continue
+        if event == "map_key":
+            stack[-1][1] = value
+        elif event in ("start_map", "start_array"):
+            if not accept_item():
+                skip_depth = 1
+                continue
+            container = {} if event == "start_map" else _SampledList()
+            attach(container)
+            stack.append([container, None, 0])
+        elif event in ("end_map", "end_array"):
+            container, _, seen = stack.pop()
+            if event == "end_array":
+                container.total_items = seen
+        else:
+            if not accept_item():
+                continue
+            if event == "number" and not isinstance(value, (int, float)):
+                value = float(value) # ijson devolve Decimal
+            if isinstance(value, str):
+                value = _truncate_string(value, max_string)
+            attach(value)
+    return root
+
+
+def load_json_file(filepath):
+    """Carrega o ficheiro; com ijson, os arrays muito longos e strings enormes são cortados durante a leitura."""
+    if ijson is not None:
+        with open(filepath, "rb") as f:
+            return _build_from_ijson_events(ijson.basic_parse(f), JSON_STREAMING_MAX_ARRAY_ITEMS, JSON_STREAMING_MAX_STRING_CHARS)
+    with open(filepath, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def condense_json_file(filepath, max_chars=JSON_CONDENSER_DEFAULT_BUDGET_CHARS, transform=None):
+    """
+    Lê e condensa um ficheiro JSON. Devolve (texto_json, relatório) com o relatório
+    {'original_bytes', 'condensed_chars', 'level', 'is_schema'}. Lança ValueError se o ficheiro não for JSON válido.
+    transform (opcional) é aplicado ao objeto carregado antes da condensação (ex: SchemaRefResolver.resolve).
+    """
+    original_bytes = os.path.getsize(filepath)
+    try:
+        obj = load_json_file(filepath)
+    except Exception as e: # json.JSONDecodeError / ijson.JSONError / UnicodeDecodeError
+        raise ValueError(f"JSON inválido em '{filepath}': {e}") from e
+    if transform is not None:
+        obj = transform(obj)
+    text, level = condense_json_object(obj, max_chars)
+    return text, {"original_bytes": original_bytes, "condensed_chars": len(text), "level": level,
+                  "is_schema": looks_like_json_schema(obj)}
@@ -0,0 +1,148 @@
+# llm_response_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+
+LLM_RESPONSE_CACHE_DIR_NAME = "llm_response_cache"
+LLM_RESPONSE_CACHE_DEFAULT_MAX_BYTES = 512 * 1024 * 1024 # 512 MB
+LLM_RESPONSE_CACHE_DEFAULT_MAX_ENTRIES = 50000
+
+
+def compute_llm_cache_key(endpoint, model, system_prompt=None, user_prompt=None, messages=None, options=None, extra=None):
+    """Chave de conteúdo: modelo + prompts (ou mensagens) + opções de geração."""
+    key_material = {
+        "endpoint": endpoint,
+        "model": model,
+        "system": system_prompt,
+        "prompt": user_prompt,
+        "messages": messages,
+        "options": options or {},
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Cache persistente de respostas LLM, endereçada por conteúdo (um ficheiro JSON por resposta).
+    A eviction é LRU (pela data do último acesso) quando o tamanho total ou o nº de entradas excede o limite.
+    Com bypass=True as leituras são ignoradas, mas as respostas novas continuam a ser guardadas.
+    """
+
+    def __init__(self, cache_dir, max_bytes=LLM_RESPONSE_CACHE_DEFAULT_MAX_BYTES,
+                 max_entries=LLM_RESPONSE_CACHE_DEFAULT_MAX_ENTRIES, bypass=False, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = None # key -> [tamanho_bytes, último_acesso]; carregado na primeira utilização
+        self._total_bytes = 0
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard_entry in os.scandir(self.cache_dir):
+            if not shard_entry.is_dir():
+                continue
+            for entry in os.scandir(shard_entry.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                self._index[entry.name[:-5]] = [stat.st_size, stat.st_mtime]
+                self._total_bytes += stat.st_size
+
+    def get(self, key):
+        """Devolve o dicionário guardado ou None (conta hit/miss)."""
+        if not self.enabled or self.bypass:
+            return None
+        with self._lock:
+            self._ensure_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self._entry_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                now = time.time()
+                os.utime(path, (now, now)) # Último acesso persistido para o LRU entre execuções
+                self._index[key][1] = now
+                self.hits += 1
+                return entry
+            except Exception:
+                self._drop(key)
+                self.misses += 1
+                return None
+
+    def put(self, key, entry):
+        if not self.enabled:
+            return
+        path = self._entry_path(key)
+        data = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._ensure_index()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"[LLM CACHE WARNING] Não foi possível guardar a resposta em cache: {e}")
+                return
+            size = os.path.getsize(path)
+            if key in self._index:
+                self._total_bytes -= self._index[key][0]
+            self._index[key] = [size, time.time()]
+            self._total_bytes += size
+            self.stores += 1
+            self._evict_if_needed()
+
+    def _drop(self, key):
+        size, _ = self._index.pop(key, (0, 0))
+        self._total_bytes -= size
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes and len(self._index) <= self.max_entries:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes and len(self._index) <= self.max_entries:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def counters(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+    def stats_summary(self, since=None):
+        """Texto com os contadores (diferença desde 'since', se fornecido)."""
+        current = self.counters()
+        if since:
+            current = {k: v - since.get(k, 0) for k, v in current.items()}
+        lookups = current["hits"] + current["misses"]
+        hit_rate = f"{100.0 * current['hits'] / lookups:.1f}%" if lookups else "N/A"
+        state = "desativada" if not self.enabled else ("bypass" if self.bypass else "ativa")
+        return (f"LLM response cache ({state}): hits {current['hits']}, misses {current['misses']}, "
+                f"hit rate {hit_rate}, stores {current['stores']}, evictions {current['evictions']}")
@@ -0,0 +1,132 @@
+# merge_shards.py
+# Junta os resultados de várias execuções headless em shards (batch_runner.py): sumários, logs de interação e journals.
+import os
+import glob
+import json
+import argparse
+
+from batch_runner import SHARD_SUMMARY_FILENAME_TEMPLATE
+from ollama_client import summarize_generation_metrics, format_throughput_summary
+from interaction_logger_mini import LOG_DIR_NAME
+from run_journal import RUN_JOURNAL_FILENAME
+
+MERGED_SUMMARY_FILENAME = "merged_summary.json"
+MERGED_LOG_FILENAME = "merged_shards_log.txt"
+
+
+def find_shard_summaries(input_dirs):
+    pattern = SHARD_SUMMARY_FILENAME_TEMPLATE.replace("{index:03d}", "*").replace("{count:03d}", "*")
+    paths = []
+    for input_dir in input_dirs:
+        paths.extend(sorted(glob.glob(os.path.join(input_dir, pattern))))
+    return paths
+
+
+def merge_summaries(summary_paths):
+    """Agrega os resultados por modelo de todos os shards e verifica shards em falta ou repetidos."""
+    shards = []
+    for path in summary_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            shards.append(json.load(f))
+    shard_counts = {shard["shard_count"] for shard in shards}
+    if len(shard_counts) > 1:
+        raise ValueError(f"Os shards foram gerados com shard-count diferentes: {sorted(shard_counts)}")
+    shard_count = shard_counts.pop() if shard_counts else 0
+    seen_indexes = sorted(shard["shard_index"] for shard in shards)
+    per_model = {}
+    for shard in shards:
+        for model, document_results in shard["models"].items():
+            per_model.setdefault(model, {}).update({result["doc_name"]: result for result in document_results})
+
+    models_summary = {}
+    for model, results_by_doc in sorted(per_model.items()):
+        results = list(results_by_doc.values())
+        successes = [r for r in results if r["status"] == "success"]
+        total_llm_seconds = sum(r["llm_duration"] or 0.0 for r in successes)
+        models_summary[model] = {
+            "documents": len(results),
+            "success": len(successes),
+            "warning": sum(1 for r in results if r["status"] == "warning"),
+            "error": sum(1 for r in results if r["status"] == "error"),
+            "resumed": sum(1 for r in results if r.get("resumed")),
+            "total_llm_seconds": total_llm_seconds,
+            "avg_llm_seconds": total_llm_seconds / len(successes) if successes else None,
+            "throughput": summarize_generation_metrics([r.get("llm_metrics") for r in results]),
+        }
+    return {
+        "shard_count": shard_count,
+        "shards_found": seen_indexes,
+        "shards_missing": sorted(set(range(shard_count)) - set(seen_indexes)),
+        "shards_duplicated": sorted({i for i in seen_indexes if seen_indexes.count(i) > 1}),
+        "hosts": sorted({shard.get("host", "?") for shard in shards}),
+        "max_shard_duration_seconds": max((shard.get("total_duration_seconds") or 0.0 for shard in shards), default=0.0),
+        "models": models_summary,
+    }
+
+
+def merge_interaction_logs(input_dirs, output_dir):
+    """Concatena os logs de cada pasta modelo/variante de todos os shards num único ficheiro por pasta."""
+    merged_files = 0
+    for stale_path in glob.glob(os.path.join(output_dir, LOG_DIR_NAME, "**", MERGED_LOG_FILENAME), recursive=True):
+        os.remove(stale_path) # Repetir o merge não duplica entradas
+    for input_dir in input_dirs:
+        logs_root = os.path.join(input_dir, LOG_DIR_NAME)
+        for log_path in sorted(glob.glob(os.path.join(logs_root, "**", "*.txt"), recursive=True)):
+            relative_dir = os.path.relpath(os.path.dirname(log_path), logs_root)
+            merged_dir = os.path.join(output_dir, LOG_DIR_NAME, relative_dir)
+            os.makedirs(merged_dir, exist_ok=True)
+            with open(log_path, "r", encoding="utf-8", errors="replace") as src, \
+                    open(os.path.join(merged_dir, MERGED_LOG_FILENAME), "a", encoding="utf-8") as dst:
+                dst.write(f"\n{'#' * 50}\n# Shard dir: {input_dir}\n# Log: {os.path.basename(log_path)}\n{'#' * 50}\n\n")
+                dst.write(src.read())
+            merged_files += 1
+    return merged_files
+
+
+def merge_journals(input_dirs, output_dir):
+    """Journal combinado (sem entradas repetidas), utilizável com --resume --journal-file."""
+    entries = {}
+    for input_dir in input_dirs:
+        path = os.path.join(input_dir, RUN_JOURNAL_FILENAME)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry["key"]] = entry
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    with open(os.path.join(output_dir, RUN_JOURNAL_FILENAME), "w", encoding="utf-8") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return len(entries)
+
+
+def print_merged_summary(merged):
+    print(f"\n--- Sumário combinado: {len(merged['shards_found'])}/{merged['shard_count']} shards ({', '.join(merged['hosts'])}) ---")
+    if merged["shards_missing"]: print(f"[WARNING] Shards em falta: {merged['shards_missing']}")
+    if merged["shards_duplicated"]: print(f"[WARNING] Shards repetidos (prevalece o último lido): {merged['shards_duplicated']}")
+    for model, stats in merged["models"].items():
+        avg = f"{stats['avg_llm_seconds']:.2f}s" if stats["avg_llm_seconds"] is not None else "N/A"
+        print(f"{model}: {stats['documents']} docs, sucessos {stats['success']}, avisos {stats['warning']}, erros {stats['error']}, "
+              f"tempo LLM médio {avg}")
+        print(f"  {format_throughput_summary(stats['throughput'])}")
+    print(f"Shard mais lento: {merged['max_shard_duration_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Junta sumários, logs e journals de execuções em shards.")
+    parser.add_argument("input_dirs", nargs="+", help="Diretórios de saída (--output-dir) de cada shard.")
+    parser.add_argument("--output-dir", required=True, help="Diretório para o resultado combinado.")
+    cli_args = parser.parse_args()
+    os.makedirs(cli_args.output_dir, exist_ok=True)
+    summary_files = find_shard_summaries(cli_args.input_dirs)
+    if not summary_files:
+        raise SystemExit("[MERGE ERROR] Nenhum sumário de shard encontrado.")
+    merged_summary = merge_summaries(summary_files)
+    with open(os.path.join(cli_args.output_dir, MERGED_SUMMARY_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(merged_summary, f, ensure_ascii=False, indent=2)
+    print_merged_summary(merged_summary)
+    print(f"[MERGE] Logs combinados: {merge_interaction_logs(cli_args.input_dirs, cli_args.output_dir)} ficheiros; "
+          f"journal combinado: {merge_journals(cli_args.input_dirs, cli_args.output_dir)} unidades.")
@@ -1,29 +1,52 @@
 # mini_doc_analyzer.py
+from __future__ import annotations # Anotações (ex: VectorStoreIndex) não são avaliadas: LlamaIndex só é importado quando o RAG é usado
+import time
+_MODULE_IMPORT_START = time.perf_counter()
 import json
 import os
-import requests # Para call_ollama_generate (LLM Principal)
-import time
+from typing import TYPE_CHECKING
 import beaupy
 import re
+import math
 import traceback
+import functools
+import argparse
+import concurrent.futures
 
 # Importar módulos locais
 import interaction_logger_mini
+from rag_context_store import RagContextStore, compute_context_key
+from ollama_client import OllamaChatModel, OllamaClientError, get_shared_client, format_generation_metrics, summarize_generation_metrics, format_throughput_summary
+from ollama_endpoint_pool import parse_endpoint_list, OLLAMA_ENDPOINTS_ENV_VAR
+from llm_response_cache import LLMResponseCache, LLM_RESPONSE_CACHE_DIR_NAME
+from semantic_answer_cache import SemanticAnswerCache, SEMANTIC_ANSWER_CACHE_FILENAME, compute_answer_namespace
+from index_manifest import compute_index_version
+from retrieval_cache import RetrievalCache, chroma_change_signal
+from json_condenser import condense_json_file
+from schema_ref_resolver import SchemaRefResolver, SCHEMA_MIRROR_DIR_NAME
+from batch_runner import add_headless_arguments, load_headless_config, is_headless_requested, build_headless_run_configuration, files_for_shard, write_shard_summary
+from run_journal import RunJournal, RUN_JOURNAL_FILENAME, compute_file_sha256, compute_unit_key, compute_prompt_version
+from token_budget import TokenBudgetManager, format_token_report
+from stage_pipeline import run_two_stage_pipeline, format_pipeline_stats
+from structured_assessment import ASSESSMENT_MODES, ASSESSMENT_JSON_SCHEMA, STRUCTURED_OUTPUT_INSTRUCTION, JsonObjectStreamDetector, parse_assessment
+from model_sweep_scheduler import get_model_sizes, plan_model_sweep, estimate_resident_bytes, warm_up_model, unload_model, ModelSweepStats, format_sweep_plan
 # REMOVER: import document_rag_services as doc_rag
 
 # --- LlamaIndex Imports ---
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage, Settings
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.ollama import Ollama # Para usar LLMs Ollama dentro do LlamaIndex
-import chromadb # Cliente ChromaDB
+# llama_index, chromadb e o stack de embeddings HuggingFace são pesados (vários segundos): são importados
+# dentro de load_llamaindex_index, apenas quando um modo RAG é selecionado.
+if TYPE_CHECKING:
+    from llama_index.core import VectorStoreIndex
 
 # --- Configurações (Ollama e Diretórios como antes) ---
-OLLAMA_API_BASE_URL = "http://localhost:11434/api"
-OLLAMA_TAGS_ENDPOINT_SUFFIX = "/tags"
-OLLAMA_GENERATE_ENDPOINT_SUFFIX = "/generate"
+OLLAMA_API_BASE_URL = "http://localhost:11434/api" # Usado pelo cliente partilhado (ollama_client.py)
+OLLAMA_API_BASE_URLS = parse_endpoint_list(os.getenv(OLLAMA_ENDPOINTS_ENV_VAR, "")) # Vários servidores Ollama (vazio = só OLLAMA_API_BASE_URL)
 OLLAMA_REQUEST_TIMEOUT_SECONDS = 360
 OLLAMA_KEEP_ALIVE_DURATION = "5m"
+ANALYSIS_MAX_WORKERS = int(os.getenv("ANALYZER_MAX_WORKERS", str(max(1, len(OLLAMA_API_BASE_URLS))))) # Ficheiros analisados em paralelo por modelo (por omissão, um por servidor)
+JSON_PROMPT_MODE = os.getenv("ANALYZER_JSON_PROMPT_MODE", "condensed") # 'condensed' ou 'raw' (original se couber no orçamento)
+JSON_PROMPT_BUDGET_CHARS = int(os.getenv("ANALYZER_JSON_BUDGET_CHARS", "60000")) # Tamanho máximo do JSON injetado nos prompts
+SWEEP_MAX_PARALLEL_MODELS = int(os.getenv("ANALYZER_SWEEP_MAX_PARALLEL", "1")) # Modo "todos os modelos": modelos pequenos em simultâneo se a RAM permitir
 PROMPTS_DIR_NAME = "prompts_mini"
 DEFAULT_SCHEMA_DIR = "test_schemas"
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -33,51 +56,145 @@ PROMPTS_DIR_PATH = os.path.join(SCRIPT_DIR, PROMPTS_DIR_NAME)
 LLAMA_CHROMA_PERSIST_DIR = "./llamaindex_chroma_db_docs" # Deve corresponder ao do script de indexação
 LLAMA_CHROMA_COLLECTION_NAME = "llamaindex_doc_embeddings_minilm"
 LLAMA_EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2" # Deve corresponder
+VECTOR_BACKEND = os.getenv("ANALYZER_VECTOR_BACKEND", "chroma") # 'chroma' ou 'mmap' (exportação só de leitura, ver mmap_vector_index.py)
+VECTOR_RERANK_FACTOR = int(os.getenv("ANALYZER_VECTOR_RERANK_FACTOR", "0")) or None # Índice mmap quantizado: candidatos por resultado (None = por omissão)
+AUX_LLM_MODEL_NAME = "qwen2:0.5b" # LLM auxiliar (fixo) para tarefas RAG
+SUBQUESTION_ANSWER_MAX_CONCURRENCY = int(os.getenv("ANALYZER_SUBQ_CONCURRENCY", "3")) # Respostas a sub-perguntas geradas em paralelo
+PIPELINE_RAG_STAGES = os.getenv("ANALYZER_PIPELINE", "1") == "1" # Com RAG: contexto do documento seguinte construído durante a análise do atual
+PIPELINE_QUEUE_DEPTH = int(os.getenv("ANALYZER_PIPELINE_DEPTH", "2")) # Contextos prontos à espera do LLM principal (backpressure)
+PIPELINE_CONTEXT_WORKERS = int(os.getenv("ANALYZER_PIPELINE_CONTEXT_WORKERS", "1")) # Threads da etapa de contexto RAG
+RAG_CONTEXT_STORE_PERSIST = True # Guardar contextos RAG em disco (rag_context_cache/) para reutilizar entre execuções
+RAG_CONTEXT_STORE_MAX_BYTES = int(os.getenv("ANALYZER_RAG_CONTEXT_MAX_MB", "256")) * 1024 * 1024 # Limite do armazém (LRU)
+RAG_CONTEXT_STORE_MAX_ENTRIES = int(os.getenv("ANALYZER_RAG_CONTEXT_MAX_ENTRIES", "20000"))
+RAG_NUM_SUBQUERIES = 3 # RAG multi-step: sub-perguntas geradas por documento
+RAG_K_PER_SUBQUERY = 2 # Nós recuperados por sub-pergunta (RAG simples: k + 1)
+
+# --- Cache de respostas LLM (principal e auxiliar) ---
+LLM_CACHE_BYPASS = os.getenv("ANALYZER_LLM_CACHE_BYPASS", "0") == "1" # Ignorar leituras da cache (as respostas novas continuam a ser guardadas)
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+llm_response_cache = LLMResponseCache(os.path.join(SCRIPT_DIR, LLM_RESPONSE_CACHE_DIR_NAME), max_bytes=LLM_CACHE_MAX_BYTES, bypass=LLM_CACHE_BYPASS)
+
+# --- Cache semântica das respostas às sub-perguntas (RAG multi-step), invalidada quando o índice muda ---
+SEMANTIC_CACHE_ENABLED = os.getenv("ANALYZER_SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("ANALYZER_SEMANTIC_CACHE_THRESHOLD", "0.92")) # Cosseno mínimo entre sub-perguntas
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("ANALYZER_SEMANTIC_CACHE_MAX_ENTRIES", "4096"))
+subquestion_answer_cache = SemanticAnswerCache(os.path.join(SCRIPT_DIR, SEMANTIC_ANSWER_CACHE_FILENAME), threshold=SEMANTIC_CACHE_THRESHOLD,
+                                               max_entries=SEMANTIC_CACHE_MAX_ENTRIES, enabled=SEMANTIC_CACHE_ENABLED)
+
+# --- Cache de embeddings de queries e de resultados top-k (retrievers reutilizados), invalidada quando a coleção muda ---
+RETRIEVAL_CACHE_ENABLED = os.getenv("ANALYZER_RETRIEVAL_CACHE", "1") == "1"
+retrieval_cache = RetrievalCache(enabled=RETRIEVAL_CACHE_ENABLED)
+retrieval_cache.on_version_change.append(subquestion_answer_cache.set_index_version) # A mesma versão do índice para as duas caches
+
+# --- Resolução offline de $ref (espelho local em schema_mirror/, preenchido com 'python schema_ref_resolver.py') ---
+SCHEMA_MIRROR_DIR_PATH = os.path.join(SCRIPT_DIR, SCHEMA_MIRROR_DIR_NAME)
+schema_ref_resolver = SchemaRefResolver(SCHEMA_MIRROR_DIR_PATH) if os.path.isdir(SCHEMA_MIRROR_DIR_PATH) else None
+
+# --- Orçamento de tokens (janela de contexto por modelo, lida de /api/show) ---
+TOKEN_BUDGET_ENABLED = os.getenv("ANALYZER_TOKEN_BUDGET", "1") == "1"
+TOKEN_BUDGET_NUM_CTX = int(os.getenv("ANALYZER_NUM_CTX", "0")) or None # Se definido, é também enviado ao Ollama (options.num_ctx)
+token_budget_manager = TokenBudgetManager(lambda: get_ollama_client(), num_ctx_override=TOKEN_BUDGET_NUM_CTX)
+
+# --- Modo de avaliação: texto livre ou JSON estruturado (parâmetro 'format' do Ollama, stream interrompido no fim do objeto) ---
+ASSESSMENT_MODE = os.getenv("ANALYZER_ASSESSMENT_MODE", "text")
+if ASSESSMENT_MODE not in ASSESSMENT_MODES:
+    print(f"[WARNING] ANALYZER_ASSESSMENT_MODE '{ASSESSMENT_MODE}' desconhecido; a usar 'text'."); ASSESSMENT_MODE = "text"
+# Raciocínio ('think') dos modelos que o suportam: '0' desliga, '1' liga; por omissão desligado no modo estruturado
+ASSESSMENT_THINK = {"0": False, "1": True}.get(os.getenv("ANALYZER_THINK", ""), False if ASSESSMENT_MODE == "structured" else None)
+
+# --- Tempos de arranque (reportados no início de main) ---
+startup_timings = [("imports do módulo", time.perf_counter() - _MODULE_IMPORT_START)]
+
+def record_startup_stage(stage_name, stage_start_time):
+    startup_timings.append((stage_name, time.perf_counter() - stage_start_time))
+
+def print_startup_breakdown():
+    print("[STARTUP] Tempos de arranque:")
+    for stage_name, seconds in startup_timings:
+        print(f"  - {stage_name}: {seconds:.2f}s")
+    print(f"  = total: {sum(seconds for _, seconds in startup_timings):.2f}s")
+
+# --- Funções de Interação com Ollama (LLM Principal - call_ollama_generate, list_ollama_models) ---
+def get_ollama_client():
+    """Cliente Ollama partilhado (pool de ligações keep-alive) usado pelo LLM principal e pelo auxiliar."""
+    return get_shared_client(OLLAMA_API_BASE_URL, OLLAMA_REQUEST_TIMEOUT_SECONDS, response_cache=llm_response_cache,
+                             base_urls=OLLAMA_API_BASE_URLS or None)
 
-# --- Funções de Interação com Ollama (LLM Principal - call_ollama_generate, list_ollama_models - como antes) ---
 def list_ollama_models():
-    # (Implementação como antes)
     try:
-        response = requests.get(f"{OLLAMA_API_BASE_URL}{OLLAMA_TAGS_ENDPOINT_SUFFIX}", timeout=10)
-        response.raise_for_status()
-        models_data = response.json()
-        available_models = [model["name"] for model in models_data.get("models", [])]
+        models_data = get_ollama_client().list_models()
+        available_models = [model["name"] for model in models_data]
         if not available_models:
             print("[WARNING] No models found via Ollama API. Using a minimal default list.")
-            return ["qwen2:0.5b"]
+            return [AUX_LLM_MODEL_NAME]
         print(f"[INFO] Successfully fetched {len(available_models)} models from Ollama.")
         return available_models
     except Exception as e:
         print(f"[WARNING] Could not fetch models from Ollama: {e}. Using a minimal default list.")
-        return ["qwen2:0.5b"]
+        return [AUX_LLM_MODEL_NAME]
+
+def call_ollama_generate_with_metrics(model_name, system_prompt, user_prompt_with_data, target_doc_name_for_info="", options=None):
+    """
+    Como call_ollama_generate, mas devolve (texto, métricas do chunk 'done' ou None).
+    No modo estruturado (ASSESSMENT_MODE), o texto é o objeto de avaliação JSON (indentado) e o stream é fechado
+    assim que o objeto completo e válido chega.
+    """
+    structured = ASSESSMENT_MODE == "structured"
+    try:
+        response = get_ollama_client().generate(model_name, user_prompt_with_data, system=system_prompt, options=options, keep_alive=OLLAMA_KEEP_ALIVE_DURATION,
+                                                format=ASSESSMENT_JSON_SCHEMA if structured else None, think=ASSESSMENT_THINK,
+                                                early_stop_factory=(lambda: JsonObjectStreamDetector().feed) if structured else None)
+        final_assessment_text = response.text.strip()
+        if "<think>" in final_assessment_text: final_assessment_text = re.sub(r"<think>.*?</think>\s*", "", final_assessment_text, flags=re.DOTALL).strip()
+        if not final_assessment_text:
+            if response.done_chunk.get("error"): return f"Error in LLM 'done' signal: {response.done_chunk.get('error')}", response.metrics
+            return "Warning: LLM produced an empty response.", response.metrics
+        if structured:
+            assessment, problems = parse_assessment(final_assessment_text)
+            if assessment is None or problems:
+                return f"Warning: LLM did not return a valid structured assessment ({'; '.join(problems)}).\n{final_assessment_text}", response.metrics
+            final_assessment_text = json.dumps(assessment, ensure_ascii=False, indent=2)
+        return final_assessment_text, response.metrics
+    except OllamaClientError as e:
+        if e.kind == "stream": return f"Error from Ollama API Stream: {e}", None
+        if e.kind == "http": return f"Error: Ollama HTTPError for '{target_doc_name_for_info}': {e}. Response: {e.response_text or 'N/A'}", None
+        return f"Error: Ollama RequestException for '{target_doc_name_for_info}': {e}", None
+    except Exception as e_call: return f"Error: Unexpected Ollama call error for '{target_doc_name_for_info}': {e_call}", None
+
+def is_llm_error_text(llm_assessment_text):
+    """Erros devolvidos por call_ollama_generate_with_metrics: 'Error: ...', 'Error from Ollama API Stream: ...', "Error in LLM 'done' signal: ..."."""
+    return llm_assessment_text.startswith("Error")
 
 def call_ollama_generate(model_name, system_prompt, user_prompt_with_data, target_doc_name_for_info=""):
-    # (Implementação como antes)
-    payload = { "model": model_name, "system": system_prompt, "prompt": user_prompt_with_data, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE_DURATION }
-    endpoint = f"{OLLAMA_API_BASE_URL}{OLLAMA_GENERATE_ENDPOINT_SUFFIX}"
-    full_response_content = []; raw_done_chunk_for_debug = None; http_status = None
+    return call_ollama_generate_with_metrics(model_name, system_prompt, user_prompt_with_data, target_doc_name_for_info)[0]
+
+def analysis_environment_version_parts(use_rag_flag):
+    """
+    Estado fora dos prompts que muda a resposta, para compute_prompt_version: espelho de schemas ($ref resolvidos no JSON)
+    e, com RAG, o backend vetorial e a versão do índice (contexto recuperado).
+    """
+    return (schema_ref_resolver.version() if schema_ref_resolver is not None else None,
+            VECTOR_BACKEND if use_rag_flag else None,
+            retrieval_cache.current_version() if use_rag_flag else None)
+
+def load_json_for_prompt(json_filepath, doc_name):
+    """
+    Texto JSON a injetar nos prompts. Em modo 'condensed' usa sempre a forma condensada (json_condenser.py);
+    em modo 'raw' usa o ficheiro original se couber em JSON_PROMPT_BUDGET_CHARS e condensa apenas acima disso.
+    Se existir o espelho de schemas, os '$ref' são resolvidos (e condensados) antes, em ambos os modos.
+    Ficheiros que não são JSON válido são cortados no orçamento (com aviso).
+    """
+    if JSON_PROMPT_MODE == "raw" and schema_ref_resolver is None and os.path.getsize(json_filepath) <= JSON_PROMPT_BUDGET_CHARS:
+        with open(json_filepath, 'r', encoding='utf-8') as f: return f.read()
     try:
-        with requests.post(endpoint, json=payload, timeout=OLLAMA_REQUEST_TIMEOUT_SECONDS, stream=True) as response:
-            http_status = response.status_code; response.raise_for_status()
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8', errors='ignore')
-                    try:
-                        chunk = json.loads(decoded_line)
-                        if "response" in chunk and chunk["response"]: full_response_content.append(chunk["response"])
-                        if chunk.get("done", False): raw_done_chunk_for_debug = chunk; break
-                        if "error" in chunk: return f"Error from Ollama API Stream: {chunk['error']}"
-                    except json.JSONDecodeError: pass
-                    except Exception as e_chunk: print(f"[ERROR] Proc stream chunk for '{target_doc_name_for_info}': {e_chunk}")
-            final_assessment_text = "".join(full_response_content).strip()
-            if "<think>" in final_assessment_text: final_assessment_text = re.sub(r"<think>.*?</think>\s*", "", final_assessment_text, flags=re.DOTALL).strip()
-            if not final_assessment_text:
-                if raw_done_chunk_for_debug and raw_done_chunk_for_debug.get("error"): return f"Error in LLM 'done' signal: {raw_done_chunk_for_debug.get('error')}"
-                return "Warning: LLM produced an empty response."
-            return final_assessment_text
-    except requests.exceptions.HTTPError as http_err: return f"Error: Ollama HTTPError for '{target_doc_name_for_info}': {http_err}. Response: {http_err.response.text[:200] if http_err.response else 'N/A'}"
-    except requests.exceptions.RequestException as e: return f"Error: Ollama RequestException for '{target_doc_name_for_info}': {e}"
-    except Exception as e_call: return f"Error: Unexpected Ollama call error for '{target_doc_name_for_info}': {e_call}"
+        condensed_text, report = condense_json_file(json_filepath, JSON_PROMPT_BUDGET_CHARS,
+                                                    transform=schema_ref_resolver.resolve if schema_ref_resolver else None)
+    except ValueError as e_invalid:
+        print(f"[WARNING] {e_invalid}. A usar o texto original (até {JSON_PROMPT_BUDGET_CHARS} caracteres).")
+        with open(json_filepath, 'r', encoding='utf-8', errors='replace') as f: return f.read(JSON_PROMPT_BUDGET_CHARS)
+    print(f"[JSON CONDENSER] '{doc_name}': {report['original_bytes']} bytes -> {report['condensed_chars']} caracteres "
+          f"(nível {report['level']}, {'schema' if report['is_schema'] else 'dados'}).")
+    return condensed_text
 
 # --- Funções Auxiliares (load_prompt_template, get_json_files_from_dir - como antes) ---
 def load_prompt_template(prompt_filename):
@@ -100,10 +217,11 @@ def get_json_files_from_dir(directory_path):
 class DummyLogger:
     # (Implementação como antes)
     current_log_filepath = None
-    def initialize_logger(self, *args, **kwargs): pass
+    def initialize_logger(self, *args, **kwargs): return None
     def log_interaction(self, *args, **kwargs): pass
     def log_error_interaction(self, *args, **kwargs): pass
     def log_run_summary(self, *args, **kwargs): print("[DUMMY LOGGER] Skipping run summary log.")
+    def flush_logs(self, *args, **kwargs): pass
     def format_duration(self, seconds):
         if seconds is None or seconds < 0: return "N/A"
         if seconds < 60: return f"{seconds:.2f}s"
@@ -154,18 +272,34 @@ def prompt_user_for_run_mode(all_available_ollama_models):
 
 # --- Novas Funções RAG com LlamaIndex ---
 def load_llamaindex_index(persist_dir, collection_name, embed_model_name_for_query):
-    """Carrega um VectorStoreIndex LlamaIndex persistido do ChromaDB."""
+    """Carrega um VectorStoreIndex LlamaIndex persistido do ChromaDB (ou o índice mmap exportado, com ANALYZER_VECTOR_BACKEND=mmap)."""
     if not os.path.exists(persist_dir):
         print(f"[LlamaIndex LOAD ERROR] Diretório de persistência '{persist_dir}' não encontrado.")
         print("  Execute o script 'index_documents_llamaindex.py' primeiro.")
         return None
+    if VECTOR_BACKEND == "mmap":
+        mmap_index = load_mmap_vector_index(persist_dir, embed_model_name_for_query)
+        if mmap_index is not None:
+            return mmap_index
+        print("[LlamaIndex LOAD WARNING] Índice mmap indisponível: a usar o ChromaDB.")
     try:
+        stage_start = time.perf_counter()
+        from llama_index.core import VectorStoreIndex
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        import chromadb # Cliente ChromaDB
+        record_startup_stage("imports llama_index/chromadb", stage_start)
+
         print(f"[LlamaIndex LOAD INFO] A carregar índice de '{persist_dir}', coleção '{collection_name}'...")
+        stage_start = time.perf_counter()
         chroma_client = chromadb.PersistentClient(path=persist_dir)
         chroma_collection = chroma_client.get_collection(collection_name) # get_collection, não get_or_create
+        record_startup_stage("cliente/coleção Chroma", stage_start)
         
         # Configurar o modelo de embedding para consulta (deve ser o mesmo da indexação)
+        stage_start = time.perf_counter()
         query_embed_model = HuggingFaceEmbedding(model_name=embed_model_name_for_query)
+        record_startup_stage("modelo de embedding", stage_start)
         
         vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
         index = VectorStoreIndex.from_vector_store(
@@ -173,13 +307,45 @@ def load_llamaindex_index(persist_dir, collection_name, embed_model_name_for_que
             embed_model=query_embed_model # Importante para queries
         )
         print(f"[LlamaIndex LOAD INFO] Índice carregado com sucesso. {chroma_collection.count()} itens na coleção.")
+        retrieval_cache.bind_index(embed_model_name_for_query, lambda: compute_index_version(persist_dir, chroma_collection.count()),
+                                   lambda: chroma_change_signal(persist_dir, chroma_collection), embed_model=query_embed_model)
         return index
     except Exception as e:
         print(f"[LlamaIndex LOAD ERROR] Falha ao carregar índice LlamaIndex/Chroma: {e}")
         print("  Certifique-se que a coleção existe e o modelo de embedding é compatível.")
         return None
 
-def generate_subqueries_with_llamaindex_llm(aux_llm_model: Ollama, # Tipo Ollama do LlamaIndex
+def load_mmap_vector_index(persist_dir, embed_model_name_for_query):
+    """Índice mmap exportado pelo indexador (persist_dir/mmap_index), com a interface usada pelos caminhos RAG; None se não existir."""
+    from mmap_vector_index import MmapVectorIndex, MmapVectorStoreIndex, MMAP_INDEX_DIR_NAME
+    index_dir = os.path.join(persist_dir, MMAP_INDEX_DIR_NAME)
+    try:
+        stage_start = time.perf_counter()
+        mmap_index = MmapVectorIndex(index_dir, rerank_factor=VECTOR_RERANK_FACTOR)
+        record_startup_stage("índice mmap", stage_start)
+    except FileNotFoundError:
+        print(f"[LlamaIndex LOAD WARNING] '{index_dir}' não existe. Execute 'index_documents_llamaindex.py' para exportar o índice.")
+        return None
+    except Exception as e:
+        print(f"[LlamaIndex LOAD ERROR] Falha ao abrir o índice mmap '{index_dir}': {e}")
+        return None
+    if mmap_index.manifest.get("embed_model") not in (None, embed_model_name_for_query):
+        print(f"[LlamaIndex LOAD ERROR] Índice mmap exportado com '{mmap_index.manifest['embed_model']}', esperado '{embed_model_name_for_query}'.")
+        return None
+    if mmap_index.index_version != compute_index_version(persist_dir, mmap_index.count()):
+        print("[LlamaIndex LOAD WARNING] O índice mmap é anterior à última indexação (desatualizado). Execute o indexador para o exportar de novo.")
+
+    stage_start = time.perf_counter()
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    query_embed_model = HuggingFaceEmbedding(model_name=embed_model_name_for_query)
+    record_startup_stage("modelo de embedding", stage_start)
+    print(f"[LlamaIndex LOAD INFO] Índice mmap carregado ({mmap_index.count()} nós, {mmap_index.manifest['dtype']}, "
+          f"quantização {mmap_index.quantization}" + (f", reordenação {mmap_index.rerank_factor}x" if mmap_index.quantization != "none" else "") + ").")
+    # Exportação só de leitura: a versão é a da exportação (um índice novo só é visto ao reabrir)
+    retrieval_cache.bind_index(embed_model_name_for_query, lambda: mmap_index.index_version or "mmap", embed_model=query_embed_model)
+    return MmapVectorStoreIndex(mmap_index, query_embed_model)
+
+def generate_subqueries_with_llamaindex_llm(aux_llm_model: OllamaChatModel, # LLM auxiliar (cliente Ollama partilhado)
                                             system_prompt_sq_gen, user_template_sq_gen,
                                             document_content_excerpt, document_name, project_context_summary,
                                             num_queries=3):
@@ -195,17 +361,15 @@ def generate_subqueries_with_llamaindex_llm(aux_llm_model: Ollama, # Tipo Ollama
         project_context_summary=project_context_summary
     )
     
-    # Formato de mensagem para o LLM do LlamaIndex
-    from llama_index.core.llms import ChatMessage, MessageRole
+    # Formato de mensagem da API /chat do Ollama
     messages = [
-        ChatMessage(role=MessageRole.SYSTEM, content=system_prompt_sq_gen),
-        ChatMessage(role=MessageRole.USER, content=user_prompt_sq_formatted)
+        {"role": "system", "content": system_prompt_sq_gen},
+        {"role": "user", "content": user_prompt_sq_formatted}
     ]
     
     print(f"[SQ GEN LLAMA] A gerar ~{num_queries} sub-perguntas para '{document_name}' usando {aux_llm_model.model}...")
     try:
-        response = aux_llm_model.chat(messages)
-        subqueries_raw_output = response.message.content
+        subqueries_raw_output = aux_llm_model.chat(messages)
     except Exception as e:
         print(f"[SQ GEN LLAMA ERROR] Falha ao chamar LLM para sub-perguntas: {e}")
         return []
@@ -222,30 +386,116 @@ def generate_subqueries_with_llamaindex_llm(aux_llm_model: Ollama, # Tipo Ollama
     return subqueries_list[:num_queries]
 
 
-def answer_subquestions_with_llamaindex_rag(index: VectorStoreIndex, aux_llm_model: Ollama, 
+def retrieve_nodes_for_queries(index: VectorStoreIndex, queries: list[str], k_per_query=2, query_embeddings=None):
+    """
+    Recupera os top-k nós para várias queries de uma vez: um único encode em batch de todas as queries
+    (se query_embeddings não for dado; modelo associado em load_llamaindex_index) e uma única consulta à coleção Chroma (query_embeddings múltiplos).
+    Retorna uma lista (na ordem das queries) de listas de NodeWithScore.
+    """
+    from llama_index.core.schema import NodeWithScore
+
+    if query_embeddings is None:
+        query_embeddings = retrieval_cache.embed_queries(queries)
+    chroma_collection = getattr(index.vector_store, "client", None) # ChromaVectorStore.client é a coleção Chroma
+    if chroma_collection is None or not hasattr(chroma_collection, "query"):
+        # Vector store sem consulta múltipla: uma consulta por query, mas com os embeddings já calculados
+        from llama_index.core.vector_stores.types import VectorStoreQuery
+        results_per_query = []
+        for query_embedding in query_embeddings:
+            query_result = index.vector_store.query(VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=k_per_query))
+            similarities = query_result.similarities or [None] * len(query_result.nodes or [])
+            results_per_query.append([NodeWithScore(node=n, score=sc) for n, sc in zip(query_result.nodes or [], similarities)])
+        return results_per_query
+
+    chroma_results = chroma_collection.query(query_embeddings=query_embeddings, n_results=k_per_query,
+                                             include=["documents", "metadatas", "distances"])
+    results_per_query = []
+    for ids, documents, metadatas, distances in zip(chroma_results["ids"], chroma_results["documents"],
+                                                    chroma_results["metadatas"], chroma_results["distances"]):
+        results_per_query.append([NodeWithScore(node=node_from_chroma_row(node_id, text, metadata), score=math.exp(-distance))
+                                  for node_id, text, metadata, distance in zip(ids, documents, metadatas, distances)])
+    return results_per_query
+
+
+def node_from_chroma_row(node_id, text, metadata):
+    """TextNode a partir de uma linha da coleção Chroma (id, documento, metadados)."""
+    from llama_index.core.schema import TextNode
+    from llama_index.core.vector_stores.utils import metadata_dict_to_node
+    try:
+        node = metadata_dict_to_node(metadata)
+        node.set_content(text)
+    except Exception: # Entradas sem '_node_content' (não escritas pelo LlamaIndex)
+        node = TextNode(text=text, id_=node_id, metadata=metadata or {})
+    return node
+
+
+def retrieve_nodes_cached(index: VectorStoreIndex, query: str, similarity_top_k: int):
+    """
+    Top-k nós para uma query com as caches de retrieval_cache: resultados (IDs e scores) já conhecidos para esta
+    versão do índice são lidos da coleção por ID; caso contrário a query é embutida (ou o embedding vem da cache)
+    e pesquisada com um retriever reutilizado. Retorna uma lista de NodeWithScore.
+    """
+    from llama_index.core.schema import NodeWithScore, QueryBundle
+
+    cached_results = retrieval_cache.get_results(query, similarity_top_k)
+    chroma_collection = getattr(index.vector_store, "client", None) # ChromaVectorStore.client é a coleção Chroma
+    if cached_results is not None and not cached_results:
+        return []
+    if cached_results is not None and hasattr(chroma_collection, "get"):
+        rows = chroma_collection.get(ids=[node_id for node_id, _ in cached_results], include=["documents", "metadatas"])
+        nodes_by_id = {node_id: node_from_chroma_row(node_id, text, metadata)
+                       for node_id, text, metadata in zip(rows["ids"], rows["documents"], rows["metadatas"])}
+        if len(nodes_by_id) == len(cached_results):
+            return [NodeWithScore(node=nodes_by_id[node_id], score=score) for node_id, score in cached_results]
+        # Algum nó desapareceu entretanto (a verificação da versão ainda não correu): pesquisar de novo
+
+    query_embedding = retrieval_cache.embed_queries([query])[0]
+    retrieved_nodes = retrieval_cache.retriever(index, similarity_top_k).retrieve(QueryBundle(query_str=query, embedding=query_embedding))
+    retrieval_cache.put_results(query, similarity_top_k, [(node_ws.node.node_id, node_ws.score) for node_ws in retrieved_nodes])
+    return retrieved_nodes
+
+
+def answer_subquestions_with_llamaindex_rag(index: VectorStoreIndex, aux_llm_model: OllamaChatModel, 
                                            subqueries: list[str], prompt_answer_template: str, 
-                                           k_per_query=2, max_chars_per_doc_in_sub_answer_ctx=500):
+                                           k_per_query=2, max_chars_per_doc_in_sub_answer_ctx=500,
+                                           max_concurrent_answers=None):
     """
-    Para cada sub-pergunta, recupera contexto e usa um LLM para gerar uma resposta.
-    Retorna uma lista de (sub_pergunta, resposta_llm_para_sub_pergunta).
+    Recupera contexto para todas as sub-perguntas numa única passagem (embedding em batch + uma consulta ao
+    vector store) e gera as respostas com o LLM auxiliar em paralelo (até max_concurrent_answers).
+    Sub-perguntas semelhantes a uma já respondida (subquestion_answer_cache) reutilizam a resposta, sem recuperação nem LLM.
+    Retorna (lista, na ordem das sub-perguntas, de (sub_pergunta, resposta_llm_para_sub_pergunta), todas_respondidas);
+    todas_respondidas é False se alguma resposta for uma mensagem de erro.
     """
     if not index or not aux_llm_model or not subqueries or not prompt_answer_template:
         print("[SUB ANSWER WARNING] Parâmetros em falta para responder sub-perguntas.")
-        return []
+        return [], False
 
-    qa_pairs = []
-    retriever = index.as_retriever(similarity_top_k=k_per_query)
     print(f"[SUB ANSWER RAG] A processar {len(subqueries)} sub-perguntas...")
+    answer_namespace = compute_answer_namespace(aux_llm_model.model, prompt_answer_template,
+                                                {"k_per_query": k_per_query, "max_chars": max_chars_per_doc_in_sub_answer_ctx})
+    try:
+        retrieval_cache.current_version() # Se a coleção mudou, a cache semântica também descarta as respostas antigas
+        query_embeddings = retrieval_cache.embed_queries(subqueries)
+        cached_answers = [subquestion_answer_cache.lookup(answer_namespace, query_embedding) for query_embedding in query_embeddings]
+        pending = [i for i, cached in enumerate(cached_answers) if cached is None]
+        retrieved_nodes_per_subquery = dict(zip(pending, retrieve_nodes_for_queries(
+            index, [subqueries[i] for i in pending], k_per_query, query_embeddings=[query_embeddings[i] for i in pending]))) if pending else {}
+    except Exception as e_batch:
+        print(f"    [SUB ANSWER ERROR] Falha na recuperação em batch: {e_batch}")
+        return [(sub_q_text, f"Erro ao gerar resposta para esta sub-pergunta: {e_batch}") for sub_q_text in subqueries], False
 
-    for i, sub_q_text in enumerate(subqueries):
+    def answer_one(i):
+        sub_q_text = subqueries[i]
+        if cached_answers[i] is not None:
+            cached_answer, cached_question, similarity = cached_answers[i]
+            print(f"  Sub-pergunta {i+1}/{len(subqueries)} respondida pela cache semântica (cosseno {similarity:.3f} com \"{cached_question[:80]}\").")
+            return (sub_q_text, cached_answer), True
+        retrieved_nodes = retrieved_nodes_per_subquery[i]
         print(f"  Processando Sub-pergunta {i+1}/{len(subqueries)}: \"{sub_q_text[:100]}...\"")
         try:
-            retrieved_nodes = retriever.retrieve(sub_q_text)
-            
             if not retrieved_nodes:
                 print(f"    Nenhum documento encontrado para a sub-pergunta.")
-                qa_pairs.append((sub_q_text, "Contexto RAG não encontrou documentos relevantes para esta sub-pergunta."))
-                continue
+                return (sub_q_text, "Contexto RAG não encontrou documentos relevantes para esta sub-pergunta."), True
 
             # Formatar contexto recuperado para esta sub-pergunta
             sub_q_retrieved_context_parts = []
@@ -264,22 +514,28 @@ def answer_subquestions_with_llamaindex_rag(index: VectorStoreIndex, aux_llm_mod
             )
             
             # Usar o LLM auxiliar para responder
-            from llama_index.core.llms import ChatMessage, MessageRole # Reimportar aqui para clareza
             messages_for_sub_answer = [
                 # Poderia ter um system prompt aqui se necessário para o LLM que responde
-                ChatMessage(role=MessageRole.USER, content=user_prompt_for_sub_answer)
+                {"role": "user", "content": user_prompt_for_sub_answer}
             ]
-            response = aux_llm_model.chat(messages_for_sub_answer)
-            answer_text = response.message.content.strip()
+            answer_text = aux_llm_model.chat(messages_for_sub_answer).strip()
+            if answer_text:
+                subquestion_answer_cache.store(answer_namespace, sub_q_text, query_embeddings[i], answer_text)
             
-            print(f"    Resposta LLM à sub-pergunta: \"{answer_text[:100]}...\"")
-            qa_pairs.append((sub_q_text, answer_text))
+            print(f"    Resposta LLM à sub-pergunta {i+1}: \"{answer_text[:100]}...\"")
+            return (sub_q_text, answer_text), True
 
         except Exception as e_sub_ans:
             print(f"    [SUB ANSWER ERROR] Erro ao processar sub-pergunta '{sub_q_text}': {e_sub_ans}")
-            qa_pairs.append((sub_q_text, f"Erro ao gerar resposta para esta sub-pergunta: {e_sub_ans}"))
-            
-    return qa_pairs
+            return (sub_q_text, f"Erro ao gerar resposta para esta sub-pergunta: {e_sub_ans}"), False
+
+    workers = max(1, min(max_concurrent_answers or SUBQUESTION_ANSWER_MAX_CONCURRENCY, len(subqueries)))
+    if workers == 1:
+        answers = [answer_one(i) for i in range(len(subqueries))]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sub_answer") as executor:
+            answers = list(executor.map(answer_one, range(len(subqueries)))) # map preserva a ordem das sub-perguntas
+    return [qa_pair for qa_pair, _ in answers], all(answered for _, answered in answers)
 
 
 def format_qa_pairs(qa_pairs_list: list[tuple[str, str]]):
@@ -295,27 +551,29 @@ def format_qa_pairs(qa_pairs_list: list[tuple[str, str]]):
 
 def get_context_with_llamaindex(use_rag_flag, rag_type,
                                 llamaindex_index: VectorStoreIndex, # O índice LlamaIndex carregado
-                                aux_llm_model_llamaindex: Ollama, # LLM LlamaIndex para tarefas RAG
+                                aux_llm_model_llamaindex: OllamaChatModel, # LLM auxiliar para tarefas RAG
                                 system_subquery_gen_prompt, user_subquery_gen_template, # Para gerar SQs
                                 prompt_answer_subquestion_text, # Template para responder SQs
                                 raw_json_str, doc_name, project_context_summary,
-                                num_subqueries=3, k_per_subquery=2):
-    """Orquestra a obtenção de contexto RAG usando LlamaIndex."""
+                                num_subqueries=RAG_NUM_SUBQUERIES, k_per_subquery=RAG_K_PER_SUBQUERY):
+    """
+    Orquestra a obtenção de contexto RAG usando LlamaIndex. Devolve (contexto, sucesso): sem sucesso o texto
+    descreve a falha (vai na mesma para o prompt) e o contexto não deve ser guardado para reutilização.
+    """
     if not use_rag_flag or rag_type == "none":
-        return "RAG não solicitado para esta análise."
+        return "RAG não solicitado para esta análise.", True
     if not llamaindex_index:
-        return "Contexto RAG: Índice LlamaIndex não disponível."
+        return "Contexto RAG: Índice LlamaIndex não disponível.", False
 
     if rag_type == "simple_docs_llamaindex":
         print(f"[RAG SIMPLE LLAMA] A obter contexto para '{doc_name}'...")
         try:
-            retriever = llamaindex_index.as_retriever(similarity_top_k=k_per_subquery + 1)
             json_excerpt = raw_json_str[:250]
             simple_query = f"Informação PII e de proteção de dados relevante para o documento '{doc_name}'. Excerto do conteúdo: {json_excerpt}"
-            retrieved_nodes = retriever.retrieve(simple_query) # Retorna lista de NodeWithScore
+            retrieved_nodes = retrieve_nodes_cached(llamaindex_index, simple_query, k_per_subquery + 1) # Retorna lista de NodeWithScore
             
             if not retrieved_nodes:
-                return "Contexto RAG Simples (LlamaIndex): Nenhum documento relevante encontrado."
+                return "Contexto RAG Simples (LlamaIndex): Nenhum documento relevante encontrado.", True
 
             # Formatar os nós recuperados manualmente para contexto bruto
             context_parts = []
@@ -324,14 +582,14 @@ def get_context_with_llamaindex(use_rag_flag, rag_type,
                 content_preview = node_ws.node.get_content()[:700] # Usar get_content()
                 if len(node_ws.node.get_content()) > 700: content_preview += "..."
                 context_parts.append(f"Contexto do Documento '{source}':\n{content_preview}")
-            return "\n\n---\n\n".join(context_parts)
+            return "\n\n---\n\n".join(context_parts), True
         except Exception as e:
-            return f"Contexto RAG Simples (LlamaIndex): Erro durante a recuperação - {str(e)[:150]}"
+            return f"Contexto RAG Simples (LlamaIndex): Erro durante a recuperação - {str(e)[:150]}", False
 
     elif rag_type == "multi_step_qa_llamaindex":
         print(f"[RAG MULTI-STEP QA LLAMA] Iniciando para '{doc_name}'...")
         if not aux_llm_model_llamaindex:
-            return "Contexto RAG Multi-Step Q&A: LLM auxiliar (LlamaIndex) não configurado."
+            return "Contexto RAG Multi-Step Q&A: LLM auxiliar (LlamaIndex) não configurado.", False
 
         # 1. Gerar Sub-Perguntas
         document_content_excerpt_for_sq = raw_json_str[:500]
@@ -341,22 +599,193 @@ def get_context_with_llamaindex(use_rag_flag, rag_type,
             num_queries=num_subqueries
         )
         if not subqueries:
-            return "Contexto RAG Multi-Step Q&A: Falha ao gerar sub-perguntas."
+            return "Contexto RAG Multi-Step Q&A: Falha ao gerar sub-perguntas.", False
 
         # 2. Responder a cada sub-pergunta usando RAG
-        qa_pairs = answer_subquestions_with_llamaindex_rag(
+        qa_pairs, all_answered = answer_subquestions_with_llamaindex_rag(
             llamaindex_index, aux_llm_model_llamaindex,
             subqueries, prompt_answer_subquestion_text,
             k_per_query=k_per_subquery
         )
         if not qa_pairs:
-            return "Contexto RAG Multi-Step Q&A: Falha ao gerar respostas para sub-perguntas."
+            return "Contexto RAG Multi-Step Q&A: Falha ao gerar respostas para sub-perguntas.", False
 
         # 3. Formatar os pares Q+A para o LLM principal
         formatted_qa_context = format_qa_pairs(qa_pairs)
-        return formatted_qa_context
+        return formatted_qa_context, all_answered
     else:
-        return f"Tipo de RAG (LlamaIndex) desconhecido: {rag_type}."
+        return f"Tipo de RAG (LlamaIndex) desconhecido: {rag_type}.", False
+
+
+# --- Análise de um único documento (usada em modo sequencial e concorrente) ---
+def analyze_single_document(*args, **kwargs):
+    """
+    Lê o ficheiro, obtém o contexto RAG, formata os prompts e chama o LLM principal
+    (as duas etapas, prepare_document_analysis e finish_document_analysis, seguidas; argumentos como em prepare_document_analysis).
+    Retorna um dicionário com 'doc_name', 'status' ('success', 'warning', 'error'), 'llm_duration',
+    'llm_metrics' (métricas do servidor Ollama, ver ollama_client.extract_generation_metrics) e
+    'stage_timings' (segundos por etapa: leitura, contexto RAG, formatação, LLM, log e total),
+    'token_report' (contagem de tokens por secção, ver token_budget.py; None se o orçamento estiver desativado)
+    e 'assessment' (texto devolvido pelo LLM principal, None se não chegou a ser chamado).
+    Com run_journal em modo de retoma, unidades já concluídas não são repetidas: o resultado vem do journal ('resumed': True).
+    progress_callback(doc_name, etapa, segundos), se definido, é chamado no fim de cada etapa (ex: pelo serviço HTTP).
+    """
+    return finish_document_analysis(prepare_document_analysis(*args, **kwargs))
+
+
+def prepare_document_analysis(file_position, total_files, json_filepath,
+                              model_to_use_main_llm, system_prompt_base, user_template_base, project_context,
+                              use_rag_flag, rag_type, llamaindex_index, aux_llm_llamaindex,
+                              system_subquery_gen_prompt, user_subquery_gen_template, prompt_answer_subquestion_text,
+                              logger_module, current_analysis_description, rag_context_store=None, log_filepath=None,
+                              run_journal=None, prompt_version=None, progress_callback=None):
+    """
+    Primeira etapa (journal, leitura do JSON e contexto RAG, que usa o LLM auxiliar). Devolve o estado para
+    finish_document_analysis; com state["finished"] (unidade retomada do journal ou erro de leitura) state["result"] já é final.
+    """
+    doc_name = os.path.basename(json_filepath)
+    if ASSESSMENT_MODE == "structured": # Instrução com o schema (chavetas escapadas para .format)
+        user_template_base = user_template_base + STRUCTURED_OUTPUT_INSTRUCTION.replace("{", "{{").replace("}", "}}")
+    stage_timings = {}
+    result = {"doc_name": doc_name, "status": "error", "llm_duration": 0.0, "llm_metrics": None, "stage_timings": stage_timings, "token_report": None,
+              "assessment": None}
+    def report_progress(stage):
+        if progress_callback is not None: progress_callback(doc_name, stage, stage_timings.get(stage))
+    document_start_time = stage_start = time.perf_counter()
+    unit_key = doc_sha256 = None
+    if run_journal is not None:
+        try:
+            doc_sha256 = compute_file_sha256(json_filepath)
+            unit_key = compute_unit_key(model_to_use_main_llm, doc_sha256, rag_type if use_rag_flag else "none", prompt_version)
+            journal_entry = run_journal.completed_entry(unit_key)
+        except OSError as e_hash:
+            print(f"[RUN JOURNAL WARNING] Não foi possível calcular o hash de '{doc_name}': {e_hash}"); journal_entry = None
+        if journal_entry:
+            print(f"[RUN JOURNAL] '{doc_name}' já concluído com '{model_to_use_main_llm}' em {journal_entry['completed_at']}: a saltar.")
+            result.update(status=journal_entry["status"], llm_duration=journal_entry["llm_duration"], llm_metrics=journal_entry.get("llm_metrics"), resumed=True)
+            stage_timings["total"] = time.perf_counter() - document_start_time
+            return {"finished": True, "result": result}
+    print(f"\n--- Analisando ficheiro {file_position}/{total_files}: {doc_name} ---")
+    raw_json_str = ""
+    # Conteúdo JSON para os prompts: condensado (schema-aware, sempre JSON válido) ou o texto original se couber no orçamento
+    try:
+        raw_json_str = load_json_for_prompt(json_filepath, doc_name)
+    except Exception as e: print(f"[ERROR] Could not read JSON '{json_filepath}': {e}"); logger_module.log_error_interaction(doc_name, current_analysis_description, "N/A", "File read error", f"File reading error: {e}", log_filepath=log_filepath); return {"finished": True, "result": result}
+    stage_timings["read"] = time.perf_counter() - stage_start; stage_start = time.perf_counter()
+    report_progress("read")
+
+    # Obter contexto RAG usando LlamaIndex (construído uma única vez por documento se houver armazém)
+    def build_rag_context(): # -> (contexto, sucesso)
+        return get_context_with_llamaindex(
+            use_rag_flag, rag_type,
+            llamaindex_index,
+            aux_llm_llamaindex, # Passar o LLM auxiliar
+            system_subquery_gen_prompt, user_subquery_gen_template,
+            prompt_answer_subquestion_text, # Novo prompt para responder sub-perguntas
+            raw_json_str, doc_name, project_context
+        )
+    if rag_context_store is not None and use_rag_flag and rag_type != "none":
+        context_key = compute_context_key(
+            raw_json_str, doc_name, rag_type,
+            aux_llm_llamaindex.model if aux_llm_llamaindex else None,
+            prompt_texts=(system_subquery_gen_prompt, user_subquery_gen_template, prompt_answer_subquestion_text, project_context),
+            extra_params={"index_version": retrieval_cache.current_version(), "vector_backend": VECTOR_BACKEND,
+                          "num_subqueries": RAG_NUM_SUBQUERIES, "k_per_subquery": RAG_K_PER_SUBQUERY}
+        )
+        actual_rag_context, context_reused = rag_context_store.get_or_build(context_key, build_rag_context, doc_name, rag_type)
+        if context_reused: print(f"[RAG CONTEXT STORE] Contexto RAG reutilizado para '{doc_name}'.")
+    else:
+        actual_rag_context, _ = build_rag_context()
+    stage_timings["rag_context"] = time.perf_counter() - stage_start
+    report_progress("rag_context")
+    return {
+        "finished": False, "result": result, "doc_name": doc_name, "stage_timings": stage_timings, "report_progress": report_progress,
+        "document_start_time": document_start_time, "unit_key": unit_key, "doc_sha256": doc_sha256,
+        "raw_json_str": raw_json_str, "actual_rag_context": actual_rag_context,
+        "model_to_use_main_llm": model_to_use_main_llm, "system_prompt_base": system_prompt_base, "user_template_base": user_template_base,
+        "project_context": project_context, "use_rag_flag": use_rag_flag, "rag_type": rag_type, "logger_module": logger_module,
+        "current_analysis_description": current_analysis_description, "log_filepath": log_filepath,
+        "run_journal": run_journal, "prompt_version": prompt_version,
+    }
+
+
+def finish_document_analysis(state):
+    """Segunda etapa (orçamento de tokens, formatação dos prompts, LLM principal, log e journal). Devolve o resultado do documento."""
+    result = state["result"]
+    if state["finished"]: return result
+    doc_name, stage_timings, report_progress = state["doc_name"], state["stage_timings"], state["report_progress"]
+    raw_json_str, actual_rag_context, unit_key, doc_sha256 = state["raw_json_str"], state["actual_rag_context"], state["unit_key"], state["doc_sha256"]
+    model_to_use_main_llm, system_prompt_base, user_template_base = state["model_to_use_main_llm"], state["system_prompt_base"], state["user_template_base"]
+    project_context, use_rag_flag, rag_type = state["project_context"], state["use_rag_flag"], state["rag_type"]
+    logger_module, current_analysis_description, log_filepath = state["logger_module"], state["current_analysis_description"], state["log_filepath"]
+    run_journal, prompt_version = state["run_journal"], state["prompt_version"]
+    stage_start = time.perf_counter()
+
+    # Ajustar as secções grandes à janela de contexto do modelo (e retirar do sistema o que já vai no prompt do utilizador)
+    system_template_for_llm, user_template_for_llm = system_prompt_base, user_template_base
+    prompt_sections = {"project_context_summary": project_context, "raw_json_content": raw_json_str}
+    if use_rag_flag: prompt_sections["additional_rag_context"] = actual_rag_context
+    token_report = None
+    if TOKEN_BUDGET_ENABLED:
+        system_template_for_llm, user_template_for_llm, prompt_sections, token_report = token_budget_manager.fit_prompt(
+            model_to_use_main_llm, system_prompt_base, user_template_base, prompt_sections)
+        print(f"[TOKEN BUDGET] '{doc_name}': {format_token_report(token_report)}")
+    result["token_report"] = token_report
+    fitted_rag_context = prompt_sections.get("additional_rag_context", actual_rag_context)
+
+    # Formatar prompts principais (como antes)
+    prompt_format_args = {"document_name": doc_name, "raw_json_content": prompt_sections["raw_json_content"], "project_context_summary": prompt_sections["project_context_summary"]}
+    if "{additional_rag_context}" in user_template_for_llm: prompt_format_args["additional_rag_context"] = fitted_rag_context
+    try:
+        final_user_prompt_for_llm = user_template_for_llm.format(**prompt_format_args)
+    except KeyError as e_key: print(f"[ERROR] Placeholder user_template: {e_key}"); logger_module.log_error_interaction(doc_name, current_analysis_description, "N/A", "Template error", f"UK{e_key}", log_filepath=log_filepath); return result
+
+    system_prompt_format_args = {
+        "document_name": doc_name, "raw_json_content": prompt_sections["raw_json_content"],
+        "project_context_summary": prompt_sections["project_context_summary"],
+        "additional_rag_context": fitted_rag_context if use_rag_flag and "{additional_rag_context}" in system_template_for_llm else "RAG context not used/applicable in system prompt."
+    }
+    try:
+        final_system_prompt_for_llm = system_template_for_llm.format(**system_prompt_format_args)
+    except KeyError as e_key_sys:
+        print(f"[WARNING] Placeholder system_prompt: {e_key_sys}. Usando parcialmente formatado.")
+        temp_sys = system_template_for_llm
+        for k_s, v_s in system_prompt_format_args.items(): temp_sys = temp_sys.replace("{" + k_s + "}", str(v_s))
+        final_system_prompt_for_llm = temp_sys
+    except Exception as e_fmt_sys: print(f"[ERROR] Format system_prompt: {e_fmt_sys}"); final_system_prompt_for_llm = system_template_for_llm
+    stage_timings["prompt_format"] = time.perf_counter() - stage_start
+    report_progress("prompt_format")
+
+    # Chamada ao LLM Principal (Ollama API direta)
+    print(f"[INFO] Submetendo para LLM principal '{model_to_use_main_llm}' para '{doc_name}'.")
+    start_time_file_llm = time.perf_counter()
+    llm_assessment_text, llm_metrics = call_ollama_generate_with_metrics( # Sua função de chamada direta
+        model_to_use_main_llm,
+        final_system_prompt_for_llm,
+        final_user_prompt_for_llm,
+        target_doc_name_for_info=f"MainAnalysisFor_{doc_name}",
+        options=token_budget_manager.generation_options()
+    )
+    token_budget_manager.record_prompt_eval(model_to_use_main_llm, len(final_system_prompt_for_llm) + len(final_user_prompt_for_llm), llm_metrics)
+    end_time_file_llm = time.perf_counter(); file_llm_duration = end_time_file_llm - start_time_file_llm
+    result["llm_duration"] = stage_timings["llm"] = file_llm_duration; result["llm_metrics"] = llm_metrics; result["assessment"] = llm_assessment_text
+    report_progress("llm")
+    stage_start = time.perf_counter()
+    # Um único print para que o resultado não se misture com o de outros workers
+    print(f"\n[RESULT] Assessment by '{model_to_use_main_llm}' for '{doc_name}':\n"
+          + llm_assessment_text[:1000] + ('...' if len(llm_assessment_text) > 1000 else '')
+          + f"\n(Time for LLM analysis: {logger_module.format_duration(file_llm_duration)}; servidor: {format_generation_metrics(llm_metrics)})")
+    if is_llm_error_text(llm_assessment_text): logger_module.log_error_interaction(doc_name, current_analysis_description, final_system_prompt_for_llm, final_user_prompt_for_llm, llm_assessment_text, log_filepath=log_filepath)
+    else:
+        logger_module.log_interaction(doc_name, current_analysis_description, final_system_prompt_for_llm, final_user_prompt_for_llm, llm_assessment_text, log_filepath=log_filepath,
+                                      llm_metrics=format_generation_metrics(llm_metrics), prompt_token_report=format_token_report(token_report))
+        result["status"] = "warning" if llm_assessment_text.startswith("Warning:") else "success"
+    stage_timings["logging"] = time.perf_counter() - stage_start
+    report_progress("logging")
+    if unit_key is not None:
+        run_journal.record(unit_key, model_to_use_main_llm, doc_name, doc_sha256, rag_type if use_rag_flag else "none", prompt_version, result)
+    stage_timings["total"] = time.perf_counter() - state["document_start_time"]
+    return result
 
 
 # --- Função de Análise por Modelo (Atualizada para LlamaIndex) ---
@@ -365,126 +794,136 @@ def run_analysis_for_model(model_to_use_main_llm, # Nome do LLM principal (Ollam
                            system_prompt_base, user_template_base, project_context,
                            use_rag_flag, rag_type,
                            llamaindex_index: VectorStoreIndex, # Índice LlamaIndex
-                           aux_llm_llamaindex: Ollama, # Modelo LlamaIndex.Ollama para tarefas RAG
+                           aux_llm_llamaindex: OllamaChatModel, # LLM auxiliar (cliente Ollama partilhado) para tarefas RAG
                            system_subquery_gen_prompt, user_subquery_gen_template, # Para gerar SQs
                            prompt_answer_subquestion_text, # Para responder SQs
-                           logger_module, analysis_mode_key_for_log, current_analysis_description):
+                           logger_module, analysis_mode_key_for_log, current_analysis_description,
+                           rag_context_store: RagContextStore = None, # Contextos RAG partilhados entre modelos
+                           max_workers=None, # Nº de documentos analisados em paralelo (None = ANALYSIS_MAX_WORKERS)
+                           document_results_out=None, # Lista opcional que recebe o dicionário de resultado de cada documento
+                           run_journal: RunJournal = None, prompt_version=None, # Journal de unidades concluídas (--resume)
+                           output_dir=None): # Base dos logs de interação (None = SCRIPT_DIR)
     # (Início da função como antes, inicializando logger e métricas)
     model_specific_pipeline_start_time = time.perf_counter()
-    logger_module.initialize_logger(model_to_use_main_llm, analysis_mode_key_for_log, SCRIPT_DIR)
+    cache_counters_at_start = llm_response_cache.counters()
+    log_filepath = logger_module.initialize_logger(model_to_use_main_llm, analysis_mode_key_for_log, output_dir or SCRIPT_DIR) # Passado explicitamente aos workers
     print(f"\n--- Iniciando análise com: {current_analysis_description} para o modelo principal {model_to_use_main_llm} ---")
     model_successful_analyses = 0; model_total_llm_processing_time = 0.0
     if not json_files_to_analyze: # ... (retorno como antes)
         model_pipeline_end_time = time.perf_counter()
-        logger_module.log_run_summary(0, 0, model_pipeline_end_time - model_specific_pipeline_start_time, None)
+        logger_module.log_run_summary(0, 0, model_pipeline_end_time - model_specific_pipeline_start_time, None,
+                                      cache_stats=llm_response_cache.stats_summary(since=cache_counters_at_start), log_filepath=log_filepath)
         return 0, 0.0
 
-    for i, json_filepath in enumerate(json_files_to_analyze):
+    document_analysis_kwargs = dict(
+        total_files=len(json_files_to_analyze),
+        model_to_use_main_llm=model_to_use_main_llm,
+        system_prompt_base=system_prompt_base, user_template_base=user_template_base, project_context=project_context,
+        use_rag_flag=use_rag_flag, rag_type=rag_type,
+        llamaindex_index=llamaindex_index, aux_llm_llamaindex=aux_llm_llamaindex,
+        system_subquery_gen_prompt=system_subquery_gen_prompt, user_subquery_gen_template=user_subquery_gen_template,
+        prompt_answer_subquestion_text=prompt_answer_subquestion_text,
+        logger_module=logger_module, current_analysis_description=current_analysis_description,
+        rag_context_store=rag_context_store, log_filepath=log_filepath,
+        run_journal=run_journal, prompt_version=prompt_version
+    )
+    analyze_document = functools.partial(analyze_single_document, **document_analysis_kwargs)
+    def unexpected_error_result(json_filepath, stage_name, exc):
+        """Resultado 'error' (contado e registado no log) para um documento cuja análise lançou uma exceção."""
         doc_name = os.path.basename(json_filepath)
-        print(f"\n--- Analisando ficheiro {i+1}/{len(json_files_to_analyze)}: {doc_name} ---")
-        raw_json_str = ""
-        # ... (leitura do ficheiro como antes) ...
-        try:
-            with open(json_filepath, 'r', encoding='utf-8') as f:
-                MAX_JSON_SIZE_PROMPT = 2 * 1024 * 1024; raw_json_str = f.read(MAX_JSON_SIZE_PROMPT)
-                if len(raw_json_str) == MAX_JSON_SIZE_PROMPT and f.tell() < os.path.getsize(json_filepath): print(f"[WARNING] Raw JSON for '{doc_name}' was truncated.")
-        except Exception as e: print(f"[ERROR] Could not read JSON '{json_filepath}': {e}"); logger_module.log_error_interaction(doc_name, current_analysis_description, "N/A", "File read error", f"File reading error: {e}"); continue
+        error_text = f"Error: unexpected failure in stage '{stage_name}': {exc}"
+        logger_module.log_error_interaction(doc_name, current_analysis_description, "N/A", "N/A", error_text, log_filepath=log_filepath)
+        return {"doc_name": doc_name, "status": "error", "llm_duration": 0.0, "llm_metrics": None, "stage_timings": {}, "token_report": None,
+                "assessment": None, "error": error_text}
+    workers = max(1, min(max_workers or ANALYSIS_MAX_WORKERS, len(json_files_to_analyze)))
+    document_results = []
+    pipeline_stats = None
+    if PIPELINE_RAG_STAGES and use_rag_flag and rag_type != "none" and len(json_files_to_analyze) > 1:
+        # Contexto RAG (LLM auxiliar) dos documentos seguintes construído enquanto o LLM principal analisa o atual
+        print(f"[PIPELINE] Contexto RAG ({PIPELINE_CONTEXT_WORKERS} threads) em paralelo com o LLM principal ({workers} threads), fila {PIPELINE_QUEUE_DEPTH}.")
+        prepare_document = functools.partial(prepare_document_analysis, **document_analysis_kwargs)
+        pipelined_results, pipeline_stats = run_two_stage_pipeline(
+            list(enumerate(json_files_to_analyze, start=1)),
+            lambda item: prepare_document(file_position=item[0], json_filepath=item[1]), finish_document_analysis,
+            prepare_workers=PIPELINE_CONTEXT_WORKERS, finish_workers=workers, queue_depth=PIPELINE_QUEUE_DEPTH,
+            stage_names=("contexto_rag", "llm_principal"), error_result_fn=lambda item, stage_name, exc: unexpected_error_result(item[1], stage_name, exc))
+        document_results = [document_result for document_result in pipelined_results if document_result is not None]
+    elif workers == 1:
+        for i, json_filepath in enumerate(json_files_to_analyze):
+            try:
+                document_results.append(analyze_document(file_position=i + 1, json_filepath=json_filepath))
+            except Exception as e_document:
+                print(f"[ERROR] Erro inesperado ao analisar '{json_filepath}': {e_document}")
+                traceback.print_exc()
+                document_results.append(unexpected_error_result(json_filepath, "doc_analysis", e_document))
+    else:
+        # Modo concorrente: o Ollama serve pedidos em paralelo (OLLAMA_NUM_PARALLEL); os resultados são agregados aqui
+        print(f"[INFO] Análise concorrente com {workers} workers.")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="doc_analysis") as executor:
+            futures = [executor.submit(analyze_document, file_position=i + 1, json_filepath=json_filepath)
+                       for i, json_filepath in enumerate(json_files_to_analyze)]
+            for future, json_filepath in zip(futures, json_files_to_analyze):
+                try:
+                    document_results.append(future.result())
+                except Exception as e_worker:
+                    print(f"[ERROR] Erro inesperado ao analisar '{json_filepath}': {e_worker}")
+                    traceback.print_exc()
+                    document_results.append(unexpected_error_result(json_filepath, "doc_analysis", e_worker))
+
+    if document_results_out is not None: document_results_out.extend(document_results)
+    for document_result in document_results:
+        if document_result["status"] == "success":
+            model_successful_analyses += 1; model_total_llm_processing_time += document_result["llm_duration"]
 
-        # Obter contexto RAG usando LlamaIndex
-        actual_rag_context = get_context_with_llamaindex(
-            use_rag_flag, rag_type,
-            llamaindex_index,
-            aux_llm_llamaindex, # Passar o modelo LlamaIndex.Ollama
-            system_subquery_gen_prompt, user_subquery_gen_template,
-            prompt_answer_subquestion_text, # Novo prompt para responder sub-perguntas
-            raw_json_str, doc_name, project_context
-        )
-        
-        # Formatar prompts principais (como antes)
-        prompt_format_args = {"document_name": doc_name, "raw_json_content": raw_json_str, "project_context_summary": project_context}
-        if "{additional_rag_context}" in user_template_base: prompt_format_args["additional_rag_context"] = actual_rag_context
-        try:
-            final_user_prompt_for_llm = user_template_base.format(**prompt_format_args)
-        except KeyError as e_key: print(f"[ERROR] Placeholder user_template: {e_key}"); logger_module.log_error_interaction(doc_name, current_analysis_description, "N/A", "Template error", f"UK{e_key}"); continue
-        
-        system_prompt_format_args = {
-            "document_name": doc_name, "raw_json_content": raw_json_str,
-            "project_context_summary": project_context,
-            "additional_rag_context": actual_rag_context if use_rag_flag and "{additional_rag_context}" in system_prompt_base else "RAG context not used/applicable in system prompt."
-        }
-        try:
-            final_system_prompt_for_llm = system_prompt_base.format(**system_prompt_format_args)
-        except KeyError as e_key_sys:
-            print(f"[WARNING] Placeholder system_prompt: {e_key_sys}. Usando parcialmente formatado.")
-            temp_sys = system_prompt_base
-            for k_s, v_s in system_prompt_format_args.items(): temp_sys = temp_sys.replace("{" + k_s + "}", str(v_s))
-            final_system_prompt_for_llm = temp_sys
-        except Exception as e_fmt_sys: print(f"[ERROR] Format system_prompt: {e_fmt_sys}"); final_system_prompt_for_llm = system_prompt_base
-        
-        # Chamada ao LLM Principal (Ollama API direta)
-        print(f"[INFO] Submetendo para LLM principal '{model_to_use_main_llm}' para '{doc_name}'.")
-        start_time_file_llm = time.perf_counter()
-        llm_assessment_text = call_ollama_generate( # Sua função de chamada direta
-            model_to_use_main_llm,
-            final_system_prompt_for_llm,
-            final_user_prompt_for_llm,
-            target_doc_name_for_info=f"MainAnalysisFor_{doc_name}"
-        )
-        # ... (resto da função: logging, cálculo de tempos, sumário do modelo - como antes) ...
-        end_time_file_llm = time.perf_counter(); file_llm_duration = end_time_file_llm - start_time_file_llm
-        print(f"\n[RESULT] Assessment by '{model_to_use_main_llm}' for '{doc_name}':")
-        print(llm_assessment_text[:1000] + ('...' if len(llm_assessment_text) > 1000 else ''))
-        print(f"(Time for LLM analysis: {logger_module.format_duration(file_llm_duration)})")
-        if llm_assessment_text.startswith("Error:"): logger_module.log_error_interaction(doc_name, current_analysis_description, final_system_prompt_for_llm, final_user_prompt_for_llm, llm_assessment_text)
-        else:
-            logger_module.log_interaction(doc_name, current_analysis_description, final_system_prompt_for_llm, final_user_prompt_for_llm, llm_assessment_text)
-            if not llm_assessment_text.startswith("Warning:"): model_successful_analyses += 1; model_total_llm_processing_time += file_llm_duration
-    
     model_pipeline_end_time = time.perf_counter()
     model_total_pipeline_duration_seconds = model_pipeline_end_time - model_specific_pipeline_start_time
     model_avg_time_per_file_seconds = model_total_llm_processing_time / model_successful_analyses if model_successful_analyses > 0 else None
     print(f"\n--- Sumário para Modelo: {model_to_use_main_llm} (RAG: {rag_type if use_rag_flag else 'Nenhum'}) ---")
     # ... (prints do sumário do modelo)
-    print(f"Ficheiros processados: {len(json_files_to_analyze)}, Sucessos: {model_successful_analyses}")
+    error_count = sum(1 for r in document_results if r["status"] == "error")
+    print(f"Ficheiros processados: {len(json_files_to_analyze)}, Sucessos: {model_successful_analyses}, Erros: {error_count}")
+    resumed_count = sum(1 for r in document_results if r.get("resumed"))
+    if resumed_count: print(f"Retomados do journal (não repetidos): {resumed_count}")
     print(f"Tempo médio (LLM): {logger_module.format_duration(model_avg_time_per_file_seconds)}")
     print(f"Tempo total pipeline modelo: {logger_module.format_duration(model_total_pipeline_duration_seconds)}")
-    logger_module.log_run_summary(len(json_files_to_analyze), model_successful_analyses, model_total_pipeline_duration_seconds, model_avg_time_per_file_seconds)
-    if logger_module.current_log_filepath: print(f"Log: {logger_module.current_log_filepath}")
+    model_cache_stats = llm_response_cache.stats_summary(since=cache_counters_at_start)
+    print(model_cache_stats)
+    model_throughput_stats = format_throughput_summary(summarize_generation_metrics([r["llm_metrics"] for r in document_results]))
+    print(model_throughput_stats)
+    model_pipeline_stats = format_pipeline_stats(pipeline_stats) if pipeline_stats else None
+    if model_pipeline_stats: print(model_pipeline_stats)
+    logger_module.log_run_summary(len(json_files_to_analyze), model_successful_analyses, model_total_pipeline_duration_seconds, model_avg_time_per_file_seconds,
+                                  cache_stats=model_cache_stats, log_filepath=log_filepath, throughput_stats=model_throughput_stats,
+                                  pipeline_stats=model_pipeline_stats)
+    if log_filepath: print(f"Log: {log_filepath}")
     print(f"--- Fim da análise com: {model_to_use_main_llm} ---\n")
     return model_successful_analyses, model_total_llm_processing_time
 
 
 # --- Função Principal (Atualizada para LlamaIndex) ---
-def main():
+def main(resume=False, journal_path=None, headless_config=None):
+    """headless_config (ver batch_runner.load_headless_config) substitui as perguntas interativas e ativa o sharding."""
     overall_pipeline_start_time = time.perf_counter()
     print("--- Mini Document PII Analyzer v5 (LlamaIndex RAG) ---")
 
     logger_module = interaction_logger_mini
     # ... (verificação do logger como antes) ...
 
-    # --- Inicializar LlamaIndex ---
-    # Configurar o modelo de embedding globalmente para LlamaIndex (opcional, mas pode simplificar)
-    # try:
-    #     Settings.embed_model = HuggingFaceEmbedding(model_name=LLAMA_EMBED_MODEL_NAME)
-    # except Exception as e_embed_settings:
-    #     print(f"[LLAMAINDEX ERROR] Falha ao definir embed_model global: {e_embed_settings}")
-    #     print("  RAG com LlamaIndex pode não funcionar. Verifique a instalação de sentence-transformers.")
-    #     # Poderia abortar aqui ou tentar continuar sem RAG LlamaIndex
-    
-    llamaindex_loaded_index = load_llamaindex_index(
-        LLAMA_CHROMA_PERSIST_DIR, 
-        LLAMA_CHROMA_COLLECTION_NAME,
-        LLAMA_EMBED_MODEL_NAME # Passar o nome do modelo para ser usado na consulta
-    )
-    if not llamaindex_loaded_index:
-        print("[WARNING] Índice LlamaIndex não carregado. RAG com LlamaIndex não estará disponível.")
-        # Não precisa de rag_factory aqui, LlamaIndex lida com isso internamente
-
+    stage_start = time.perf_counter()
     all_available_ollama_models = list_ollama_models()
+    record_startup_stage("listar modelos Ollama", stage_start)
     # ... (verificação de all_available_ollama_models como antes) ...
 
-    run_configuration = prompt_user_for_run_mode(all_available_ollama_models)
-    # ... (verificação de run_configuration como antes) ...
+    if headless_config:
+        run_configuration = build_headless_run_configuration(headless_config, all_available_ollama_models)
+    else:
+        run_configuration = prompt_user_for_run_mode(all_available_ollama_models)
+    if not run_configuration: return
+    schema_dir = (headless_config or {}).get("schema_dir") or os.path.join(SCRIPT_DIR, DEFAULT_SCHEMA_DIR)
+    output_dir = (headless_config or {}).get("output_dir") or SCRIPT_DIR
+    shard_index, shard_count = ((headless_config["shard_index"], headless_config["shard_count"]) if headless_config else (0, 1))
+    os.makedirs(output_dir, exist_ok=True)
+    if shard_count > 1: print(f"[HEADLESS] Shard {shard_index + 1}/{shard_count} da matriz (modelo × documento).")
 
     models_to_run_list = run_configuration["models_to_run"]
     use_rag = run_configuration["use_rag"]
@@ -493,11 +932,24 @@ def main():
 
     print(f"\n[INFO FINAL CONFIG] Modelos: {models_to_run_list}, Usar RAG: {use_rag}, Tipo RAG: {rag_type}")
 
+    # --- Inicializar LlamaIndex (apenas se um modo RAG foi selecionado) ---
+    llamaindex_loaded_index = None
+    if use_rag:
+        llamaindex_loaded_index = load_llamaindex_index(
+            LLAMA_CHROMA_PERSIST_DIR, 
+            LLAMA_CHROMA_COLLECTION_NAME,
+            LLAMA_EMBED_MODEL_NAME # Passar o nome do modelo para ser usado na consulta
+        )
+        if not llamaindex_loaded_index:
+            print("[WARNING] Índice LlamaIndex não carregado. RAG com LlamaIndex não estará disponível.")
+            # Não precisa de rag_factory aqui, LlamaIndex lida com isso internamente
+    print_startup_breakdown()
+
     project_summary_text = load_prompt_template("project_context_summary.txt")
     # ... (fallback para project_summary_text como antes) ...
     if not project_summary_text: project_summary_text = "Project context: Not available."
 
-    json_files_to_analyze = get_json_files_from_dir(os.path.join(SCRIPT_DIR, DEFAULT_SCHEMA_DIR))
+    json_files_to_analyze = get_json_files_from_dir(schema_dir)
     # ... (verificação de json_files_to_analyze como antes) ...
 
     user_template_filename = "user_doc_holistic_task_template_WITHRAG_raw.txt" if use_rag else "user_doc_holistic_task_template_NORAG_raw.txt"
@@ -507,7 +959,7 @@ def main():
     # Prompts para RAG LlamaIndex
     system_subquery_gen_prompt, user_subquery_gen_template = None, None
     prompt_answer_subquestion_text = None # Novo prompt para responder sub-perguntas
-    aux_ollama_llm_for_rag = None # Modelo LlamaIndex.Ollama para tarefas RAG
+    aux_ollama_llm_for_rag = None # LLM auxiliar (OllamaChatModel) para tarefas RAG
 
     if use_rag and (rag_type == "multi_step_qa_llamaindex" or rag_type == "simple_docs_llamaindex"): # Verificar se RAG está ativo
         if not llamaindex_loaded_index:
@@ -516,13 +968,12 @@ def main():
             rag_type = "none"
         else:
             # Configurar LLM auxiliar para LlamaIndex
-            PREFERRED_AUX_LLM_NAME = "qwen2:0.5b" # Nome exato do Ollama
             # ... (lógica para encontrar actual_preferred_aux_llm_name como antes) ...
-            actual_preferred_aux_llm_name = PREFERRED_AUX_LLM_NAME # Simplificação, assumindo que existe
+            actual_preferred_aux_llm_name = AUX_LLM_MODEL_NAME # Simplificação, assumindo que existe
             # Criar instância do LLM LlamaIndex
             try:
-                aux_ollama_llm_for_rag = Ollama(model=actual_preferred_aux_llm_name, request_timeout=120.0)
-                print(f"[INFO] LLM auxiliar LlamaIndex ({actual_preferred_aux_llm_name}) configurado para tarefas RAG.")
+                aux_ollama_llm_for_rag = OllamaChatModel(actual_preferred_aux_llm_name, client=get_ollama_client(), request_timeout=120.0)
+                print(f"[INFO] LLM auxiliar ({actual_preferred_aux_llm_name}) configurado para tarefas RAG (cliente Ollama partilhado).")
             except Exception as e_llm_llama:
                 print(f"[ERROR] Falha ao configurar LLM LlamaIndex ({actual_preferred_aux_llm_name}): {e_llm_llama}")
                 print("        RAG Multi-Step Q&A pode não funcionar. Tentando fallback se possível.")
@@ -547,7 +998,22 @@ def main():
 
     overall_successful_analyses = 0; overall_llm_time = 0.0; models_processed_count = 0
 
-    for model_idx, current_model_to_run_main_llm in enumerate(models_to_run_list):
+    # Journal de unidades concluídas: sempre escrito; consultado apenas com --resume
+    run_journal = RunJournal(journal_path or os.path.join(output_dir, RUN_JOURNAL_FILENAME), resume=resume)
+    model_document_results = {} # modelo -> resultados por documento (sumário do shard em modo headless)
+    prompt_version = compute_prompt_version(
+        system_prompt_base_text, user_template_base_text, project_summary_text,
+        system_subquery_gen_prompt, user_subquery_gen_template, prompt_answer_subquestion_text,
+        AUX_LLM_MODEL_NAME, JSON_PROMPT_MODE, JSON_PROMPT_BUDGET_CHARS, TOKEN_BUDGET_ENABLED, TOKEN_BUDGET_NUM_CTX,
+        ASSESSMENT_MODE, ASSESSMENT_THINK, *analysis_environment_version_parts(use_rag)
+    )
+
+    # Contexto RAG depende apenas do documento e do LLM auxiliar: construído uma vez e partilhado por todos os modelos
+    rag_context_store = RagContextStore(SCRIPT_DIR, persist_to_disk=RAG_CONTEXT_STORE_PERSIST, max_bytes=RAG_CONTEXT_STORE_MAX_BYTES,
+                                        max_entries=RAG_CONTEXT_STORE_MAX_ENTRIES) if use_rag else None
+
+    def run_model(model_idx, current_model_to_run_main_llm):
+        """Corre a análise de um modelo principal. Devolve (sucessos, tempo LLM) ou None em caso de erro."""
         # Determinar modo RAG para esta iteração
         current_use_rag = use_rag
         current_rag_type = rag_type
@@ -581,10 +1047,11 @@ def main():
 
         print(f"\n======================\nProcessando Modelo {model_idx + 1}/{len(models_to_run_list)}: {current_model_to_run_main_llm}\n{current_analysis_description}\n======================")
 
+        document_results = model_document_results.setdefault(current_model_to_run_main_llm, [])
         try:
-            successful_count, llm_time_for_model = run_analysis_for_model(
+            return run_analysis_for_model(
                 model_to_use_main_llm=current_model_to_run_main_llm,
-                json_files_to_analyze=json_files_to_analyze,
+                json_files_to_analyze=files_for_shard(current_model_to_run_main_llm, json_files_to_analyze, shard_index, shard_count),
                 system_prompt_base=system_prompt_base_text,
                 user_template_base=user_template_base_text,
                 project_context=project_summary_text,
@@ -597,15 +1064,54 @@ def main():
                 prompt_answer_subquestion_text=prompt_answer_subquestion_text, # Novo prompt
                 logger_module=logger_module,
                 analysis_mode_key_for_log=analysis_mode_key_for_log,
-                current_analysis_description=current_analysis_description
+                current_analysis_description=current_analysis_description,
+                rag_context_store=rag_context_store,
+                run_journal=run_journal, prompt_version=prompt_version,
+                output_dir=output_dir, document_results_out=document_results
             )
-            overall_successful_analyses += successful_count
-            overall_llm_time += llm_time_for_model
-            models_processed_count +=1
         except Exception as e_model_loop:
             print(f"[ERROR FATAL] Erro no loop do modelo '{current_model_to_run_main_llm}': {e_model_loop}")
             traceback.print_exc()
             print(f"  A continuar para o próximo modelo, se houver.")
+            return None
+
+    def accumulate_model_result(model_result):
+        nonlocal overall_successful_analyses, overall_llm_time, models_processed_count
+        if model_result is None: return
+        overall_successful_analyses += model_result[0]
+        overall_llm_time += model_result[1]
+        models_processed_count += 1
+
+    if run_all_models_flag and len(models_to_run_list) > 1:
+        # Varrimento de todos os modelos: do mais pequeno para o maior, cada um aquecido antes da medição e
+        # descarregado no fim, para não acumular modelos residentes (swapping em máquinas só com CPU)
+        ollama_client = get_ollama_client()
+        model_sizes = get_model_sizes(ollama_client)
+        reserved_bytes = estimate_resident_bytes(model_sizes.get(AUX_LLM_MODEL_NAME, 0)) if aux_ollama_llm_for_rag else 0
+        sweep_batches = plan_model_sweep(models_to_run_list, model_sizes, max_parallel=SWEEP_MAX_PARALLEL_MODELS, reserved_bytes=reserved_bytes)
+        print(f"[SWEEP] Plano de execução ({len(sweep_batches)} lotes):\n{format_sweep_plan(sweep_batches, model_sizes)}")
+        sweep_stats = ModelSweepStats()
+        model_positions = {name: idx for idx, name in enumerate(models_to_run_list)}
+        for batch_idx, batch in enumerate(sweep_batches):
+            for model_name in batch:
+                print(f"[SWEEP] A aquecer '{model_name}'...")
+                sweep_stats.warm_up_seconds[model_name] = warm_up_model(ollama_client, model_name, OLLAMA_KEEP_ALIVE_DURATION)
+            if len(batch) == 1:
+                accumulate_model_result(run_model(model_positions[batch[0]], batch[0]))
+            else:
+                print(f"[SWEEP] A correr em simultâneo: {', '.join(batch)}")
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(batch), thread_name_prefix="model_sweep") as executor:
+                    for model_result in executor.map(lambda name: run_model(model_positions[name], name), batch):
+                        accumulate_model_result(model_result)
+            for model_name in batch:
+                sweep_stats.unload_seconds[model_name] = unload_model(ollama_client, model_name)
+            if batch_idx == 0 and aux_ollama_llm_for_rag and aux_ollama_llm_for_rag.model not in models_to_run_list:
+                # Os contextos RAG ficaram no armazém: o LLM auxiliar só volta a ser carregado se faltar algum
+                unload_model(ollama_client, aux_ollama_llm_for_rag.model)
+        print(sweep_stats.summary())
+    else:
+        for model_idx, current_model_to_run_main_llm in enumerate(models_to_run_list):
+            accumulate_model_result(run_model(model_idx, current_model_to_run_main_llm))
 
     # Sumário Global Final (como antes)
     # ... (lógica do sumário global)
@@ -620,11 +1126,37 @@ def main():
     else:
         print("\nNenhum modelo foi processado.")
         print(f"Tempo total de pipeline: {logger_module.format_duration(overall_total_pipeline_duration_seconds)}")
+    if rag_context_store is not None:
+        print(f"[RAG CONTEXT STORE] {rag_context_store.stats_summary()}")
+    if llamaindex_loaded_index is not None:
+        print(f"[RETRIEVAL CACHE] {retrieval_cache.stats_summary()}")
+    if use_rag and rag_type == "multi_step_qa_llamaindex":
+        subquestion_answer_cache.save()
+        print(f"[SEMANTIC CACHE] {subquestion_answer_cache.stats_summary()}")
+    print(f"[LLM CACHE] {llm_response_cache.stats_summary()}")
+    if len(OLLAMA_API_BASE_URLS) > 1:
+        print(f"[OLLAMA POOL] {get_ollama_client().endpoint_stats_summary()}")
+    print(f"[RUN JOURNAL] {run_journal.stats_summary()}")
+    if headless_config:
+        write_shard_summary(output_dir, headless_config, model_document_results, overall_total_pipeline_duration_seconds)
+    if schema_ref_resolver is not None:
+        print(f"[SCHEMA REF] {schema_ref_resolver.stats_summary()}")
 
     # LlamaIndex não tem um .close() explícito para o índice carregado desta forma.
     # O cliente ChromaDB dentro do VectorStore pode precisar ser fechado se fosse gerido manualmente,
     # mas LlamaIndex trata disso.
+    logger_module.flush_logs() # Garantir que entradas em fila (modo de escrita 'background') estão em disco
+    get_ollama_client().close() # Fechar as ligações keep-alive do cliente Ollama partilhado
     print(f"\n--- Mini Analyzer v5 (LlamaIndex RAG) Completo ---")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Mini Document PII Analyzer (LlamaIndex RAG).")
+    arg_parser.add_argument("--resume", action="store_true", default=None, help="Saltar as unidades (modelo, documento, RAG, prompts) já concluídas no journal.")
+    arg_parser.add_argument("--journal-file", default=None, help=f"Journal de unidades concluídas (por omissão, {RUN_JOURNAL_FILENAME} no diretório de saída).")
+    add_headless_arguments(arg_parser)
+    cli_args = arg_parser.parse_args()
+    if is_headless_requested(cli_args):
+        cli_headless_config = load_headless_config(cli_args)
+        main(resume=bool(cli_headless_config["resume"]), journal_path=cli_headless_config["journal_file"], headless_config=cli_headless_config)
+    else:
+        main(resume=bool(cli_args.resume), journal_path=cli_args.journal_file)
\ No newline at end of file
@@ -0,0 +1,387 @@
+# mmap_vector_index.py
+# Índice vetorial só de leitura em ficheiros mapeados em memória (alternativa ao ChromaDB no analisador).
+# O indexador (index_documents_llamaindex.py) exporta a coleção Chroma para:
+#   vectors.npy       - matriz N x D (float16 ou float32) com os embeddings normalizados (cosseno = produto interno)
+#   texts.bin         - textos dos nós em UTF-8, concatenados; text_offsets.npy (N+1 int64) delimita cada um
+#   nodes.json        - IDs e metadados dos nós (sem os campos internos do LlamaIndex, que repetem o texto)
+#   mmap_index.json   - manifest (escrito por último): nº de nós, dimensão, dtype, quantização, modelo de embedding, versão do índice
+# Com quantização, a primeira passagem percorre apenas códigos int8 (vectors_int8.npy + int8_scales.npy, 4x menos
+# que float32) ou de 1 bit (vectors_binary.npy + binary_thresholds.npy, 32x menos); os melhores candidatos são depois
+# reordenados com os vetores completos de vectors.npy, lidos do disco só para essas linhas.
+# A pesquisa é feita por blocos de linhas (produto interno vetorizado com NumPy + argpartition). Abrir o índice não lê
+# os vetores: as páginas são carregadas a pedido e partilhadas (page cache) entre processos do analisador.
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+import datetime
+
+import numpy as np
+
+MMAP_INDEX_DIR_NAME = "mmap_index"
+MMAP_INDEX_MANIFEST_FILENAME = "mmap_index.json"
+MMAP_INDEX_FORMAT_VERSION = 1
+MMAP_INDEX_DTYPES = ("float16", "float32")
+MMAP_INDEX_QUANTIZATIONS = ("none", "int8", "binary")
+MMAP_DEFAULT_RERANK_FACTORS = {"int8": 4, "binary": 16} # Candidatos da 1ª passagem por resultado pedido (reordenados em float)
+MMAP_SEARCH_BLOCK_BYTES = 64 * 1024 * 1024 # Memória temporária máxima por bloco de linhas da pesquisa
+MMAP_EXPORT_BATCH_SIZE = 1000 # Nós lidos da coleção Chroma por pedido
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8) # Bits a 1 por byte
+# Metadados internos do LlamaIndex nos registos Chroma (o texto já vai em texts.bin)
+_LLAMAINDEX_INTERNAL_METADATA_KEYS = ("_node_content", "_node_type", "doc_id", "document_id", "ref_doc_id")
+
+
+def default_export_dtype(quantization):
+    """
+    Sem quantização, float16 (metade da memória; a pesquisa exata quase não muda). Com quantização os vetores
+    completos só servem para reordenar os candidatos: float32, para que a reordenação seja em precisão total.
+    """
+    return "float16" if quantization == "none" else "float32"
+
+
+def _write_atomically(path, write_fn, mode="wb"):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def quantize_int8(matrix):
+    """Códigos int8 com uma escala por dimensão (valor ~= código * escala)."""
+    scales = np.abs(matrix).max(axis=0) / 127.0 if len(matrix) else np.ones(matrix.shape[1])
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    return np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8), scales
+
+
+def quantize_binary(matrix, thresholds=None):
+    """1 bit por dimensão (acima da média da dimensão), empacotado em bytes. Devolve (códigos, limiares)."""
+    if thresholds is None:
+        thresholds = (matrix.mean(axis=0) if len(matrix) else np.zeros(matrix.shape[1])).astype(np.float32)
+    return np.packbits(matrix > thresholds, axis=1), thresholds
+
+
+def _quantized_files(matrix, quantization):
+    """{nome do ficheiro: array} com os códigos de quantização a exportar."""
+    if quantization == "int8":
+        codes, scales = quantize_int8(matrix)
+        return {"vectors_int8.npy": codes, "int8_scales.npy": scales}
+    if quantization == "binary":
+        codes, thresholds = quantize_binary(matrix)
+        return {"vectors_binary.npy": codes, "binary_thresholds.npy": thresholds}
+    return {}
+
+
+def export_mmap_vector_index(chroma_collection, output_dir, dtype=None, index_version=None, embed_model_name=None, quantization="none"):
+    """
+    Exporta todos os nós da coleção Chroma para output_dir (com os códigos da quantização pedida). Devolve o manifest escrito.
+    dtype None = default_export_dtype(quantization).
+    """
+    dtype = dtype or default_export_dtype(quantization)
+    if dtype not in MMAP_INDEX_DTYPES:
+        raise ValueError(f"dtype '{dtype}' não suportado (opções: {', '.join(MMAP_INDEX_DTYPES)}).")
+    if quantization not in MMAP_INDEX_QUANTIZATIONS:
+        raise ValueError(f"Quantização '{quantization}' não suportada (opções: {', '.join(MMAP_INDEX_QUANTIZATIONS)}).")
+    ids, texts, metadatas, vectors = [], [], [], []
+    total = chroma_collection.count()
+    for offset in range(0, total, MMAP_EXPORT_BATCH_SIZE):
+        batch = chroma_collection.get(limit=MMAP_EXPORT_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+        ids.extend(batch["ids"])
+        texts.extend(text or "" for text in batch["documents"])
+        metadatas.extend({key: value for key, value in (metadata or {}).items() if key not in _LLAMAINDEX_INTERNAL_METADATA_KEYS}
+                         for metadata in batch["metadatas"])
+        vectors.extend(batch["embeddings"])
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1) if ids else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms > 0, norms, 1.0)
+    quantized_files = _quantized_files(matrix, quantization)
+    matrix = matrix.astype(dtype)
+
+    encoded_texts = [text.encode("utf-8") for text in texts]
+    text_offsets = np.zeros(len(encoded_texts) + 1, dtype=np.int64)
+    np.cumsum([len(encoded) for encoded in encoded_texts], out=text_offsets[1:])
+
+    os.makedirs(output_dir, exist_ok=True)
+    _write_atomically(os.path.join(output_dir, "vectors.npy"), lambda f: np.save(f, matrix))
+    for filename, array in quantized_files.items():
+        _write_atomically(os.path.join(output_dir, filename), lambda f, array=array: np.save(f, array))
+    _write_atomically(os.path.join(output_dir, "text_offsets.npy"), lambda f: np.save(f, text_offsets))
+    _write_atomically(os.path.join(output_dir, "texts.bin"), lambda f: f.write(b"".join(encoded_texts)))
+    _write_atomically(os.path.join(output_dir, "nodes.json"), lambda f: json.dump({"ids": ids, "metadatas": metadatas}, f, ensure_ascii=False),
+                      mode="w")
+    manifest = {"format_version": MMAP_INDEX_FORMAT_VERSION, "count": len(ids), "dimension": int(matrix.shape[1]) if len(ids) else 0,
+                "dtype": dtype, "quantization": quantization, "embed_model": embed_model_name, "index_version": index_version,
+                "exported": datetime.datetime.now().isoformat()}
+    _write_atomically(os.path.join(output_dir, MMAP_INDEX_MANIFEST_FILENAME), lambda f: json.dump(manifest, f, indent=2), mode="w")
+    return manifest
+
+
+class MmapVectorIndex:
+    """
+    Índice exportado por export_mmap_vector_index, aberto só para leitura. Expõe a mesma interface que a coleção
+    Chroma usada pelo analisador (count, query com query_embeddings, get por IDs), com distância = 1 - cosseno.
+    Com quantização na exportação, a pesquisa usa os códigos quantizados e reordena os k * rerank_factor melhores
+    candidatos em float (rerank_factor=None usa MMAP_DEFAULT_RERANK_FACTORS).
+    """
+
+    def __init__(self, index_dir, rerank_factor=None):
+        self.index_dir = index_dir
+        self._quantized = {} # quantização -> (códigos, escalas ou limiares), do disco ou calculados (relatório)
+        with open(os.path.join(index_dir, MMAP_INDEX_MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != MMAP_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato do índice mmap '{self.manifest.get('format_version')}' não suportado.")
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(index_dir, "text_offsets.npy"), mmap_mode="r")
+        with open(os.path.join(index_dir, "nodes.json"), "r", encoding="utf-8") as f:
+            nodes = json.load(f)
+        self.ids, self.metadatas = nodes["ids"], nodes["metadatas"]
+        if not (len(self.ids) == len(self.vectors) == len(self.text_offsets) - 1 == self.manifest["count"]):
+            raise ValueError(f"Índice mmap '{index_dir}' incoerente (exportação interrompida?). Exporte novamente.")
+        self._positions = {node_id: position for position, node_id in enumerate(self.ids)}
+        with open(os.path.join(index_dir, "texts.bin"), "rb") as f:
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self.quantization = self.manifest.get("quantization", "none")
+        self.rerank_factor = rerank_factor or MMAP_DEFAULT_RERANK_FACTORS.get(self.quantization, 0)
+        if self.quantization != "none":
+            self._quantized[self.quantization] = self._load_quantized(self.quantization)
+
+    @property
+    def index_version(self):
+        return self.manifest.get("index_version")
+
+    def count(self):
+        return len(self.ids)
+
+    def text(self, position):
+        return self._texts[int(self.text_offsets[position]): int(self.text_offsets[position + 1])].decode("utf-8")
+
+    def _load_quantized(self, quantization):
+        code_file, parameter_file = {"int8": ("vectors_int8.npy", "int8_scales.npy"), "binary": ("vectors_binary.npy", "binary_thresholds.npy")}[quantization]
+        codes = np.load(os.path.join(self.index_dir, code_file), mmap_mode="r")
+        if len(codes) != len(self.ids):
+            raise ValueError(f"Índice mmap '{self.index_dir}' incoerente ({code_file}). Exporte novamente.")
+        return codes, np.load(os.path.join(self.index_dir, parameter_file))
+
+    def quantized(self, quantization):
+        """Códigos da quantização: os exportados ou, se não existirem, calculados em memória (ex: relatório de recall)."""
+        if quantization not in self._quantized:
+            matrix = np.asarray(self.vectors, dtype=np.float32)
+            self._quantized[quantization] = quantize_int8(matrix) if quantization == "int8" else quantize_binary(matrix)
+        return self._quantized[quantization]
+
+    def _block_scorer(self, queries, quantization):
+        """
+        (função (início, fim) -> scores B x linhas da 1ª passagem (maior = mais parecido), bytes temporários por linha).
+        """
+        n_queries, dimension = queries.shape
+        if quantization == "none":
+            return lambda start, stop: queries @ np.asarray(self.vectors[start:stop], dtype=np.float32).T, 4 * (dimension + n_queries)
+        codes, parameters = self.quantized(quantization)
+        if quantization == "int8":
+            scaled_queries = queries * parameters # q . (código * escala) = (q * escala) . código
+            return lambda start, stop: scaled_queries @ np.asarray(codes[start:stop], dtype=np.float32).T, 4 * (dimension + n_queries)
+        query_bits, _ = quantize_binary(queries, parameters)
+        # Distância de Hamming (XOR + contagem de bits por byte); score = -distância
+        return (lambda start, stop: -_POPCOUNT[np.bitwise_xor(codes[start:stop][None, :, :], query_bits[:, None, :])].sum(axis=2, dtype=np.float32),
+                n_queries * (2 * codes.shape[1] + 4))
+
+    def _top_k_blockwise(self, block_scorer, n_queries, k):
+        """Top-k (posições, scores) por query, ordenados, percorrendo as linhas por blocos."""
+        score_block, bytes_per_row = block_scorer
+        block_rows = max(1024, MMAP_SEARCH_BLOCK_BYTES // bytes_per_row)
+        best_positions = np.empty((n_queries, 0), dtype=np.int64)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+        for start in range(0, len(self.ids), block_rows):
+            stop = min(len(self.ids), start + block_rows)
+            best_scores = np.concatenate([best_scores, score_block(start, stop).astype(np.float32)], axis=1)
+            best_positions = np.concatenate([best_positions, np.broadcast_to(np.arange(start, stop), (n_queries, stop - start))], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores, best_positions = np.take_along_axis(best_scores, top, 1), np.take_along_axis(best_positions, top, 1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_positions, order, 1), np.take_along_axis(best_scores, order, 1)
+
+    def search(self, query_embeddings, k, quantization=None, rerank_factor=None):
+        """
+        Top-k para cada query: lista (pela ordem das queries) de [(posição, cosseno)] por cosseno decrescente.
+        quantization=None usa a da exportação ('none' = exata); rerank_factor=0 devolve a ordem da 1ª passagem
+        (scores aproximados), sem reordenar em float.
+        """
+        if not len(self.ids):
+            return [[] for _ in query_embeddings]
+        quantization = quantization or self.quantization
+        rerank_factor = self.rerank_factor if rerank_factor is None else rerank_factor
+        queries = np.array(query_embeddings, dtype=np.float32, copy=True).reshape(len(query_embeddings), -1) # Não normalizar o array do chamador
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(self.ids))
+        first_pass_k = k if quantization == "none" or not rerank_factor else min(len(self.ids), k * rerank_factor)
+        positions, scores = self._top_k_blockwise(self._block_scorer(queries, quantization), len(queries), first_pass_k)
+        if quantization == "none" or not rerank_factor:
+            return [[(int(position), float(score)) for position, score in zip(row_positions[:k], row_scores[:k])]
+                    for row_positions, row_scores in zip(positions, scores)]
+        results = []
+        for query, candidates in zip(queries, positions):
+            candidates = np.sort(candidates) # Leitura sequencial das linhas candidatas de vectors.npy
+            exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            ordered = np.argsort(-exact, kind="stable")[:k]
+            results.append([(int(candidates[i]), float(exact[i])) for i in ordered])
+        return results
+
+    def query(self, query_embeddings, n_results=10, include=("documents", "metadatas", "distances")):
+        """Como chromadb.Collection.query (apenas query_embeddings)."""
+        hits_per_query = self.search(query_embeddings, n_results)
+        return {
+            "ids": [[self.ids[position] for position, _ in hits] for hits in hits_per_query],
+            "documents": [[self.text(position) for position, _ in hits] for hits in hits_per_query],
+            "metadatas": [[self.metadatas[position] for position, _ in hits] for hits in hits_per_query],
+            "distances": [[1.0 - similarity for _, similarity in hits] for hits in hits_per_query],
+        }
+
+    def get(self, ids, include=("documents", "metadatas")):
+        """Como chromadb.Collection.get(ids=...): IDs desconhecidos são omitidos."""
+        positions = [self._positions[node_id] for node_id in ids if node_id in self._positions]
+        return {"ids": [self.ids[position] for position in positions],
+                "documents": [self.text(position) for position in positions],
+                "metadatas": [self.metadatas[position] for position in positions]}
+
+
+class _MmapVectorStore:
+    """Apenas o necessário do ChromaVectorStore: .client é a 'coleção'."""
+
+    def __init__(self, mmap_index):
+        self.client = mmap_index
+
+
+class MmapRetriever:
+    """Retriever (interface retrieve do LlamaIndex) sobre um MmapVectorIndex."""
+
+    def __init__(self, mmap_index, embed_model, similarity_top_k):
+        self.mmap_index = mmap_index
+        self.embed_model = embed_model
+        self.similarity_top_k = similarity_top_k
+
+    def retrieve(self, query):
+        from llama_index.core.schema import NodeWithScore, TextNode, QueryBundle
+        query_bundle = query if isinstance(query, QueryBundle) else QueryBundle(query_str=query)
+        query_embedding = query_bundle.embedding or self.embed_model.get_query_embedding(query_bundle.query_str)
+        return [NodeWithScore(node=TextNode(text=self.mmap_index.text(position), id_=self.mmap_index.ids[position],
+                                            metadata=dict(self.mmap_index.metadatas[position])), score=similarity)
+                for position, similarity in self.mmap_index.search([query_embedding], self.similarity_top_k)[0]]
+
+
+class MmapVectorStoreIndex:
+    """Substituto do VectorStoreIndex (Chroma) para os caminhos RAG do analisador: vector_store.client e as_retriever."""
+
+    def __init__(self, mmap_index, embed_model):
+        self.mmap_index = mmap_index
+        self.embed_model = embed_model
+        self.vector_store = _MmapVectorStore(mmap_index)
+
+    def as_retriever(self, similarity_top_k=2):
+        return MmapRetriever(self.mmap_index, self.embed_model, similarity_top_k)
+
+
+def quantization_recall_report(mmap_index, query_embeddings=None, k=5, sample_size=200, rerank_factors=(4, 16), seed=0,
+                               chroma_collection=None):
+    """
+    Recall@k de cada modo de pesquisa (int8 / binário, com e sem reordenação em float) face à pesquisa exata (NumPy)
+    sobre os vetores exportados, e a memória percorrida na 1ª passagem. Com chroma_collection (a coleção de onde o
+    índice foi exportado), mede também o recall do Chroma (HNSW, collection.query) para as mesmas queries.
+    Sem query_embeddings, usa como queries uma amostra dos próprios nós (o próprio nó é excluído dos resultados).
+    Devolve uma lista de dicionários (um por modo).
+    """
+    count = mmap_index.count()
+    exclude_self = query_embeddings is None
+    if exclude_self:
+        sample = np.random.default_rng(seed).choice(count, size=min(sample_size, count), replace=False)
+        query_embeddings = np.asarray(mmap_index.vectors[np.sort(sample)], dtype=np.float32)
+        sample_positions = np.sort(sample)
+    search_k = k + 1 if exclude_self else k
+
+    def top_k_sets(positions):
+        if exclude_self:
+            positions = [[position for position in hits if position != own][:k] for hits, own in zip(positions, sample_positions)]
+        return [set(hits[:k]) for hits in positions]
+
+    def run(quantization, rerank_factor):
+        start = time.perf_counter()
+        results = mmap_index.search(query_embeddings, search_k, quantization=quantization, rerank_factor=rerank_factor)
+        query_ms = 1000 * (time.perf_counter() - start) / max(1, len(results))
+        return top_k_sets([[position for position, _ in hits] for hits in results]), query_ms
+
+    def recall_against(found, expected_sets):
+        return float(np.mean([len(hits & expected) / max(1, len(expected)) for hits, expected in zip(found, expected_sets)]))
+
+    truth, exact_ms = run("none", 0)
+    dimension = mmap_index.vectors.shape[1]
+    rows = [{"mode": f"{mmap_index.vectors.dtype} (exata NumPy, vectors.npy)", "recall": 1.0, "first_pass_bytes": mmap_index.vectors.nbytes,
+             "query_ms": exact_ms, "rerank_rows": 0}]
+    if chroma_collection is not None:
+        start = time.perf_counter()
+        chroma_ids = chroma_collection.query(query_embeddings=np.asarray(query_embeddings, dtype=np.float32).tolist(),
+                                             n_results=min(search_k, count), include=[])["ids"]
+        chroma_ms = 1000 * (time.perf_counter() - start) / max(1, len(chroma_ids))
+        # IDs que não existem no índice exportado (coleção alterada depois da exportação) contam como falhas
+        chroma_found = top_k_sets([[mmap_index._positions.get(node_id, -1) for node_id in hits] for hits in chroma_ids])
+        rows.append({"mode": "Chroma (HNSW, collection.query)", "recall": recall_against(chroma_found, truth),
+                     "first_pass_bytes": count * dimension * 4, "query_ms": chroma_ms, "rerank_rows": 0})
+    for quantization in ("int8", "binary"):
+        codes, parameters = mmap_index.quantized(quantization)
+        for rerank_factor in (0,) + tuple(rerank_factors):
+            found, query_ms = run(quantization, rerank_factor)
+            rows.append({"mode": quantization + (f" + reordenação float ({rerank_factor}x)" if rerank_factor else " (sem reordenação)"),
+                         "recall": recall_against(found, truth), "first_pass_bytes": codes.nbytes + parameters.nbytes,
+                         "query_ms": query_ms, "rerank_rows": search_k * rerank_factor})
+    return rows
+
+
+def format_quantization_report(rows, mmap_index, k):
+    lines = [f"Índice: {mmap_index.count()} nós x {mmap_index.vectors.shape[1]} dimensões; "
+             f"recall@{k} face à pesquisa exata (NumPy) sobre os vetores exportados.",
+             f"{'modo':<42} {'recall':>7} {'memória 1ª passagem':>20} {'bytes/vetor':>12} {'ms/query':>9} {'linhas float/query':>19}"]
+    for row in rows:
+        query_ms = f"{row['query_ms']:.2f}" if row["query_ms"] is not None else "-"
+        lines.append(f"{row['mode']:<42} {row['recall']:>7.3f} {row['first_pass_bytes'] / (1024 * 1024):>17.2f} MB "
+                     f"{row['first_pass_bytes'] / max(1, mmap_index.count()):>12.1f} {query_ms:>9} {row['rerank_rows']:>19}")
+    return "\n".join(lines)
+
+
+def _embed_queries_from_file(path, embed_model_name):
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    with open(path, "r", encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    return HuggingFaceEmbedding(model_name=embed_model_name).get_text_embedding_batch(queries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relatório de recall vs memória das pesquisas quantizadas num índice mmap exportado.")
+    parser.add_argument("--index-dir", default=os.path.join("llamaindex_chroma_db_docs", MMAP_INDEX_DIR_NAME),
+                        help="Diretório do índice mmap (ex: chroma_db_docs/mmap_index para index_documents.py).")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--sample", type=int, default=200, help="Nº de nós usados como queries (sem --queries-file).")
+    parser.add_argument("--queries-file", help="Ficheiro com uma query por linha (embutidas com o modelo da exportação).")
+    parser.add_argument("--rerank-factors", default="4,16", help="Fatores de reordenação a comparar (candidatos por resultado).")
+    parser.add_argument("--chroma-dir", help="Diretório Chroma de onde o índice foi exportado: mede também o recall do Chroma (HNSW).")
+    parser.add_argument("--collection", default="llamaindex_doc_embeddings_minilm",
+                        help="Coleção Chroma (com --chroma-dir; document_embeddings_minilm para index_documents.py).")
+    args = parser.parse_args()
+    try:
+        report_index = MmapVectorIndex(args.index_dir)
+    except (OSError, ValueError) as e:
+        print(f"[MMAP INDEX ERROR] Não foi possível abrir '{args.index_dir}': {e}")
+        sys.exit(1)
+    report_collection = None
+    if args.chroma_dir:
+        import chromadb
+        try:
+            report_collection = chromadb.PersistentClient(path=args.chroma_dir).get_collection(args.collection)
+        except Exception as e:
+            print(f"[MMAP INDEX ERROR] Não foi possível abrir a coleção '{args.collection}' em '{args.chroma_dir}': {e}")
+            sys.exit(1)
+    report_queries = _embed_queries_from_file(args.queries_file, report_index.manifest.get("embed_model")) if args.queries_file else None
+    report_rows = quantization_recall_report(report_index, report_queries, k=args.k, sample_size=args.sample,
+                                             rerank_factors=tuple(int(factor) for factor in args.rerank_factors.split(",") if factor.strip()),
+                                             chroma_collection=report_collection)
+    print(format_quantization_report(report_rows, report_index, args.k))
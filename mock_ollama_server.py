@@ -0,0 +1,295 @@
+# mock_ollama_server.py
+# Servidor local que imita a API do Ollama (/api/tags, /api/generate, /api/chat) para medir o overhead
+# do pipeline sem um LLM real. Débitos de tokens, latência e erros são configuráveis e reprodutíveis (seed).
+# Também imita a saída estruturada ('format', com os espaços gerados depois do objeto) e o raciocínio ('think').
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_DEFAULT_HOST = "127.0.0.1"
+MOCK_DEFAULT_PORT = 11435 # Diferente do Ollama real (11434) para poderem coexistir
+MOCK_DEFAULT_MODELS = ("mock-small:1b", "mock-large:7b", "qwen2:0.5b")
+MOCK_LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+MOCK_BYTES_PER_BILLION_PARAMS = 600 * 1024 ** 2 # Tamanho aproximado de um modelo quantizado Q4 por mil milhões de parâmetros
+MOCK_CHARS_PER_TOKEN = 4 # Aproximação usada para contar os tokens do prompt
+MOCK_RESPONSE_WORDS = ("PII", "field", "email", "risk", "GDPR", "Article", "personal", "data", "schema", "assessment",
+                       "identifier", "retention", "consent", "high", "low", "medium", "purpose", "lawful", "basis", "notes")
+
+
+class MockOllamaConfig:
+    """Parâmetros do servidor simulado. Latências em segundos, débitos em tokens/s, taxas de erro entre 0 e 1."""
+
+    def __init__(self, models=MOCK_DEFAULT_MODELS, prompt_tokens_per_second=2000.0, generation_tokens_per_second=200.0,
+                 response_tokens=120, latency_distribution="fixed", latency_mean=0.05, latency_spread=0.0,
+                 load_duration=0.0, error_rate=0.0, error_status=500, stream_error_rate=0.0, seed=None,
+                 context_length=32768, num_ctx=4096, thinking_models=("mock-large:7b",), thinking_tokens=200):
+        if latency_distribution not in MOCK_LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Distribuição de latência desconhecida: {latency_distribution}")
+        self.models = list(models)
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.generation_tokens_per_second = generation_tokens_per_second
+        self.response_tokens = response_tokens
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.load_duration = load_duration # Simula o carregamento do modelo no primeiro pedido de cada modelo
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_error_rate = stream_error_rate
+        self.context_length = context_length # Reportados em /api/show
+        self.num_ctx = num_ctx
+        self.thinking_models = set(thinking_models) # Geram '<think>...</think>' antes da resposta, salvo com think=false
+        self.thinking_tokens = thinking_tokens
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._loaded_models = set()
+        self.requests_served = 0
+
+    def random(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def sample_latency(self):
+        with self._random_lock:
+            if self.latency_distribution == "uniform":
+                value = self._random.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread)
+            elif self.latency_distribution == "exponential":
+                value = self._random.expovariate(1.0 / self.latency_mean) if self.latency_mean > 0 else 0.0
+            elif self.latency_distribution == "lognormal":
+                # latency_mean é a mediana; latency_spread é o sigma da normal subjacente
+                value = self._random.lognormvariate(0.0, self.latency_spread) * self.latency_mean
+            else:
+                value = self.latency_mean
+        return max(0.0, value)
+
+    def take_load_duration(self, model):
+        """Devolve o tempo de 'load' a simular (apenas no primeiro pedido de cada modelo)."""
+        with self._random_lock:
+            self.requests_served += 1
+            if model in self._loaded_models:
+                return 0.0
+            self._loaded_models.add(model)
+            return self.load_duration
+
+    def unload_model(self, model):
+        with self._random_lock:
+            self._loaded_models.discard(model)
+
+    def response_words(self, count):
+        with self._random_lock:
+            return [self._random.choice(MOCK_RESPONSE_WORDS) for _ in range(count)]
+
+
+def _estimate_model_size(model_name):
+    """Tamanho fictício a partir da tag (ex: 'mock-large:7b' -> ~4.2 GB, como um modelo Q4); 0 se não houver tag."""
+    match = re.search(r"([\d.]+)b$", model_name.split(":")[-1].lower())
+    return int(float(match.group(1)) * MOCK_BYTES_PER_BILLION_PARAMS) if match else 0
+
+
+def _sample_from_schema(schema, words):
+    """Valor mínimo que respeita o (subconjunto de) JSON Schema pedido em 'format'."""
+    schema_type = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        return {key: _sample_from_schema(sub_schema, words) for key, sub_schema in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [_sample_from_schema(schema["items"], words)] if "items" in schema else []
+    if schema_type in ("number", "integer"):
+        return 1
+    if schema_type == "boolean":
+        return False
+    return " ".join(words[:8])
+
+
+def _count_prompt_tokens(payload):
+    text = (payload.get("system") or "") + (payload.get("prompt") or "")
+    for message in payload.get("messages") or []:
+        text += message.get("content") or ""
+    return max(1, len(text) // MOCK_CHARS_PER_TOKEN)
+
+
+class MockOllamaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, como o Ollama
+    server_version = "MockOllama/1.0"
+
+    @property
+    def config(self):
+        return self.server.mock_config
+
+    def log_message(self, format, *args):
+        pass # Silencioso: o output do benchmark não deve ser misturado com o log de pedidos
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, obj):
+        data = json.dumps(obj).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json(200, {"models": [{"name": name, "model": name, "size": _estimate_model_size(name)} for name in self.config.models]})
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/api/generate", "/api/chat", "/api/show"):
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"error": f"invalid JSON: {e}"})
+            return
+        model = payload.get("model")
+        if model not in self.config.models:
+            self._send_json(404, {"error": f"model '{model}' not found"})
+            return
+        if path == "/api/show":
+            self._send_json(200, {"parameters": f"num_ctx {self.config.num_ctx}", "details": {"family": "mock"},
+                                  "model_info": {"general.architecture": "mock", "mock.context_length": self.config.context_length}})
+            return
+        if "think" in payload and model not in self.config.thinking_models:
+            self._send_json(400, {"error": f"\"{model}\" does not support thinking"})
+            return
+        if self.config.random() < self.config.error_rate:
+            self._send_json(self.config.error_status, {"error": "injected error"})
+            return
+        self._serve_completion(payload, is_chat=(path == "/api/chat"))
+
+    def _serve_completion(self, payload, is_chat):
+        config = self.config
+        request_start = time.perf_counter()
+        if payload.get("keep_alive") in (0, "0", "0s"):
+            config.unload_model(payload["model"])
+            self._send_json(200, {"model": payload["model"], "done": True, "done_reason": "unload", "response": ""})
+            return
+        load_seconds = config.take_load_duration(payload["model"])
+        if not payload.get("prompt") and not payload.get("messages"):
+            # Pedido vazio: apenas carrega o modelo (aquecimento), como no Ollama
+            time.sleep(load_seconds)
+            self._send_json(200, {"model": payload["model"], "done": True, "done_reason": "load", "response": "",
+                                  "load_duration": int(load_seconds * 1e9)})
+            return
+        time.sleep(load_seconds + config.sample_latency())
+        prompt_tokens = _count_prompt_tokens(payload)
+        prompt_seconds = prompt_tokens / config.prompt_tokens_per_second if config.prompt_tokens_per_second > 0 else 0.0
+        time.sleep(prompt_seconds)
+
+        words = [word + " " for word in config.response_words(config.response_tokens)]
+        if payload.get("format"):
+            # Saída estruturada: o objeto em pedaços de ~MOCK_CHARS_PER_TOKEN caracteres e depois espaços até response_tokens
+            schema = payload["format"] if isinstance(payload["format"], dict) else {"type": "object"}
+            object_text = json.dumps(_sample_from_schema(schema, [w.strip() for w in words]))
+            words = [object_text[i: i + MOCK_CHARS_PER_TOKEN] for i in range(0, len(object_text), MOCK_CHARS_PER_TOKEN)]
+            words += ["\n"] * max(0, config.response_tokens - len(words))
+        if payload["model"] in config.thinking_models and payload.get("think") is not False:
+            words = ["<think>"] + [word + " " for word in config.response_words(config.thinking_tokens)] + ["</think>\n"] + words
+        stream = payload.get("stream", True)
+        fail_at = int(len(words) * config.random()) if config.random() < config.stream_error_rate else None
+        token_delay = 1.0 / config.generation_tokens_per_second if config.generation_tokens_per_second > 0 else 0.0
+
+        def piece(text):
+            return {"message": {"role": "assistant", "content": text}} if is_chat else {"response": text}
+
+        if stream:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+        generation_start = time.perf_counter()
+        for position, word in enumerate(words):
+            if position == fail_at:
+                if stream:
+                    self._write_chunk({"error": "injected stream error"})
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    self._send_json(500, {"error": "injected stream error"})
+                return
+            time.sleep(token_delay)
+            if stream:
+                try:
+                    self._write_chunk({"model": payload["model"], "done": False, **piece(word)})
+                except (BrokenPipeError, ConnectionResetError):
+                    return # O cliente fechou o stream (ex: paragem antecipada): a geração é cancelada, como no Ollama
+        generation_seconds = time.perf_counter() - generation_start
+
+        done_chunk = {
+            "model": payload["model"], "done": True, "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - request_start) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": len(words), "eval_duration": int(generation_seconds * 1e9),
+        }
+        if stream:
+            self._write_chunk({**done_chunk, **piece("")})
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json(200, {**done_chunk, **piece("".join(words))})
+
+
+def start_mock_server(config=None, host=MOCK_DEFAULT_HOST, port=0):
+    """
+    Inicia o servidor numa thread em background. port=0 escolhe uma porta livre.
+    Devolve (servidor, base_url); usar servidor.shutdown() para parar.
+    """
+    server = ThreadingHTTPServer((host, port), MockOllamaRequestHandler)
+    server.daemon_threads = True
+    server.mock_config = config or MockOllamaConfig()
+    threading.Thread(target=server.serve_forever, name="mock_ollama_server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api"
+
+
+def add_mock_config_arguments(parser):
+    """Argumentos de linha de comandos partilhados com benchmark_pipeline.py."""
+    parser.add_argument("--models", nargs="+", default=list(MOCK_DEFAULT_MODELS), help="Modelos anunciados em /api/tags.")
+    parser.add_argument("--prompt-tps", type=float, default=2000.0, help="Débito de avaliação do prompt (tokens/s).")
+    parser.add_argument("--gen-tps", type=float, default=200.0, help="Débito de geração (tokens/s).")
+    parser.add_argument("--response-tokens", type=int, default=120, help="Tokens gerados por resposta.")
+    parser.add_argument("--latency", choices=MOCK_LATENCY_DISTRIBUTIONS, default="fixed", help="Distribuição da latência inicial.")
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="Latência média/mediana (s).")
+    parser.add_argument("--latency-spread", type=float, default=0.0, help="Meia-amplitude (uniform) ou sigma (lognormal).")
+    parser.add_argument("--load-duration", type=float, default=0.0, help="Tempo de 'load' simulado no 1º pedido de cada modelo (s).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de pedidos que falham com erro HTTP.")
+    parser.add_argument("--error-status", type=int, default=500, help="Código HTTP dos erros injetados.")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="Fração de respostas interrompidas com erro no stream.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed para resultados reprodutíveis.")
+
+
+def mock_config_from_args(args):
+    return MockOllamaConfig(
+        models=args.models, prompt_tokens_per_second=args.prompt_tps, generation_tokens_per_second=args.gen_tps,
+        response_tokens=args.response_tokens, latency_distribution=args.latency, latency_mean=args.latency_mean,
+        latency_spread=args.latency_spread, load_duration=args.load_duration, error_rate=args.error_rate,
+        error_status=args.error_status, stream_error_rate=args.stream_error_rate, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado para testes de desempenho offline.")
+    parser.add_argument("--host", default=MOCK_DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=MOCK_DEFAULT_PORT)
+    add_mock_config_arguments(parser)
+    cli_args = parser.parse_args()
+    mock_server = ThreadingHTTPServer((cli_args.host, cli_args.port), MockOllamaRequestHandler)
+    mock_server.daemon_threads = True
+    mock_server.mock_config = mock_config_from_args(cli_args)
+    print(f"[MOCK OLLAMA] A servir em http://{cli_args.host}:{cli_args.port}/api (modelos: {', '.join(cli_args.models)}). Ctrl+C para parar.")
+    try:
+        mock_server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[MOCK OLLAMA] A terminar.")
+    finally:
+        mock_server.server_close()
@@ -0,0 +1,101 @@
+# model_sweep_scheduler.py
+# Planeamento de execuções com vários modelos ("todos os modelos"): ordena por tamanho, descarrega cada modelo
+# quando termina (keep_alive 0), aquece o seguinte antes de a medição começar e, opcionalmente, agrupa
+# modelos pequenos para correrem lado a lado quando a RAM livre o permite.
+import time
+
+import psutil
+
+SWEEP_RAM_HEADROOM_FRACTION = 0.8 # Fração da RAM disponível que os modelos em simultâneo podem ocupar
+SWEEP_MODEL_MEMORY_OVERHEAD = 1.2 # Memória residente ≈ tamanho do ficheiro do modelo × fator (KV cache, buffers)
+SWEEP_DEFAULT_MAX_PARALLEL = 1 # 1 = um modelo de cada vez (comportamento clássico)
+
+
+def get_model_sizes(ollama_client):
+    """Tamanho em bytes de cada modelo, segundo /api/tags ({nome: bytes}; 0 se desconhecido)."""
+    try:
+        return {model["name"]: model.get("size") or 0 for model in ollama_client.list_models()}
+    except Exception as e:
+        print(f"[SWEEP WARNING] Não foi possível obter os tamanhos dos modelos: {e}. A manter a ordem original.")
+        return {}
+
+
+def estimate_resident_bytes(model_size_bytes):
+    return int(model_size_bytes * SWEEP_MODEL_MEMORY_OVERHEAD)
+
+
+def plan_model_sweep(model_names, model_sizes, max_parallel=SWEEP_DEFAULT_MAX_PARALLEL, available_ram_bytes=None, reserved_bytes=0):
+    """
+    Ordena os modelos do mais pequeno para o maior e agrupa-os em lotes.
+    Cada lote corre em simultâneo: no máximo max_parallel modelos, cuja memória estimada (mais reserved_bytes,
+    ex: o LLM auxiliar) cabe na RAM disponível. Modelos de tamanho desconhecido correm sempre sozinhos, no fim.
+    """
+    known = sorted((name for name in model_names if model_sizes.get(name)), key=lambda name: model_sizes[name])
+    unknown = [name for name in model_names if not model_sizes.get(name)]
+    if available_ram_bytes is None:
+        available_ram_bytes = psutil.virtual_memory().available
+    ram_budget = available_ram_bytes * SWEEP_RAM_HEADROOM_FRACTION - reserved_bytes
+
+    batches = []
+    current_batch, current_bytes = [], 0
+    for name in known:
+        needed = estimate_resident_bytes(model_sizes[name])
+        if current_batch and (len(current_batch) >= max_parallel or current_bytes + needed > ram_budget):
+            batches.append(current_batch)
+            current_batch, current_bytes = [], 0
+        current_batch.append(name)
+        current_bytes += needed
+    if current_batch:
+        batches.append(current_batch)
+    batches.extend([name] for name in unknown)
+    return batches
+
+
+def warm_up_model(ollama_client, model_name, keep_alive):
+    """
+    Carrega o modelo (pedido com prompt vazio) em todos os servidores que o têm, para que o tempo de load
+    não entre na medição. Devolve segundos.
+    """
+    start = time.perf_counter()
+    try:
+        for base_url, result in ollama_client.generate_on_all_endpoints(model_name, "", keep_alive=keep_alive):
+            if isinstance(result, Exception):
+                print(f"[SWEEP WARNING] Falha ao aquecer '{model_name}' em {base_url}: {result}")
+    except Exception as e:
+        print(f"[SWEEP WARNING] Falha ao aquecer '{model_name}': {e}")
+    return time.perf_counter() - start
+
+
+def unload_model(ollama_client, model_name):
+    """Pede a todos os servidores Ollama que têm o modelo para o descarregar de imediato (keep_alive 0). Devolve segundos."""
+    start = time.perf_counter()
+    try:
+        for base_url, result in ollama_client.generate_on_all_endpoints(model_name, "", keep_alive=0):
+            if isinstance(result, Exception):
+                print(f"[SWEEP WARNING] Falha ao descarregar '{model_name}' em {base_url}: {result}")
+    except Exception as e:
+        print(f"[SWEEP WARNING] Falha ao descarregar '{model_name}': {e}")
+    return time.perf_counter() - start
+
+
+class ModelSweepStats:
+    """Tempos de aquecimento/descarga por modelo, para o sumário final."""
+
+    def __init__(self):
+        self.warm_up_seconds = {}
+        self.unload_seconds = {}
+
+    def summary(self):
+        lines = ["[SWEEP] Aquecimento / descarga por modelo:"]
+        for name in self.warm_up_seconds:
+            lines.append(f"  - {name}: aquecimento {self.warm_up_seconds[name]:.2f}s, "
+                         f"descarga {self.unload_seconds.get(name, 0.0):.2f}s")
+        lines.append(f"  = total aquecimento {sum(self.warm_up_seconds.values()):.2f}s, "
+                     f"total descarga {sum(self.unload_seconds.values()):.2f}s")
+        return "\n".join(lines)
+
+
+def format_sweep_plan(batches, model_sizes):
+    gib = lambda size: f"{size / 1024 ** 3:.1f}GiB" if size else "?"
+    return "\n".join(f"  Lote {idx + 1}: " + ", ".join(f"{name} ({gib(model_sizes.get(name))})" for name in batch)
+                     for idx, batch in enumerate(batches))
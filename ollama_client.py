@@ -0,0 +1,503 @@
+# ollama_client.py
+import time
+import asyncio
+import json
+import threading
+
+import httpx # Já instalado como dependência do pacote 'ollama' / llama-index-llms-ollama
+
+from llm_response_cache import compute_llm_cache_key
+from ollama_endpoint_pool import OllamaEndpointPool, ENDPOINT_HEALTH_CHECK_TIMEOUT_SECONDS
+
+OLLAMA_DEFAULT_BASE_URL = "http://localhost:11434/api"
+OLLAMA_TAGS_ENDPOINT_SUFFIX = "/tags"
+OLLAMA_GENERATE_ENDPOINT_SUFFIX = "/generate"
+OLLAMA_CHAT_ENDPOINT_SUFFIX = "/chat"
+OLLAMA_SHOW_ENDPOINT_SUFFIX = "/show"
+OLLAMA_DEFAULT_TIMEOUT_SECONDS = 360
+OLLAMA_MAX_CONNECTIONS = 16 # Ligações keep-alive reutilizadas entre pedidos (por servidor)
+OLLAMA_KEEPALIVE_EXPIRY_SECONDS = 120
+EARLY_STOP_DONE_REASON = "early_stop" # done_reason do chunk 'done' sintetizado quando o cliente interrompe o stream
+
+
+class OllamaClientError(Exception):
+    """Erro ao comunicar com o Ollama. 'kind' é 'http', 'stream' ou 'request'."""
+
+    def __init__(self, message, kind="request", status_code=None, response_text=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+class OllamaResponse:
+    """Texto completo de uma chamada (generate/chat) e o último chunk ('done') devolvido pelo servidor."""
+
+    def __init__(self, text, done_chunk=None, status_code=None, from_cache=False):
+        self.text = text
+        self.done_chunk = done_chunk or {}
+        self.status_code = status_code
+        self.from_cache = from_cache
+
+    @property
+    def metrics(self):
+        """Métricas do servidor (ver extract_generation_metrics)."""
+        return extract_generation_metrics(self.done_chunk, from_cache=self.from_cache)
+
+
+def extract_generation_metrics(done_chunk, from_cache=False):
+    """
+    Métricas do servidor presentes no chunk 'done' (durações em nanossegundos convertidas para segundos),
+    com as taxas de tokens/s de avaliação do prompt e de geração. Devolve None se não houver métricas.
+    """
+    if not done_chunk or "eval_count" not in done_chunk and "total_duration" not in done_chunk:
+        return None
+    ns_to_s = lambda key: (done_chunk.get(key) or 0) / 1e9
+    metrics = {
+        "total_duration": ns_to_s("total_duration"),
+        "load_duration": ns_to_s("load_duration"),
+        "prompt_eval_count": done_chunk.get("prompt_eval_count") or 0,
+        "prompt_eval_duration": ns_to_s("prompt_eval_duration"),
+        "eval_count": done_chunk.get("eval_count") or 0,
+        "eval_duration": ns_to_s("eval_duration"),
+        "from_cache": from_cache,
+        "early_stopped": done_chunk.get("done_reason") == EARLY_STOP_DONE_REASON,
+    }
+    metrics["prompt_tokens_per_second"] = metrics["prompt_eval_count"] / metrics["prompt_eval_duration"] if metrics["prompt_eval_duration"] > 0 else None
+    metrics["generation_tokens_per_second"] = metrics["eval_count"] / metrics["eval_duration"] if metrics["eval_duration"] > 0 else None
+    return metrics
+
+
+def format_generation_metrics(metrics):
+    if not metrics:
+        return "N/A"
+    fmt_rate = lambda rate: f"{rate:.1f} tok/s" if rate else "N/A"
+    if metrics.get("early_stopped"): # O chunk 'done' foi sintetizado no cliente: sem métricas de load nem de prompt
+        load_and_prompt = "load/prompt N/A (sem métricas do servidor)"
+    else:
+        load_and_prompt = (f"load {metrics['load_duration']:.2f}s | prompt {metrics['prompt_eval_count']} tok em {metrics['prompt_eval_duration']:.2f}s "
+                           f"({fmt_rate(metrics['prompt_tokens_per_second'])})")
+    return (f"{load_and_prompt} | geração {metrics['eval_count']} tok em {metrics['eval_duration']:.2f}s "
+            f"({fmt_rate(metrics['generation_tokens_per_second'])}) | total servidor {metrics['total_duration']:.2f}s"
+            + (" | (resposta da cache)" if metrics.get("from_cache") else "")
+            + (" | stream interrompido no fim do objeto JSON (tokens contados no cliente)" if metrics.get("early_stopped") else ""))
+
+
+def summarize_generation_metrics(metrics_list):
+    """
+    Agrega as métricas do servidor de vários documentos (respostas da cache são ignoradas):
+    tokens/s de prompt e de geração (total de tokens / total de tempo) e tempo médio de load.
+    Respostas com paragem antecipada não têm métricas de prompt nem de load (chunk 'done' sintetizado no cliente):
+    contam apenas para a geração e o nº de excluídas do prompt/load fica em 'early_stopped'.
+    """
+    measured = [m for m in metrics_list if m and not m.get("from_cache")]
+    if not measured:
+        return None
+    server_measured = [m for m in measured if not m.get("early_stopped")]
+    prompt_tokens = sum(m["prompt_eval_count"] for m in server_measured); prompt_seconds = sum(m["prompt_eval_duration"] for m in server_measured)
+    gen_tokens = sum(m["eval_count"] for m in measured); gen_seconds = sum(m["eval_duration"] for m in measured)
+    total_load_duration = sum(m["load_duration"] for m in server_measured)
+    return {
+        "documents_measured": len(measured),
+        "early_stopped": len(measured) - len(server_measured),
+        "prompt_tokens_per_second": prompt_tokens / prompt_seconds if prompt_seconds > 0 else None,
+        "generation_tokens_per_second": gen_tokens / gen_seconds if gen_seconds > 0 else None,
+        "avg_load_duration": total_load_duration / len(server_measured) if server_measured else None,
+        "total_load_duration": total_load_duration if server_measured else None,
+        "prompt_tokens": prompt_tokens, "generation_tokens": gen_tokens,
+    }
+
+
+def format_throughput_summary(summary):
+    if not summary:
+        return "Throughput (servidor Ollama): N/A (sem métricas)"
+    fmt_rate = lambda rate: f"{rate:.1f} tok/s" if rate else "N/A"
+    load_text = (f"load médio {summary['avg_load_duration']:.2f}s (total {summary['total_load_duration']:.2f}s)"
+                 if summary.get("avg_load_duration") is not None else "load N/A")
+    early_stopped = summary.get("early_stopped", 0)
+    return (f"Throughput (servidor Ollama, {summary['documents_measured']} docs): prompt {fmt_rate(summary['prompt_tokens_per_second'])}, "
+            f"geração {fmt_rate(summary['generation_tokens_per_second'])}, {load_text}, "
+            f"tokens prompt/geração: {summary['prompt_tokens']}/{summary['generation_tokens']}"
+            + (f" ({early_stopped} com paragem antecipada excluídos do prompt/load)" if early_stopped else ""))
+
+
+def _generation_extras(format, think):
+    """Parâmetros extra que entram na chave da cache (None se não houver, para manter as chaves antigas)."""
+    extras = {key: value for key, value in (("format", format), ("think", think)) if value is not None}
+    return extras or None
+
+
+def _early_stop_done_chunk(request_start, first_piece_time, piece_count):
+    """Chunk 'done' estimado no cliente quando o stream é interrompido: cada pedaço conta como um token."""
+    now = time.perf_counter()
+    return {"done": True, "done_reason": EARLY_STOP_DONE_REASON, "eval_count": piece_count,
+            "eval_duration": int((now - first_piece_time) * 1e9), "total_duration": int((now - request_start) * 1e9)}
+
+
+def should_fail_over(error):
+    """Erros que justificam tentar outro servidor do pool: ligação/timeout, HTTP 5xx, modelo em falta (404) e erros no stream."""
+    if error.kind in ("request", "stream"):
+        return True
+    return error.status_code is None or error.status_code >= 500 or error.status_code == 404
+
+
+async def iter_ndjson_objects(byte_chunks):
+    """
+    Converte um stream de bytes NDJSON em objetos JSON à medida que as linhas chegam.
+    Cada linha é descodificada uma única vez (json.loads aceita bytes diretamente).
+    """
+    buffer = b""
+    async for chunk in byte_chunks:
+        buffer += chunk
+        while True:
+            newline_pos = buffer.find(b"\n")
+            if newline_pos < 0:
+                break
+            line, buffer = buffer[:newline_pos], buffer[newline_pos + 1:]
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except json.JSONDecodeError:
+            pass
+
+
+class OllamaClient:
+    """
+    Cliente Ollama partilhado, com pool de ligações keep-alive.
+    A API assíncrona (agenerate/achat/alist_models) corre num event loop dedicado,
+    pelo que pode ser usada a partir de qualquer loop; generate/chat/list_models são os wrappers síncronos
+    e podem ser chamados em paralelo por várias threads.
+    Com vários servidores (base_urls), cada pedido vai para o servidor com menos pedidos em curso que tem o modelo,
+    e passa para outro servidor se este falhar (ver ollama_endpoint_pool.py).
+    """
+
+    def __init__(self, base_url=OLLAMA_DEFAULT_BASE_URL, timeout=OLLAMA_DEFAULT_TIMEOUT_SECONDS,
+                 max_connections=OLLAMA_MAX_CONNECTIONS, response_cache=None, base_urls=None):
+        self.endpoint_pool = OllamaEndpointPool(base_urls or [base_url])
+        self.base_url = self.endpoint_pool.endpoints[0].base_url
+        self.response_cache = response_cache # LLMResponseCache opcional (ver llm_response_cache.py)
+        self.timeout = timeout
+        self.max_connections = max_connections * len(self.endpoint_pool)
+        self._loop = None
+        self._loop_thread = None
+        self._http_client = None
+        self._start_lock = threading.Lock()
+        self._models_without_thinking = set() # Modelos que recusaram o parâmetro 'think'
+
+    # --- Event loop dedicado ---
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            loop_ready = threading.Event()
+
+            def run_loop():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._http_client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections,
+                                        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_SECONDS),
+                )
+                loop_ready.set()
+                self._loop.run_forever()
+
+            self._loop_thread = threading.Thread(target=run_loop, name="ollama_client_loop", daemon=True)
+            self._loop_thread.start()
+            loop_ready.wait()
+            return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def _run_sync(self, coro):
+        return self._submit(coro).result()
+
+    async def _run_async(self, coro):
+        return await asyncio.wrap_future(self._submit(coro))
+
+    # --- Implementação (corre sempre no loop do cliente) ---
+    async def _fetch_tags(self, base_url, timeout=10):
+        try:
+            response = await self._http_client.get(f"{base_url}{OLLAMA_TAGS_ENDPOINT_SUFFIX}", timeout=timeout)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise OllamaClientError(str(e), kind="http", status_code=e.response.status_code, response_text=e.response.text[:200]) from e
+        except httpx.HTTPError as e:
+            raise OllamaClientError(str(e) or type(e).__name__, kind="request") from e
+        return response.json().get("models", [])
+
+    async def _health_check(self, timeout=ENDPOINT_HEALTH_CHECK_TIMEOUT_SECONDS):
+        """/api/tags em todos os servidores do pool, em paralelo. Devolve [(servidor, modelos ou OllamaClientError)]."""
+        results = await asyncio.gather(*(self._fetch_tags(endpoint.base_url, timeout) for endpoint in self.endpoint_pool.endpoints),
+                                       return_exceptions=True)
+        for endpoint, result in zip(self.endpoint_pool.endpoints, results):
+            if isinstance(result, OllamaClientError):
+                self.endpoint_pool.record_health_check(endpoint, error=result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                self.endpoint_pool.record_health_check(endpoint, models=result)
+        return list(zip(self.endpoint_pool.endpoints, results))
+
+    async def _list_models(self):
+        if len(self.endpoint_pool) == 1:
+            return await self._fetch_tags(self.base_url)
+        models_by_name = {}
+        last_error = None
+        for _, result in await self._health_check(timeout=10):
+            if isinstance(result, OllamaClientError):
+                last_error = result
+                continue
+            for model in result:
+                models_by_name.setdefault(model["name"], model) # União dos modelos de todos os servidores
+        if not models_by_name and last_error is not None:
+            raise last_error
+        return list(models_by_name.values())
+
+    async def _dispatch(self, model, request_fn):
+        """Executa request_fn(base_url) no servidor escolhido pelo pool, passando para o seguinte em caso de falha."""
+        if self.endpoint_pool.health_check_due():
+            await self._health_check()
+        tried = set()
+        while True:
+            endpoint = self.endpoint_pool.select(model, exclude=tried)
+            tried.add(endpoint.base_url)
+            start_time = self.endpoint_pool.acquire(endpoint)
+            try:
+                result = await request_fn(endpoint.base_url)
+            except OllamaClientError as e:
+                model_missing = e.kind == "http" and e.status_code == 404
+                # Erros do pedido (ex: 400) não tornam o servidor indisponível
+                self.endpoint_pool.release(endpoint, start_time, error=e if should_fail_over(e) else None, model=model, model_missing=model_missing)
+                if len(tried) >= len(self.endpoint_pool) or not should_fail_over(e):
+                    raise
+                print(f"[OLLAMA POOL WARNING] '{model}' falhou em {endpoint.base_url} ({e}); a tentar outro servidor.")
+                continue
+            self.endpoint_pool.release(endpoint, start_time)
+            return result
+
+    async def _show_model(self, model):
+        return await self._dispatch(model, lambda base_url: self._show_model_at(base_url, model))
+
+    async def _show_model_at(self, base_url, model):
+        try:
+            response = await self._http_client.post(f"{base_url}{OLLAMA_SHOW_ENDPOINT_SUFFIX}", json={"model": model}, timeout=30)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise OllamaClientError(str(e), kind="http", status_code=e.response.status_code, response_text=e.response.text[:200]) from e
+        except httpx.HTTPError as e:
+            raise OllamaClientError(str(e) or type(e).__name__, kind="request") from e
+        return response.json()
+
+    async def _stream(self, base_url, endpoint_suffix, payload, text_of_chunk, timeout=None, early_stop_factory=None):
+        """
+        early_stop_factory: função sem argumentos que devolve um feed(pedaço) -> bool (novo em cada tentativa);
+        quando devolve True, o stream é fechado sem esperar pelo 'done' (o Ollama cancela a geração quando a ligação fecha).
+        """
+        text_parts = []
+        done_chunk = None
+        stop_when = early_stop_factory() if early_stop_factory else None
+        request_start = time.perf_counter()
+        first_piece_time = None
+        try:
+            async with self._http_client.stream("POST", f"{base_url}{endpoint_suffix}", json=payload,
+                                                timeout=timeout or self.timeout) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode("utf-8", errors="ignore")
+                    raise OllamaClientError(f"HTTP {response.status_code} for url {response.url}", kind="http",
+                                            status_code=response.status_code, response_text=body[:200])
+                async for chunk in iter_ndjson_objects(response.aiter_bytes()):
+                    if "error" in chunk:
+                        raise OllamaClientError(str(chunk["error"]), kind="stream", status_code=response.status_code)
+                    piece = text_of_chunk(chunk)
+                    if piece:
+                        text_parts.append(piece)
+                        first_piece_time = first_piece_time or time.perf_counter()
+                        if stop_when is not None and stop_when(piece):
+                            done_chunk = _early_stop_done_chunk(request_start, first_piece_time, len(text_parts))
+                            break
+                    if chunk.get("done", False):
+                        done_chunk = chunk
+                        break
+                if done_chunk is None:
+                    # Ligação fechada antes do 'done': resposta truncada (não pode ser tratada nem guardada como completa)
+                    raise OllamaClientError(f"Stream terminou sem o chunk 'done' ({len(text_parts)} pedaços recebidos)",
+                                            kind="stream", status_code=response.status_code)
+                return OllamaResponse("".join(text_parts), done_chunk, response.status_code)
+        except httpx.HTTPError as e:
+            raise OllamaClientError(str(e) or type(e).__name__, kind="request") from e
+
+    async def _generate(self, model, prompt, system=None, options=None, keep_alive=None, timeout=None,
+                        format=None, think=None, early_stop_factory=None):
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if system is not None: payload["system"] = system
+        if options: payload["options"] = options
+        if keep_alive is not None: payload["keep_alive"] = keep_alive
+        if format is not None: payload["format"] = format
+        if think is not None and model not in self._models_without_thinking: payload["think"] = think
+        request_fn = lambda base_url: self._stream(base_url, OLLAMA_GENERATE_ENDPOINT_SUFFIX, payload, lambda c: c.get("response"),
+                                                   timeout, early_stop_factory)
+        try:
+            return await self._dispatch(model, request_fn)
+        except OllamaClientError as e:
+            # Modelos sem suporte para 'think' respondem 400 ("does not support thinking"): repetir sem o parâmetro
+            if "think" not in payload or e.status_code != 400 or "think" not in (e.response_text or "").lower():
+                raise
+            print(f"[OLLAMA CLIENT] '{model}' não suporta o parâmetro 'think'; a repetir sem ele.")
+            self._models_without_thinking.add(model)
+            payload.pop("think")
+            return await self._dispatch(model, request_fn)
+
+    async def _generate_on_all_endpoints(self, model, prompt, keep_alive=None, timeout=None):
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if keep_alive is not None: payload["keep_alive"] = keep_alive
+        if self.endpoint_pool.health_check_due():
+            await self._health_check()
+        endpoints = self.endpoint_pool.endpoints_serving(model)
+        results = await asyncio.gather(*(self._stream(endpoint.base_url, OLLAMA_GENERATE_ENDPOINT_SUFFIX, payload, lambda c: c.get("response"), timeout)
+                                         for endpoint in endpoints), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, OllamaClientError):
+                raise result
+        return [(endpoint.base_url, result) for endpoint, result in zip(endpoints, results)]
+
+    async def _chat(self, model, messages, options=None, keep_alive=None, timeout=None):
+        payload = {"model": model, "messages": messages, "stream": True}
+        if options: payload["options"] = options
+        if keep_alive is not None: payload["keep_alive"] = keep_alive
+        return await self._dispatch(model, lambda base_url: self._stream(base_url, OLLAMA_CHAT_ENDPOINT_SUFFIX, payload,
+                                                                         lambda c: (c.get("message") or {}).get("content"), timeout))
+
+    # --- Cache de respostas ---
+    def _cache_key(self, use_cache, endpoint_suffix, model, **key_parts):
+        if not use_cache or self.response_cache is None:
+            return None
+        return compute_llm_cache_key(endpoint_suffix, model, **key_parts)
+
+    def _cache_lookup(self, cache_key):
+        if cache_key is None:
+            return None
+        entry = self.response_cache.get(cache_key)
+        if entry is None:
+            return None
+        return OllamaResponse(entry.get("text", ""), entry.get("done_chunk"), from_cache=True)
+
+    def _cache_store(self, cache_key, response):
+        # Só respostas completas: com o chunk 'done' do servidor ou o sintetizado na paragem antecipada
+        if cache_key is None or not response.text.strip() or not response.done_chunk.get("done"):
+            return
+        self.response_cache.put(cache_key, {"text": response.text, "done_chunk": response.done_chunk})
+
+    # --- API assíncrona ---
+    async def alist_models(self):
+        return await self._run_async(self._list_models())
+
+    async def ashow_model(self, model):
+        return await self._run_async(self._show_model(model))
+
+    async def agenerate(self, model, prompt, system=None, options=None, keep_alive=None, timeout=None, use_cache=True,
+                        format=None, think=None, early_stop_factory=None):
+        cache_key = self._cache_key(use_cache, OLLAMA_GENERATE_ENDPOINT_SUFFIX, model, system_prompt=system, user_prompt=prompt, options=options,
+                                    extra=_generation_extras(format, think))
+        cached = self._cache_lookup(cache_key)
+        if cached: return cached
+        response = await self._run_async(self._generate(model, prompt, system, options, keep_alive, timeout, format, think, early_stop_factory))
+        self._cache_store(cache_key, response)
+        return response
+
+    async def achat(self, model, messages, options=None, keep_alive=None, timeout=None, use_cache=True):
+        cache_key = self._cache_key(use_cache, OLLAMA_CHAT_ENDPOINT_SUFFIX, model, messages=messages, options=options)
+        cached = self._cache_lookup(cache_key)
+        if cached: return cached
+        response = await self._run_async(self._chat(model, messages, options, keep_alive, timeout))
+        self._cache_store(cache_key, response)
+        return response
+
+    # --- Wrappers síncronos ---
+    def list_models(self):
+        return self._run_sync(self._list_models())
+
+    def show_model(self, model):
+        """Informação do modelo (/api/show): 'model_info', 'parameters', 'details', ..."""
+        return self._run_sync(self._show_model(model))
+
+    def generate(self, model, prompt, system=None, options=None, keep_alive=None, timeout=None, use_cache=True,
+                 format=None, think=None, early_stop_factory=None):
+        """
+        format: 'json' ou um JSON Schema (saída estruturada); think: True/False para ativar/desativar o raciocínio
+        em modelos que o suportam; early_stop_factory: ver _stream.
+        """
+        cache_key = self._cache_key(use_cache, OLLAMA_GENERATE_ENDPOINT_SUFFIX, model, system_prompt=system, user_prompt=prompt, options=options,
+                                    extra=_generation_extras(format, think))
+        cached = self._cache_lookup(cache_key)
+        if cached: return cached
+        response = self._run_sync(self._generate(model, prompt, system, options, keep_alive, timeout, format, think, early_stop_factory))
+        self._cache_store(cache_key, response)
+        return response
+
+    def chat(self, model, messages, options=None, keep_alive=None, timeout=None, use_cache=True):
+        cache_key = self._cache_key(use_cache, OLLAMA_CHAT_ENDPOINT_SUFFIX, model, messages=messages, options=options)
+        cached = self._cache_lookup(cache_key)
+        if cached: return cached
+        response = self._run_sync(self._chat(model, messages, options, keep_alive, timeout))
+        self._cache_store(cache_key, response)
+        return response
+
+    def generate_on_all_endpoints(self, model, prompt, keep_alive=None, timeout=None):
+        """
+        O mesmo pedido (sem cache) em todos os servidores que têm o modelo, ex: carregar ou descarregar (keep_alive 0)
+        o modelo em todo o pool. Devolve [(base_url, OllamaResponse ou OllamaClientError)].
+        """
+        return self._run_sync(self._generate_on_all_endpoints(model, prompt, keep_alive, timeout))
+
+    def endpoint_stats_summary(self):
+        return self.endpoint_pool.stats_summary()
+
+    def close(self):
+        if self._loop is None:
+            return
+        try:
+            self._run_sync(self._http_client.aclose())
+        except Exception as e:
+            print(f"[OLLAMA CLIENT WARNING] Erro ao fechar ligações: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        self._loop = None
+
+
+class OllamaChatModel:
+    """LLM Ollama com nome fixo (ex: o LLM auxiliar das tarefas RAG) que usa o cliente partilhado."""
+
+    def __init__(self, model, client=None, request_timeout=None, options=None, keep_alive=None):
+        self.model = model
+        self.client = client or get_shared_client()
+        self.request_timeout = request_timeout
+        self.options = options
+        self.keep_alive = keep_alive
+
+    def chat(self, messages):
+        """messages: lista de dicionários {'role': ..., 'content': ...}. Devolve o texto da resposta."""
+        response = self.client.chat(self.model, messages, options=self.options,
+                                    keep_alive=self.keep_alive, timeout=self.request_timeout)
+        return response.text
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client(base_url=None, timeout=None, response_cache=None, base_urls=None):
+    """Devolve o cliente Ollama partilhado pelo processo (criado e configurado na primeira chamada)."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = OllamaClient(base_url or OLLAMA_DEFAULT_BASE_URL, timeout or OLLAMA_DEFAULT_TIMEOUT_SECONDS,
+                                          response_cache=response_cache, base_urls=base_urls)
+        return _shared_client
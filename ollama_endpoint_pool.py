@@ -0,0 +1,127 @@
+# ollama_endpoint_pool.py
+# Pool de servidores Ollama usado pelo cliente partilhado (ollama_client.py): modelos disponíveis em cada servidor
+# (descobertos por /api/tags), estado de saúde, e escolha do servidor com menos pedidos em curso.
+# Todos os métodos são chamados no event loop do cliente (uma única thread), pelo que não há locks.
+import time
+
+OLLAMA_ENDPOINTS_ENV_VAR = "OLLAMA_ENDPOINTS" # Ex: "http://gpu1:11434,http://gpu2:11434"
+ENDPOINT_HEALTH_CHECK_INTERVAL_SECONDS = 30 # Periodicidade do /api/tags em todos os servidores (modelos e saúde)
+ENDPOINT_HEALTH_CHECK_TIMEOUT_SECONDS = 5
+
+
+def parse_endpoint_list(value):
+    """'gpu1:11434, http://gpu2:11434/api' -> ['http://gpu1:11434/api', 'http://gpu2:11434/api'] (sem repetidos)."""
+    base_urls = []
+    for item in (value or "").replace(";", ",").split(","):
+        item = item.strip().rstrip("/")
+        if not item:
+            continue
+        if "://" not in item:
+            item = "http://" + item
+        if not item.endswith("/api"):
+            item += "/api"
+        if item not in base_urls:
+            base_urls.append(item)
+    return base_urls
+
+
+class OllamaEndpoint:
+    """Um servidor Ollama do pool e os seus contadores."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.healthy = True # Otimista até ao primeiro health check
+        self.models = None # Nomes listados em /api/tags (None = ainda desconhecido)
+        self.missing_models = set() # Modelos que o servidor recusou (404) desde o último health check
+        self.outstanding = 0
+        self.dispatched = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+
+    def serves(self, model):
+        return model not in self.missing_models and (self.models is None or model in self.models)
+
+
+class OllamaEndpointPool:
+    """
+    Escolha de servidor por pedido: entre os servidores saudáveis que têm o modelo, o que tem menos pedidos em curso
+    (empate: o que recebeu menos pedidos). Servidores que falham ficam fora da escolha até um health check OK;
+    se nenhum servidor servir, são tentados na mesma (podem ter recuperado).
+    """
+
+    def __init__(self, base_urls, health_check_interval=ENDPOINT_HEALTH_CHECK_INTERVAL_SECONDS):
+        self.endpoints = [OllamaEndpoint(base_url) for base_url in base_urls]
+        if not self.endpoints:
+            raise ValueError("O pool de servidores Ollama precisa de pelo menos um endereço.")
+        self.health_check_interval = health_check_interval
+        self._last_health_check = None
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def health_check_due(self):
+        """True (e marca o início da verificação) se o último health check é mais antigo que o intervalo."""
+        if len(self.endpoints) == 1:
+            return False # Com um único servidor não há alternativa: os erros chegam diretamente a quem chamou
+        now = time.monotonic()
+        if self._last_health_check is not None and now - self._last_health_check < self.health_check_interval:
+            return False
+        self._last_health_check = now
+        return True
+
+    def record_health_check(self, endpoint, models=None, error=None):
+        """Resultado de /api/tags num servidor: lista de modelos (dicionários de /api/tags) ou o erro."""
+        self._last_health_check = self._last_health_check or time.monotonic()
+        if error is not None:
+            if endpoint.healthy:
+                print(f"[OLLAMA POOL WARNING] Servidor {endpoint.base_url} indisponível: {error}")
+            endpoint.healthy = False
+            endpoint.last_error = str(error)
+            return
+        if not endpoint.healthy:
+            print(f"[OLLAMA POOL] Servidor {endpoint.base_url} disponível novamente.")
+        endpoint.healthy = True
+        endpoint.models = {model["name"] for model in models}
+        endpoint.missing_models.clear()
+
+    def select(self, model, exclude=()):
+        """Servidor para o próximo pedido de 'model', ignorando os já tentados ('exclude'); None se não houver."""
+        remaining = [endpoint for endpoint in self.endpoints if endpoint.base_url not in exclude]
+        for candidates in (
+            [e for e in remaining if e.healthy and e.serves(model)],
+            [e for e in remaining if e.serves(model)],
+            [e for e in remaining if e.healthy], # Nenhum servidor lista o modelo: o servidor devolve o erro
+            remaining,
+        ):
+            if candidates:
+                return min(candidates, key=lambda e: (e.outstanding, e.dispatched))
+        return None
+
+    def endpoints_serving(self, model):
+        serving = [endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint.serves(model)]
+        return serving or [endpoint for endpoint in self.endpoints if endpoint.serves(model)] or list(self.endpoints)
+
+    def acquire(self, endpoint):
+        endpoint.outstanding += 1
+        endpoint.dispatched += 1
+        return time.perf_counter()
+
+    def release(self, endpoint, start_time, error=None, model=None, model_missing=False):
+        """Fim de um pedido. Com erro, o servidor sai da escolha (ou, se só lhe falta o modelo, deixa de o listar)."""
+        endpoint.outstanding -= 1
+        endpoint.busy_seconds += time.perf_counter() - start_time
+        if error is None:
+            return
+        endpoint.failures += 1
+        endpoint.last_error = str(error)
+        if model_missing and model is not None:
+            endpoint.missing_models.add(model)
+        else:
+            endpoint.healthy = False
+
+    def stats_summary(self):
+        return "; ".join(
+            f"{endpoint.base_url}: {endpoint.dispatched} pedidos, {endpoint.failures} falhas, "
+            f"ocupado {endpoint.busy_seconds:.1f}s" + ("" if endpoint.healthy else " (indisponível)")
+            for endpoint in self.endpoints)
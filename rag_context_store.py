@@ -0,0 +1,199 @@
+# rag_context_store.py
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+
+RAG_CONTEXT_STORE_DIR_NAME = "rag_context_cache"
+RAG_CONTEXT_STORE_DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # 256 MB
+RAG_CONTEXT_STORE_DEFAULT_MAX_ENTRIES = 20000
+
+
+def _sha256_text(text):
+    return hashlib.sha256((text or "").encode("utf-8", errors="ignore")).hexdigest()
+
+
+def compute_context_key(raw_json_str, doc_name, rag_type, aux_model_name, prompt_texts=(), extra_params=None):
+    """
+    Chave do contexto RAG de um documento. Depende apenas do que influencia a recuperação
+    e o LLM auxiliar (conteúdo, nome do documento, tipo de RAG, modelo auxiliar, prompts e parâmetros),
+    nunca do LLM principal.
+    """
+    key_material = {
+        "doc_sha256": _sha256_text(raw_json_str),
+        "doc_name": doc_name,
+        "rag_type": rag_type,
+        "aux_model": aux_model_name or "",
+        "prompts_sha256": [_sha256_text(p) for p in prompt_texts],
+        "params": extra_params or {},
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RagContextStore:
+    """
+    Armazém de contextos RAG por documento (memória + disco), partilhado por todos os modelos principais
+    de uma execução. Cada contexto é construído uma única vez por chave.
+    Como em LLMResponseCache, a eviction é LRU (pela data do último acesso) quando o tamanho total ou o nº de
+    entradas excede o limite; as entradas removidas saem da memória e do disco.
+    """
+
+    def __init__(self, base_dir, persist_to_disk=True, max_bytes=RAG_CONTEXT_STORE_DEFAULT_MAX_BYTES,
+                 max_entries=RAG_CONTEXT_STORE_DEFAULT_MAX_ENTRIES):
+        self.store_dir = os.path.join(base_dir, RAG_CONTEXT_STORE_DIR_NAME)
+        self.persist_to_disk = persist_to_disk
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._index = {} # key -> [tamanho_bytes, último_acesso] (entradas em disco e/ou memória)
+        self._total_bytes = 0
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+        if self.persist_to_disk:
+            try:
+                os.makedirs(self.store_dir, exist_ok=True)
+                self._scan_disk()
+            except OSError as e:
+                print(f"[RAG CONTEXT STORE WARNING] Não foi possível criar '{self.store_dir}': {e}. Apenas memória será usada.")
+                self.persist_to_disk = False
+
+    def _entry_path(self, key):
+        return os.path.join(self.store_dir, f"{key}.json")
+
+    def _scan_disk(self):
+        for entry in os.scandir(self.store_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            self._index[entry.name[:-5]] = [stat.st_size, stat.st_mtime]
+            self._total_bytes += stat.st_size
+        with self._lock:
+            self._evict_if_needed()
+
+    def _touch(self, key):
+        """Atualiza o último acesso (chamado com o lock); em disco, persistido para o LRU entre execuções."""
+        now = time.time()
+        self._index[key][1] = now
+        if self.persist_to_disk:
+            try:
+                os.utime(self._entry_path(key), (now, now))
+            except OSError:
+                pass
+
+    def _drop(self, key):
+        """Remove a entrada da memória e do disco (chamado com o lock)."""
+        size, _ = self._index.pop(key, (0, 0))
+        self._total_bytes -= size
+        self._memory.pop(key, None)
+        if self.persist_to_disk:
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes and len(self._index) <= self.max_entries:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes and len(self._index) <= self.max_entries:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def _load_from_disk(self, key):
+        if not self.persist_to_disk:
+            return None
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("context")
+        except Exception as e:
+            print(f"[RAG CONTEXT STORE WARNING] Entrada inválida '{path}': {e}")
+            with self._lock:
+                self._drop(key)
+            return None
+
+    def _put(self, key, doc_name, rag_type, context_text):
+        """Guarda o contexto em memória e (se ativo) em disco, e aplica os limites."""
+        if not self.persist_to_disk:
+            with self._lock:
+                self._memory[key] = context_text
+                self._record_size(key, len(context_text.encode("utf-8", errors="ignore")))
+            return
+        path = self._entry_path(key)
+        tmp_path = f"{path}.tmp"
+        entry = {
+            "key": key,
+            "doc_name": doc_name,
+            "rag_type": rag_type,
+            "created": datetime.datetime.now().isoformat(),
+            "context": context_text,
+        }
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            print(f"[RAG CONTEXT STORE WARNING] Não foi possível guardar o contexto de '{doc_name}': {e}")
+            return
+        with self._lock:
+            self._memory[key] = context_text
+            self._record_size(key, size)
+
+    def _record_size(self, key, size):
+        """Chamado com o lock."""
+        if key in self._index:
+            self._total_bytes -= self._index[key][0]
+        self._index[key] = [size, time.time()]
+        self._total_bytes += size
+        self._evict_if_needed()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._touch(key)
+                return self._memory[key]
+            if key not in self._index:
+                return None
+        context_text = self._load_from_disk(key)
+        if context_text is not None:
+            with self._lock:
+                if key in self._index:
+                    self._memory[key] = context_text
+                    self._touch(key)
+        return context_text
+
+    def get_or_build(self, key, build_fn, doc_name="", rag_type=""):
+        """
+        Devolve (contexto, veio_do_armazém). build_fn só é chamado se a chave ainda não existir e devolve
+        (contexto, sucesso); contextos sem sucesso não são guardados, para que a próxima chamada tente novamente.
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:  # Evita construir o mesmo contexto em paralelo
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return cached, True
+            context_text, built_ok = build_fn()
+            with self._lock:
+                self.builds += 1
+            if built_ok and context_text:
+                self._put(key, doc_name, rag_type, context_text)
+            return context_text, False
+
+    def stats_summary(self):
+        return (f"contextos construídos: {self.builds}, reutilizados: {self.hits}, removidos (LRU): {self.evictions}, "
+                f"entradas: {len(self._index)} ({self._total_bytes / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,167 @@
+# retrieval_cache.py
+# Caches da recuperação RAG: embeddings de queries (por modelo de embedding) e os top-k nós de cada query
+# (IDs e scores, por versão do índice). As queries do RAG simples repetem-se entre modelos e execuções, e
+# muitos schemas partilham o mesmo início ('$schema', '$id', ...), pelo que a mesma query era embutida e
+# pesquisada de novo a cada documento. Os resultados ficam inválidos quando a coleção muda (reindexação).
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from index_manifest import LLAMA_INDEX_MANIFEST_FILENAME
+
+RETRIEVAL_CACHE_DEFAULT_MAX_EMBEDDINGS = 8192
+RETRIEVAL_CACHE_DEFAULT_MAX_RESULTS = 8192
+RETRIEVAL_CACHE_VERSION_CHECK_SECONDS = 10 # Periodicidade da verificação (barata) de alterações à coleção
+
+
+class _LRU:
+    """Dicionário LRU limitado (chamado com o lock de RetrievalCache)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = f"{100 * self.hits / lookups:.0f}%" if lookups else "N/A"
+        return f"{self.hits}/{lookups} ({hit_rate}), {len(self.entries)} entradas, {self.evictions} removidas"
+
+
+class RetrievalCache:
+    """
+    Embeddings de queries por (modelo de embedding, texto) e resultados por (versão do índice, texto, k).
+    bind_index associa o índice carregado e o seu modelo de embedding de queries (usado por embed_queries):
+    version_fn() devolve a versão completa (ex: hash do manifest) e
+    change_signal_fn() um sinal barato (ex: nº de itens + data do manifest), consultado no máximo a cada
+    version_check_interval segundos; quando o sinal muda, a versão é recalculada e os resultados antigos descartados.
+    """
+
+    def __init__(self, max_embeddings=RETRIEVAL_CACHE_DEFAULT_MAX_EMBEDDINGS, max_results=RETRIEVAL_CACHE_DEFAULT_MAX_RESULTS,
+                 version_check_interval=RETRIEVAL_CACHE_VERSION_CHECK_SECONDS, enabled=True):
+        self.enabled = enabled
+        self.version_check_interval = version_check_interval
+        self.embed_model_name = None
+        self.embed_model = None # Modelo de embedding de queries do índice (get_text_embedding_batch)
+        self.index_version = None
+        self.on_version_change = [] # Funções chamadas com a nova versão (ex: cache semântica das sub-perguntas)
+        self._embeddings = _LRU(max_embeddings)
+        self._results = _LRU(max_results)
+        self._retrievers = {} # (id do índice, k) -> retriever reutilizado
+        self._version_fn = None
+        self._change_signal_fn = None
+        self._change_signal = None
+        self._last_version_check = 0.0
+        self._lock = threading.Lock()
+
+    def bind_index(self, embed_model_name, version_fn, change_signal_fn=None, embed_model=None):
+        with self._lock:
+            self.embed_model_name, self.embed_model = embed_model_name, embed_model
+            self._version_fn, self._change_signal_fn = version_fn, change_signal_fn
+            self._change_signal = change_signal_fn() if change_signal_fn else None
+            self._last_version_check = time.monotonic()
+            self._set_version(version_fn())
+
+    def _set_version(self, index_version):
+        """Chamado com o lock."""
+        if index_version == self.index_version:
+            return
+        if self.index_version is not None:
+            print(f"[RETRIEVAL CACHE] Coleção alterada: {len(self._results.entries)} resultados descartados.")
+        self.index_version = index_version
+        self._results.entries.clear()
+        for callback in self.on_version_change:
+            callback(index_version)
+
+    def current_version(self):
+        """Versão do índice, verificando (no máximo a cada version_check_interval) se a coleção mudou."""
+        with self._lock:
+            now = time.monotonic()
+            if self._change_signal_fn is not None and now - self._last_version_check >= self.version_check_interval:
+                self._last_version_check = now
+                try:
+                    change_signal = self._change_signal_fn()
+                except Exception as e:
+                    print(f"[RETRIEVAL CACHE WARNING] Não foi possível verificar a coleção: {e}")
+                    change_signal = self._change_signal
+                if change_signal != self._change_signal:
+                    self._change_signal = change_signal
+                    self._set_version(self._version_fn())
+            return self.index_version
+
+    def retriever(self, index, similarity_top_k):
+        """Retriever do índice para este k, criado uma única vez."""
+        key = (id(index), similarity_top_k)
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                retriever = self._retrievers[key] = index.as_retriever(similarity_top_k=similarity_top_k)
+            return retriever
+
+    def embed_queries(self, queries, embed_fn=None):
+        """
+        Embeddings das queries (pela ordem); embed_fn(lista de textos) só recebe as que não estão em cache
+        (por omissão, get_text_embedding_batch do modelo associado em bind_index).
+        """
+        if embed_fn is None:
+            if self.embed_model is None:
+                raise RuntimeError("Nenhum modelo de embedding associado à cache de recuperação (bind_index).")
+            embed_fn = self.embed_model.get_text_embedding_batch
+        if not self.enabled:
+            return embed_fn(queries)
+        with self._lock:
+            embeddings = [self._embeddings.get((self.embed_model_name, query)) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            computed = dict(zip(missing, embed_fn(missing)))
+            with self._lock:
+                for query, embedding in computed.items():
+                    self._embeddings.put((self.embed_model_name, query), embedding)
+            embeddings = [embedding if embedding is not None else computed[query] for query, embedding in zip(queries, embeddings)]
+        return embeddings
+
+    def get_results(self, query, similarity_top_k):
+        """Lista de (id do nó, score) guardada para a query, ou None."""
+        if not self.enabled:
+            return None
+        index_version = self.current_version()
+        with self._lock:
+            return self._results.get((index_version, query, similarity_top_k))
+
+    def put_results(self, query, similarity_top_k, node_ids_and_scores):
+        if not self.enabled:
+            return
+        index_version = self.current_version()
+        with self._lock:
+            self._results.put((index_version, query, similarity_top_k), list(node_ids_and_scores))
+
+    def stats_summary(self):
+        return f"embeddings de queries: {self._embeddings.summary()}; resultados top-k: {self._results.summary()}"
+
+
+def chroma_change_signal(persist_dir, chroma_collection, manifest_filename=LLAMA_INDEX_MANIFEST_FILENAME):
+    """Sinal barato de alteração da coleção: nº de itens e data de modificação do manifest da indexação."""
+    try:
+        manifest_mtime = os.path.getmtime(os.path.join(persist_dir, manifest_filename))
+    except OSError:
+        manifest_mtime = None
+    return chroma_collection.count(), manifest_mtime
@@ -0,0 +1,111 @@
+# run_journal.py
+# Journal (append-only, JSON Lines) das unidades concluídas — (modelo, hash do documento, tipo de RAG, versão dos prompts) —
+# para retomar execuções longas (--resume) sem repetir o trabalho já feito.
+import os
+import json
+import hashlib
+import datetime
+import threading
+
+RUN_JOURNAL_FILENAME = "run_journal.jsonl"
+RUN_JOURNAL_COMPLETED_STATUSES = ("success", "warning") # Erros não são registados: voltam a ser tentados
+
+
+def compute_file_sha256(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compute_prompt_version(*prompt_parts):
+    """Versão curta dos prompts/parâmetros: muda sempre que algum texto ou parâmetro que influencia a resposta muda."""
+    material = json.dumps([part if isinstance(part, (str, int, float, bool, type(None))) else repr(part) for part in prompt_parts])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+
+def compute_unit_key(model_name, doc_sha256, rag_type, prompt_version):
+    return hashlib.sha256(f"{model_name}\n{doc_sha256}\n{rag_type}\n{prompt_version}".encode("utf-8")).hexdigest()
+
+
+class RunJournal:
+    """
+    Journal de unidades concluídas. Com resume=False as entradas são apenas escritas (para uma futura retoma);
+    com resume=True, completed_entry devolve a entrada já registada para a unidade.
+    """
+
+    def __init__(self, journal_path, resume=False):
+        self.journal_path = journal_path
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.resumed = 0
+        self.recorded = 0
+        self._checked_tail = False
+        if resume:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.journal_path):
+            print(f"[RUN JOURNAL] '{self.journal_path}' não existe: nada a retomar.")
+            return
+        invalid_lines = 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+                except (json.JSONDecodeError, KeyError):
+                    invalid_lines += 1 # Ex: última linha incompleta após uma interrupção
+        print(f"[RUN JOURNAL] {len(self._entries)} unidades concluídas carregadas de '{self.journal_path}'"
+              + (f" ({invalid_lines} linhas inválidas ignoradas)." if invalid_lines else "."))
+
+    def completed_entry(self, unit_key):
+        if not self.resume:
+            return None
+        with self._lock:
+            entry = self._entries.get(unit_key)
+            if entry is not None:
+                self.resumed += 1
+            return entry
+
+    def record(self, unit_key, model_name, doc_name, doc_sha256, rag_type, prompt_version, document_result):
+        """Acrescenta a unidade ao journal (apenas estados concluídos); escrita com flush + fsync."""
+        if document_result["status"] not in RUN_JOURNAL_COMPLETED_STATUSES:
+            return
+        entry = {
+            "key": unit_key, "model": model_name, "doc_name": doc_name, "doc_sha256": doc_sha256,
+            "rag_type": rag_type, "prompt_version": prompt_version, "status": document_result["status"],
+            "llm_duration": document_result["llm_duration"], "llm_metrics": document_result.get("llm_metrics"),
+            "completed_at": datetime.datetime.now().isoformat(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                if not self._checked_tail:
+                    line = self._tail_separator() + line
+                    self._checked_tail = True
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"[RUN JOURNAL WARNING] Não foi possível registar '{doc_name}': {e}")
+                return
+            self._entries[unit_key] = entry
+            self.recorded += 1
+
+    def _tail_separator(self):
+        """'\n' se a última linha ficou incompleta (interrupção a meio da escrita), para não corromper a próxima entrada."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                return "" if f.read(1) == b"\n" else "\n"
+        except OSError: # Ficheiro inexistente ou vazio
+            return ""
+
+    def stats_summary(self):
+        return f"unidades retomadas do journal: {self.resumed}, novas unidades registadas: {self.recorded}"
@@ -0,0 +1,223 @@
+# schema_ref_resolver.py
+# Resolução offline de '$ref' (ex: Smart Data Models: GSMA-Commons, Location-Commons) a partir de um espelho local
+# dos schemas referenciados. Cada definição partilhada é lida, resolvida e condensada uma vez por execução e por nível
+# de aninhamento (cache endereçada pelo conteúdo do ficheiro + ponteiro + nível), independentemente de quantos schemas a referenciam.
+import os
+import json
+import hashlib
+import argparse
+import threading
+import urllib.parse
+
+from json_condenser import condense_json_object
+
+SCHEMA_MIRROR_DIR_NAME = "schema_mirror"
+SCHEMA_REF_MAX_DEPTH = 3 # Níveis de '$ref' aninhados resolvidos dentro de uma definição
+SCHEMA_REF_DEFINITION_BUDGET_CHARS = 6000 # Orçamento da forma condensada de cada definição referenciada
+
+
+def mirror_path_for_url(mirror_dir, url):
+    """Caminho local de um URL no espelho: <mirror>/<host>/<caminho> (ex: smart-data-models.github.io/data-models/common-schema.json)."""
+    parsed = urllib.parse.urlsplit(url)
+    relative_path = parsed.path.lstrip("/") or "index.json"
+    return os.path.join(mirror_dir, parsed.netloc, *relative_path.split("/"))
+
+
+def resolve_json_pointer(document, fragment):
+    """Segue um ponteiro JSON ('/definitions/GSMA-Commons'); devolve None se não existir."""
+    node = document
+    for token in [t for t in fragment.split("/") if t]:
+        token = urllib.parse.unquote(token).replace("~1", "/").replace("~0", "~")
+        if isinstance(node, dict) and token in node:
+            node = node[token]
+        elif isinstance(node, list) and token.isdigit() and int(token) < len(node):
+            node = node[int(token)]
+        else:
+            return None
+    return node
+
+
+class SchemaRefResolver:
+    """
+    Substitui cada {'$ref': ...} por {'$ref': ..., <definição condensada>} usando os ficheiros do espelho local.
+    Referências que não estão no espelho ficam inalteradas. Seguro para uso por várias threads: as definições
+    são expandidas fora do lock (duas threads podem expandir a mesma em simultâneo; fica a primeira publicada).
+    """
+
+    def __init__(self, mirror_dir, definition_budget_chars=SCHEMA_REF_DEFINITION_BUDGET_CHARS, max_depth=SCHEMA_REF_MAX_DEPTH):
+        self.mirror_dir = mirror_dir
+        self.definition_budget_chars = definition_budget_chars
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._documents = {} # url sem fragmento -> (sha256 do ficheiro, documento) ou None se ausente
+        self._definitions = {} # (sha256, base, ponteiro, nível) -> definição condensada (dict)
+        self.resolved = 0
+        self.reused = 0
+        self.missing_refs = set()
+        self._version = None
+
+    def _load_document(self, document_url):
+        with self._lock:
+            if document_url in self._documents:
+                return self._documents[document_url]
+        path = mirror_path_for_url(self.mirror_dir, document_url)
+        entry = None
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    raw_bytes = f.read()
+                entry = (hashlib.sha256(raw_bytes).hexdigest(), json.loads(raw_bytes))
+            except Exception as e:
+                print(f"[SCHEMA REF WARNING] Schema inválido no espelho '{path}': {e}")
+        with self._lock:
+            self._documents[document_url] = entry
+        return entry
+
+    def _resolve_ref(self, ref, base_url, depth, current_document):
+        """Definição condensada para 'ref' (relativo a base_url) ou None se não estiver disponível."""
+        absolute_ref = urllib.parse.urljoin(base_url or "", ref)
+        document_url, _, fragment = absolute_ref.partition("#")
+        if document_url and document_url != (base_url or "").partition("#")[0]:
+            loaded = self._load_document(document_url)
+        else:
+            loaded = current_document # Referência interna ('#/definitions/...')
+        if loaded is None:
+            with self._lock:
+                self.missing_refs.add(absolute_ref)
+            return None
+        document_sha, document = loaded
+        definition_base_url = document.get("$id") or document_url or base_url
+        # A expansão depende do nível (as referências aninhadas só são seguidas até max_depth)
+        cache_key = (document_sha, definition_base_url, fragment, depth)
+        with self._lock:
+            if cache_key in self._definitions:
+                self.reused += 1
+                return self._definitions[cache_key]
+        target = resolve_json_pointer(document, fragment)
+        if target is None:
+            with self._lock:
+                self.missing_refs.add(absolute_ref)
+            return None
+        # Sem lock durante a expansão recursiva (ciclos de $ref entre threads não bloqueiam; o nível limita a recursão)
+        expanded = self._expand(target, definition_base_url, depth + 1, loaded)
+        condensed_text, _ = condense_json_object(expanded, self.definition_budget_chars)
+        condensed = json.loads(condensed_text)
+        with self._lock:
+            published = self._definitions.setdefault(cache_key, condensed)
+            if published is condensed:
+                self.resolved += 1
+            else:
+                self.reused += 1
+        return published
+
+    def _expand(self, node, base_url, depth, current_document):
+        if isinstance(node, list):
+            return [self._expand(item, base_url, depth, current_document) for item in node]
+        if not isinstance(node, dict):
+            return node
+        expanded = {key: self._expand(value, base_url, depth, current_document) for key, value in node.items() if key != "$ref"}
+        ref = node.get("$ref")
+        if isinstance(ref, str):
+            expanded = {"$ref": ref, **expanded}
+            if depth < self.max_depth:
+                definition = self._resolve_ref(ref, base_url, depth, current_document)
+                if isinstance(definition, dict):
+                    # Os campos próprios do nó prevalecem sobre os da definição referenciada
+                    expanded = {"$ref": ref, **{k: v for k, v in definition.items() if k not in ("$id", "_refs")}, **expanded}
+        return expanded
+
+    def resolve(self, schema_obj):
+        """Devolve uma cópia do schema com as referências resolvidas (o original não é alterado)."""
+        if not isinstance(schema_obj, dict):
+            return schema_obj
+        base_url = schema_obj.get("$id") or ""
+        own_document = (hashlib.sha256(json.dumps(schema_obj, sort_keys=True).encode("utf-8")).hexdigest(), schema_obj)
+        return self._expand(schema_obj, base_url, 0, own_document)
+
+    def version(self):
+        """
+        Versão do espelho (caminhos e conteúdo dos ficheiros) e dos parâmetros de resolução: muda o JSON injetado nos prompts.
+        Calculada uma vez (os documentos do espelho também só são lidos uma vez por execução).
+        """
+        with self._lock:
+            if self._version is None:
+                self._version = self._compute_version()
+            return self._version
+
+    def _compute_version(self):
+        sha = hashlib.sha256(f"{self.max_depth}\n{self.definition_budget_chars}\n".encode("utf-8"))
+        for root, dirs, files in os.walk(self.mirror_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                sha.update(os.path.relpath(path, self.mirror_dir).replace(os.sep, "/").encode("utf-8") + b"\n")
+                with open(path, "rb") as f:
+                    sha.update(hashlib.sha256(f.read()).digest())
+        return sha.hexdigest()[:16]
+
+    def stats_summary(self):
+        return (f"definições referenciadas condensadas: {self.resolved}, reutilizadas: {self.reused}, "
+                f"não encontradas no espelho: {len(self.missing_refs)}")
+
+
+def mirror_referenced_schemas(schema_paths, mirror_dir, max_depth=SCHEMA_REF_MAX_DEPTH, timeout=30):
+    """
+    Descarrega para o espelho local os documentos referenciados (recursivamente, até max_depth).
+    Só é preciso uma vez (com rede); a análise usa depois apenas o espelho.
+    """
+    import httpx # Apenas para preencher o espelho
+
+    def refs_in(node, base_url):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "$ref" and isinstance(value, str):
+                    absolute = urllib.parse.urljoin(base_url or "", value).partition("#")[0]
+                    if absolute.startswith(("http://", "https://")):
+                        yield absolute
+                else:
+                    yield from refs_in(value, base_url)
+        elif isinstance(node, list):
+            for item in node:
+                yield from refs_in(item, base_url)
+
+    pending = []
+    for path in schema_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        pending.extend((url, 1) for url in refs_in(schema, schema.get("$id")))
+    seen = set()
+    with httpx.Client(timeout=timeout, follow_redirects=True) as http_client:
+        while pending:
+            url, depth = pending.pop()
+            if url in seen or depth > max_depth:
+                continue
+            seen.add(url)
+            local_path = mirror_path_for_url(mirror_dir, url)
+            if not os.path.isfile(local_path):
+                try:
+                    response = http_client.get(url)
+                    response.raise_for_status()
+                    document = response.json()
+                except Exception as e:
+                    print(f"[SCHEMA MIRROR WARNING] Não foi possível obter '{url}': {e}")
+                    continue
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                with open(local_path, "w", encoding="utf-8") as f:
+                    json.dump(document, f, ensure_ascii=False, indent=2)
+                print(f"[SCHEMA MIRROR] {url} -> {local_path}")
+            else:
+                with open(local_path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+            pending.extend((ref_url, depth + 1) for ref_url in refs_in(document, document.get("$id") or url))
+    return seen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preenche o espelho local dos schemas referenciados por '$ref'.")
+    parser.add_argument("schema_dir", nargs="?", default="test_schemas", help="Diretório com os schemas a analisar.")
+    parser.add_argument("--mirror-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), SCHEMA_MIRROR_DIR_NAME))
+    parser.add_argument("--max-depth", type=int, default=SCHEMA_REF_MAX_DEPTH)
+    cli_args = parser.parse_args()
+    schema_files = [os.path.join(cli_args.schema_dir, name) for name in sorted(os.listdir(cli_args.schema_dir)) if name.lower().endswith(".json")]
+    mirrored = mirror_referenced_schemas(schema_files, cli_args.mirror_dir, max_depth=cli_args.max_depth)
+    print(f"[SCHEMA MIRROR] {len(mirrored)} documentos referenciados em '{cli_args.mirror_dir}'.")
@@ -0,0 +1,195 @@
+# semantic_answer_cache.py
+# Cache semântica das respostas às sub-perguntas do RAG multi-step: sub-perguntas quase iguais geradas para
+# documentos diferentes (ex: "What are the GDPR rules on location data?") reutilizam a resposta já gerada pelo
+# LLM auxiliar, se o cosseno entre os embeddings da pergunta nova e de uma pergunta guardada passar o limiar.
+# Cada entrada fica associada à versão do índice (index_manifest.compute_index_version): depois de uma
+# reindexação as respostas antigas deixam de ser usadas.
+import os
+import json
+import math
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+SEMANTIC_ANSWER_CACHE_FILENAME = "semantic_answer_cache.json"
+SEMANTIC_ANSWER_CACHE_DEFAULT_THRESHOLD = 0.92 # Cosseno mínimo (embeddings normalizados) para reutilizar uma resposta
+SEMANTIC_ANSWER_CACHE_DEFAULT_MAX_ENTRIES = 4096
+
+
+def compute_answer_namespace(aux_model_name, answer_prompt_text, extra_params=None):
+    """Respostas só são partilhadas entre perguntas respondidas com o mesmo LLM auxiliar, prompt e parâmetros de recuperação."""
+    key_material = {"aux_model": aux_model_name or "", "prompt_sha256": hashlib.sha256((answer_prompt_text or "").encode("utf-8")).hexdigest(),
+                    "params": extra_params or {}}
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _normalized(vector):
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm > 0 else None
+
+
+class SemanticAnswerCache:
+    """
+    Respostas por (namespace, embedding da pergunta), com LRU limitado a max_entries. lookup devolve a resposta
+    da pergunta guardada mais parecida se o cosseno for >= threshold. As entradas de outra versão do índice são
+    descartadas em set_index_version (e ao carregar do disco). Thread-safe (workers do pipeline e das sub-perguntas).
+    """
+
+    def __init__(self, path=None, threshold=SEMANTIC_ANSWER_CACHE_DEFAULT_THRESHOLD,
+                 max_entries=SEMANTIC_ANSWER_CACHE_DEFAULT_MAX_ENTRIES, enabled=True):
+        self.path = path # None = apenas memória
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.similarity_sum = 0.0 # Soma dos cossenos dos hits (média no sumário)
+        self._entries = OrderedDict() # id -> {"namespace", "index_version", "question", "answer", "vector"} (ordem LRU)
+        self._next_id = 0
+        self._matrix = None # numpy: uma linha (embedding normalizado) por posição; None sem numpy ou até ao 1º lookup
+        self._slot_ids = [] # posição -> id da entrada (None = posição livre)
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def set_index_version(self, index_version):
+        """Versão do índice carregado. As entradas de outra versão (respostas com contexto antigo) são descartadas."""
+        with self._lock:
+            if self.index_version == index_version:
+                return
+            if self.index_version is None and self.path:
+                self._load_from_disk(index_version)
+            stale_ids = [entry_id for entry_id, entry in self._entries.items() if entry["index_version"] != index_version]
+            for entry_id in stale_ids:
+                self._remove(entry_id)
+            if stale_ids:
+                print(f"[SEMANTIC CACHE] Índice alterado: {len(stale_ids)} respostas antigas descartadas.")
+                self._dirty = True
+            self.index_version = index_version
+
+    def lookup(self, namespace, query_vector):
+        """Devolve (resposta, pergunta guardada, cosseno) da entrada mais parecida acima do limiar, ou None."""
+        if not self.enabled or self.index_version is None:
+            return None
+        normalized = _normalized(query_vector)
+        with self._lock:
+            best = self._best_match(namespace, normalized) if normalized else None
+            if best is None or best[1] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id, similarity = best
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.similarity_sum += similarity
+            entry = self._entries[entry_id]
+            return entry["answer"], entry["question"], similarity
+
+    def store(self, namespace, question, query_vector, answer):
+        if not self.enabled or self.index_version is None:
+            return
+        normalized = _normalized(query_vector)
+        if not normalized:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._add({"namespace": namespace, "index_version": self.index_version, "question": question, "answer": answer, "vector": normalized})
+            self.stores += 1
+            self._dirty = True
+
+    def _add(self, entry):
+        """Nova entrada (chamado com o lock). Com a matriz já criada, o embedding ocupa uma posição livre."""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        if self._matrix is not None:
+            slot = self._slot_ids.index(None) if None in self._slot_ids else len(self._slot_ids)
+            if slot == len(self._slot_ids):
+                self._slot_ids.append(None)
+            if slot >= len(self._matrix) or len(entry["vector"]) != self._matrix.shape[1]:
+                self._matrix = None # Matriz cheia ou outra dimensão (outro modelo de embedding): reconstruída no próximo lookup
+            else:
+                self._matrix[slot] = entry["vector"]
+                self._slot_ids[slot] = entry_id
+                entry["slot"] = slot
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        if self._matrix is not None and "slot" in entry:
+            self._slot_ids[entry["slot"]] = None
+
+    def _best_match(self, namespace, normalized):
+        """(id, cosseno) da entrada do namespace mais parecida, ou None. Chamado com o lock."""
+        if not any(entry["namespace"] == namespace for entry in self._entries.values()):
+            return None
+        try:
+            import numpy as np # Dependência do LlamaIndex/ChromaDB (sempre presente com RAG)
+        except ImportError:
+            candidate_ids = [entry_id for entry_id, entry in self._entries.items() if entry["namespace"] == namespace]
+            similarities = [sum(a * b for a, b in zip(self._entries[entry_id]["vector"], normalized)) for entry_id in candidate_ids]
+            best_position = max(range(len(candidate_ids)), key=similarities.__getitem__)
+            return candidate_ids[best_position], similarities[best_position]
+        if self._matrix is None or self._matrix.shape[1] != len(normalized):
+            self._build_matrix(np, len(normalized))
+        used = len(self._slot_ids)
+        similarities = self._matrix[:used] @ np.asarray(normalized, dtype=np.float32)
+        for slot, entry_id in enumerate(self._slot_ids):
+            if entry_id is None or self._entries[entry_id]["namespace"] != namespace:
+                similarities[slot] = -np.inf
+        best_slot = int(np.argmax(similarities))
+        if self._slot_ids[best_slot] is None or not np.isfinite(similarities[best_slot]):
+            return None
+        return self._slot_ids[best_slot], float(similarities[best_slot])
+
+    def _build_matrix(self, np, dimension):
+        """Matriz com max_entries linhas: as entradas seguintes ocupam posições livres sem reconstruir a matriz."""
+        self._matrix = np.zeros((self.max_entries, dimension), dtype=np.float32)
+        self._slot_ids = []
+        for entry_id, entry in self._entries.items():
+            entry.pop("slot", None)
+            if len(entry["vector"]) == dimension:
+                entry["slot"] = len(self._slot_ids)
+                self._matrix[entry["slot"]] = entry["vector"]
+                self._slot_ids.append(entry_id)
+
+    def _load_from_disk(self, index_version):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception as e:
+            print(f"[SEMANTIC CACHE WARNING] Ficheiro inválido '{self.path}': {e}")
+            return
+        if saved.get("index_version") != index_version:
+            print("[SEMANTIC CACHE] Respostas guardadas são de outra versão do índice: ignoradas.")
+            return
+        for entry in saved.get("entries", [])[-self.max_entries:]:
+            self._add({**entry, "index_version": index_version})
+
+    def save(self):
+        """Guarda as entradas (ordem LRU) em disco, se houver alterações."""
+        if not self.path or not self._dirty or self.index_version is None:
+            return
+        with self._lock:
+            saved = {"index_version": self.index_version, "saved": datetime.datetime.now().isoformat(),
+                     "entries": [{key: entry[key] for key in ("namespace", "question", "answer", "vector")} for entry in self._entries.values()]}
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(saved, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[SEMANTIC CACHE WARNING] Não foi possível guardar '{self.path}': {e}")
+
+    def stats_summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = f"{100 * self.hits / lookups:.0f}%" if lookups else "N/A"
+        mean_similarity = f", cosseno médio dos hits {self.similarity_sum / self.hits:.3f}" if self.hits else ""
+        return (f"respostas reutilizadas: {self.hits}/{lookups} ({hit_rate}{mean_similarity}), guardadas: {self.stores}, "
+                f"removidas (LRU): {self.evictions}, entradas: {len(self._entries)}, limiar {self.threshold}")
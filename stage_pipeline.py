@@ -0,0 +1,114 @@
+# stage_pipeline.py
+# Execução em pipeline de duas etapas com filas limitadas: enquanto a etapa final (ex: LLM principal) processa o item i,
+# a etapa de preparação (ex: contexto RAG com o LLM auxiliar) já trabalha nos itens seguintes. A fila entre as etapas
+# limita quantos itens preparados podem ficar à espera (backpressure); a utilização de cada etapa vai para o sumário.
+import time
+import queue
+import threading
+import traceback
+
+PIPELINE_DEFAULT_QUEUE_DEPTH = 2 # Itens preparados à espera da etapa final (além dos que estão a ser processados)
+_END_OF_STREAM = object()
+
+
+class StageStats:
+    """Tempo ocupado de uma etapa (soma das threads) e o tempo bloqueado à espera da outra etapa."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0 # Preparação: fila cheia (backpressure); etapa final: fila vazia (à espera de itens)
+        self._lock = threading.Lock()
+
+    def add(self, busy_seconds=0.0, blocked_seconds=0.0, items=0):
+        with self._lock:
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+            self.items += items
+
+    def utilisation(self, wall_seconds):
+        return self.busy_seconds / (wall_seconds * self.workers) if wall_seconds > 0 else None
+
+
+def run_two_stage_pipeline(items, prepare_fn, finish_fn, prepare_workers=1, finish_workers=1,
+                           queue_depth=PIPELINE_DEFAULT_QUEUE_DEPTH, stage_names=("prepare", "finish"), error_result_fn=None):
+    """
+    prepare_fn(item) -> preparado; finish_fn(preparado) -> resultado. Devolve (resultados pela ordem de items, estatísticas).
+    Um item cuja etapa lança uma exceção fica com o resultado error_result_fn(item, nome da etapa, exceção), ou None
+    sem error_result_fn (a exceção é mostrada e o pipeline continua).
+    """
+    items = list(items)
+    results = [None] * len(items)
+    prepared_queue = queue.Queue(maxsize=max(1, queue_depth))
+    prepare_stats = StageStats(stage_names[0], prepare_workers)
+    finish_stats = StageStats(stage_names[1], finish_workers)
+    next_item = iter(range(len(items)))
+    next_item_lock = threading.Lock()
+
+    def stage_failed(idx, stage_name, exc):
+        print(f"[PIPELINE ERROR] Etapa '{stage_name}' falhou para '{items[idx]}': {exc}")
+        traceback.print_exc()
+        if error_result_fn is not None:
+            try:
+                results[idx] = error_result_fn(items[idx], stage_name, exc)
+            except Exception as e_result:
+                print(f"[PIPELINE ERROR] Não foi possível registar a falha de '{items[idx]}': {e_result}")
+
+    def prepare_worker():
+        while True:
+            with next_item_lock:
+                idx = next(next_item, None)
+            if idx is None:
+                return
+            start = time.perf_counter()
+            try:
+                entry = (idx, prepare_fn(items[idx]))
+            except Exception as e:
+                stage_failed(idx, prepare_stats.name, e)
+                entry = None # Não passa à etapa final
+            prepared_at = time.perf_counter()
+            if entry is not None:
+                prepared_queue.put(entry) # Bloqueia com a fila cheia
+            prepare_stats.add(busy_seconds=prepared_at - start, blocked_seconds=time.perf_counter() - prepared_at, items=1)
+
+    def finish_worker():
+        while True:
+            wait_start = time.perf_counter()
+            entry = prepared_queue.get()
+            start = time.perf_counter()
+            if entry is _END_OF_STREAM:
+                return
+            idx, prepared = entry
+            try:
+                results[idx] = finish_fn(prepared)
+            except Exception as e:
+                stage_failed(idx, finish_stats.name, e)
+            finish_stats.add(busy_seconds=time.perf_counter() - start, blocked_seconds=start - wait_start, items=1)
+
+    wall_start = time.perf_counter()
+    prepare_threads = [threading.Thread(target=prepare_worker, name=f"pipeline_{stage_names[0]}_{i}", daemon=True) for i in range(prepare_workers)]
+    finish_threads = [threading.Thread(target=finish_worker, name=f"pipeline_{stage_names[1]}_{i}", daemon=True) for i in range(finish_workers)]
+    for thread in prepare_threads + finish_threads:
+        thread.start()
+    for thread in prepare_threads:
+        thread.join()
+    for _ in finish_threads:
+        prepared_queue.put(_END_OF_STREAM)
+    for thread in finish_threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - wall_start
+    return results, {"wall_seconds": wall_seconds, "queue_depth": prepared_queue.maxsize, "stages": [prepare_stats, finish_stats]}
+
+
+def format_pipeline_stats(stats):
+    if not stats:
+        return "Pipeline: N/A"
+    wall_seconds = stats["wall_seconds"]
+    fmt_pct = lambda value: f"{100 * value:.0f}%" if value is not None else "N/A"
+    stage_texts = [
+        f"{stage.name} {fmt_pct(stage.utilisation(wall_seconds))} ocupado ({stage.workers} threads, {stage.items} itens, "
+        f"{stage.busy_seconds:.1f}s, {'bloqueado com a fila cheia' if idx == 0 else 'à espera de itens'} {stage.blocked_seconds:.1f}s)"
+        for idx, stage in enumerate(stats["stages"])]
+    return f"Pipeline (fila {stats['queue_depth']}, {wall_seconds:.1f}s): " + "; ".join(stage_texts)
@@ -0,0 +1,121 @@
+# structured_assessment.py
+# Modo de avaliação estruturado: a resposta do LLM principal é um objeto JSON com o schema ASSESSMENT_JSON_SCHEMA
+# (parâmetro 'format' do Ollama). O stream é interrompido assim que o objeto completo e válido chega, sem esperar
+# pelo 'done' (com 'format', alguns modelos continuam a gerar espaços/linhas vazias depois do objeto).
+import json
+
+ASSESSMENT_MODES = ("text", "structured")
+ASSESSMENT_LIKELIHOODS = ("High", "Medium", "Low")
+ASSESSMENT_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "document_name": {"type": "string"},
+        "personal_data_presence": {"type": "string", "enum": ["significant", "some", "none"]},
+        "likelihood": {"type": "string", "enum": list(ASSESSMENT_LIKELIHOODS)},
+        "personal_data_fields": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "json_path": {"type": "string"},
+                    "category": {"type": "string", "enum": ["general", "special_category"]},
+                    "reason": {"type": "string"},
+                },
+                "required": ["json_path", "category", "reason"],
+            },
+        },
+        "combined_sensitivity": {"type": "string"},
+        "project_context_influence": {"type": "string"},
+        "reasoning": {"type": "string"},
+        "overall_assessment": {"type": "string"},
+    },
+    "required": ["document_name", "personal_data_presence", "likelihood", "personal_data_fields",
+                 "combined_sensitivity", "project_context_influence", "reasoning", "overall_assessment"],
+}
+# Acrescentado ao template do utilizador no modo estruturado (substitui a instrução de resposta em texto simples)
+STRUCTURED_OUTPUT_INSTRUCTION = (
+    "\n\nOutput Format Override:\n"
+    "Ignore the plain-text instruction above. Respond with a single JSON object (and nothing else) that follows this JSON Schema; "
+    "put your paragraphs of reasoning inside the string fields:\n" + json.dumps(ASSESSMENT_JSON_SCHEMA) + "\n"
+)
+
+
+def validate_assessment(obj, schema=ASSESSMENT_JSON_SCHEMA):
+    """Validação mínima (chaves obrigatórias, tipos e enums) do subconjunto de JSON Schema usado acima. Devolve a lista de problemas."""
+    problems = []
+    expected_type = schema.get("type")
+    python_types = {"object": dict, "array": list, "string": str, "number": (int, float), "integer": int, "boolean": bool}
+    if expected_type in python_types and not isinstance(obj, python_types[expected_type]):
+        return [f"esperado {expected_type}, recebido {type(obj).__name__}"]
+    if "enum" in schema and obj not in schema["enum"]:
+        problems.append(f"valor {obj!r} fora de {schema['enum']}")
+    if expected_type == "object":
+        problems.extend(f"chave obrigatória em falta: {key}" for key in schema.get("required", ()) if key not in obj)
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in obj:
+                problems.extend(f"{key}: {problem}" for problem in validate_assessment(obj[key], sub_schema))
+    elif expected_type == "array" and "items" in schema:
+        for idx, item in enumerate(obj):
+            problems.extend(f"[{idx}]: {problem}" for problem in validate_assessment(item, schema["items"]))
+    return problems
+
+
+class JsonObjectStreamDetector:
+    """
+    Recebe os pedaços do stream (feed) e indica quando o primeiro objeto JSON de topo ficou completo e válido.
+    Acompanha a profundidade de chavetas fora de strings, pelo que cada pedaço é percorrido uma única vez.
+    """
+
+    def __init__(self, validator=validate_assessment):
+        self.validator = validator
+        self.text = ""
+        self.object_text = None
+        self.value = None
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, piece):
+        """Devolve True quando um objeto completo e válido já chegou (self.value / self.object_text)."""
+        offset = len(self.text)
+        self.text += piece
+        for position in range(offset, len(self.text)):
+            char = self.text[position]
+            if self._start is None:
+                if char == "{":
+                    self._start, self._depth = position, 1
+                continue
+            if self._in_string:
+                if self._escaped: self._escaped = False
+                elif char == "\\": self._escaped = True
+                elif char == '"': self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._accept(self.text[self._start: position + 1]):
+                    return True
+                if self._depth == 0:
+                    self._start = None # Objeto inválido: procurar o próximo
+        return False
+
+    def _accept(self, candidate):
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            return False
+        if self.validator is not None and self.validator(value):
+            return False
+        self.object_text, self.value = candidate, value
+        return True
+
+
+def parse_assessment(text):
+    """Objeto de avaliação a partir do texto completo da resposta (ex: vinda da cache). Devolve (objeto ou None, problemas)."""
+    detector = JsonObjectStreamDetector(validator=None)
+    if not detector.feed(text or ""):
+        return None, ["nenhum objeto JSON completo na resposta"]
+    return detector.value, validate_assessment(detector.value)
@@ -0,0 +1,184 @@
+# token_budget.py
+# Contabilidade de tokens dos prompts: janela de contexto efetiva por modelo (lida de /api/show), remoção de secções
+# duplicadas entre o prompt de sistema e o do utilizador, e corte por prioridade das secções grandes
+# (contexto do projeto, contexto RAG, JSON) para que o prompt caiba na janela do modelo.
+import re
+import math
+import json
+import threading
+
+from json_condenser import condense_json_object
+
+OLLAMA_DEFAULT_NUM_CTX = 4096 # Janela usada pelo Ollama quando o modelo não define num_ctx
+TOKEN_BUDGET_DEFAULT_CHARS_PER_TOKEN = 3.5 # Estimativa conservadora (JSON e texto técnico em inglês)
+TOKEN_BUDGET_CHARS_PER_TOKEN_RANGE = (2.5, 5.0) # Limites para a calibração a partir de prompt_eval_count
+TOKEN_BUDGET_CALIBRATION_WEIGHT = 0.3 # Peso de cada nova medição na média móvel
+TOKEN_BUDGET_RESERVED_OUTPUT_TOKENS = 1024 # Espaço deixado para a resposta
+TOKEN_BUDGET_MIN_SECTION_TOKENS = 64 # Nenhuma secção é cortada abaixo disto (exceto se não couber de todo)
+# Ordem de corte: a primeira secção é a menos prioritária (o JSON é o objeto da análise e é cortado por último)
+TOKEN_BUDGET_TRIM_ORDER = ("project_context_summary", "additional_rag_context", "raw_json_content")
+TOKEN_BUDGET_JSON_SECTIONS = ("raw_json_content",)
+DUPLICATE_SECTION_NOTE = "(provided in the user message)"
+TRIMMED_TEXT_NOTE = "\n[... trimmed to fit the model context window ...]"
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+def estimate_tokens(text, chars_per_token=TOKEN_BUDGET_DEFAULT_CHARS_PER_TOKEN):
+    return math.ceil(len(text or "") / chars_per_token)
+
+
+def read_context_window(show_info, default_num_ctx=OLLAMA_DEFAULT_NUM_CTX):
+    """
+    Janela efetiva a partir da resposta de /api/show: num_ctx (parâmetros do Modelfile) ou o default do Ollama,
+    limitado pelo contexto máximo da arquitetura ('<arch>.context_length'). Devolve (janela, máximo_arquitetura).
+    """
+    model_info = show_info.get("model_info") or {}
+    architecture_max = next((value for key, value in model_info.items() if key.endswith(".context_length")), None)
+    num_ctx = None
+    for line in (show_info.get("parameters") or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "num_ctx" and parts[1].isdigit():
+            num_ctx = int(parts[1])
+    window = num_ctx or default_num_ctx
+    if architecture_max:
+        window = min(window, architecture_max)
+    return window, architecture_max
+
+
+def trim_text_to_tokens(text, max_tokens, chars_per_token):
+    """Corta texto numa fronteira de linha, com uma nota no fim."""
+    max_chars = int(max_tokens * chars_per_token) - len(TRIMMED_TEXT_NOTE)
+    if len(text) <= int(max_tokens * chars_per_token):
+        return text
+    if max_chars <= 0:
+        return TRIMMED_TEXT_NOTE.strip()
+    cut = text.rfind("\n", 0, max_chars)
+    return text[: cut if cut > max_chars // 2 else max_chars].rstrip() + TRIMMED_TEXT_NOTE
+
+
+def trim_json_to_tokens(text, max_tokens, chars_per_token):
+    """Recondensa o JSON para o orçamento (resultado sempre JSON válido); texto não-JSON é cortado como texto."""
+    if len(text) <= int(max_tokens * chars_per_token):
+        return text
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError:
+        return trim_text_to_tokens(text, max_tokens, chars_per_token)
+    condensed_text, _ = condense_json_object(obj, max(int(max_tokens * chars_per_token), 2))
+    return condensed_text
+
+
+def deduplicate_sections(system_template, user_template, section_names):
+    """Secções presentes nos dois templates ficam só no do utilizador. Devolve (template_sistema, secções_removidas)."""
+    removed = []
+    for name in section_names:
+        placeholder = "{" + name + "}"
+        if placeholder in system_template and placeholder in user_template:
+            system_template = system_template.replace(placeholder, DUPLICATE_SECTION_NOTE)
+            removed.append(name)
+    return system_template, removed
+
+
+class TokenBudgetManager:
+    """
+    Ajusta os prompts à janela de contexto de cada modelo. A janela é lida uma vez por modelo (/api/show);
+    num_ctx_override (se definido) é também enviado ao Ollama como opção num_ctx.
+    A relação caracteres/token é calibrada por modelo com os prompt_eval_count devolvidos pelo servidor.
+    """
+
+    def __init__(self, client_getter, num_ctx_override=None, reserved_output_tokens=TOKEN_BUDGET_RESERVED_OUTPUT_TOKENS):
+        self.client_getter = client_getter
+        self.num_ctx_override = num_ctx_override
+        self.reserved_output_tokens = reserved_output_tokens
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._chars_per_token = {}
+
+    def context_window(self, model):
+        with self._lock:
+            if model in self._windows:
+                return self._windows[model]
+        default_window = self.num_ctx_override or OLLAMA_DEFAULT_NUM_CTX
+        try:
+            window, architecture_max = read_context_window(self.client_getter().show_model(model), default_window)
+            if self.num_ctx_override:
+                window = min(self.num_ctx_override, architecture_max) if architecture_max else self.num_ctx_override
+        except Exception as e:
+            print(f"[TOKEN BUDGET WARNING] Não foi possível ler a janela de contexto de '{model}': {e}. A usar {default_window}.")
+            window = default_window
+        with self._lock:
+            self._windows[model] = window
+        return window
+
+    def chars_per_token(self, model):
+        with self._lock:
+            return self._chars_per_token.get(model, TOKEN_BUDGET_DEFAULT_CHARS_PER_TOKEN)
+
+    def generation_options(self):
+        """Opções a enviar ao Ollama para que a janela usada corresponda à do orçamento."""
+        return {"num_ctx": self.num_ctx_override} if self.num_ctx_override else None
+
+    def record_prompt_eval(self, model, prompt_chars, llm_metrics):
+        """Calibra caracteres/token com a contagem real (ignora respostas da cache e prompts cortados pelo servidor)."""
+        if not llm_metrics or llm_metrics.get("from_cache") or not llm_metrics.get("prompt_eval_count"):
+            return
+        if llm_metrics["prompt_eval_count"] >= self.context_window(model):
+            return
+        low, high = TOKEN_BUDGET_CHARS_PER_TOKEN_RANGE
+        measured = min(high, max(low, prompt_chars / llm_metrics["prompt_eval_count"]))
+        with self._lock:
+            current = self._chars_per_token.get(model, TOKEN_BUDGET_DEFAULT_CHARS_PER_TOKEN)
+            self._chars_per_token[model] = current + TOKEN_BUDGET_CALIBRATION_WEIGHT * (measured - current)
+
+    def fit_prompt(self, model, system_template, user_template, sections):
+        """
+        sections: {nome_placeholder: texto}. Devolve (template_sistema, template_utilizador, secções_ajustadas, relatório).
+        Secções duplicadas são removidas do prompt de sistema; se o total exceder a janela (menos a reserva para a resposta),
+        as secções são cortadas pela ordem de TOKEN_BUDGET_TRIM_ORDER.
+        """
+        chars_per_token = self.chars_per_token(model)
+        window = self.context_window(model)
+        system_template, deduplicated = deduplicate_sections(system_template, user_template, sections)
+        occurrences = {name: system_template.count("{" + name + "}") + user_template.count("{" + name + "}") for name in sections}
+        fixed_tokens = estimate_tokens(PLACEHOLDER_PATTERN.sub("", system_template) + PLACEHOLDER_PATTERN.sub("", user_template), chars_per_token)
+        budget = window - self.reserved_output_tokens - fixed_tokens
+        original_tokens = {name: estimate_tokens(text, chars_per_token) * occurrences[name] for name, text in sections.items()}
+        fitted = dict(sections)
+        fitted_tokens = dict(original_tokens)
+
+        trim_order = [name for name in TOKEN_BUDGET_TRIM_ORDER if name in fitted] + [name for name in fitted if name not in TOKEN_BUDGET_TRIM_ORDER]
+        for allow_below_minimum in (False, True):
+            for name in trim_order:
+                overflow = sum(fitted_tokens.values()) - budget
+                if overflow <= 0 or not occurrences[name] or not fitted[name]:
+                    continue
+                per_copy_tokens = fitted_tokens[name] // occurrences[name]
+                floor_tokens = 0 if allow_below_minimum else min(TOKEN_BUDGET_MIN_SECTION_TOKENS, per_copy_tokens)
+                target_tokens = max(floor_tokens, per_copy_tokens - math.ceil(overflow / occurrences[name]))
+                if target_tokens >= per_copy_tokens:
+                    continue
+                trim_fn = trim_json_to_tokens if name in TOKEN_BUDGET_JSON_SECTIONS else trim_text_to_tokens
+                fitted[name] = trim_fn(fitted[name], target_tokens, chars_per_token)
+                fitted_tokens[name] = estimate_tokens(fitted[name], chars_per_token) * occurrences[name]
+
+        report = {
+            "model": model, "context_window": window, "reserved_output_tokens": self.reserved_output_tokens,
+            "chars_per_token": chars_per_token, "fixed_tokens": fixed_tokens,
+            "sections": {name: {"original": original_tokens[name], "final": fitted_tokens[name]} for name in sections},
+            "deduplicated": deduplicated,
+            "total_tokens": fixed_tokens + sum(fitted_tokens.values()),
+        }
+        report["fits"] = report["total_tokens"] <= window - self.reserved_output_tokens
+        return system_template, user_template, fitted, report
+
+
+def format_token_report(report):
+    if not report:
+        return "N/A"
+    sections_text = ", ".join(
+        f"{name} {values['original']}" + (f"→{values['final']}" if values["final"] != values["original"] else "")
+        for name, values in report["sections"].items())
+    return (f"~{report['total_tokens']} tokens de {report['context_window']} (reserva resposta {report['reserved_output_tokens']}) | "
+            f"fixo {report['fixed_tokens']} | {sections_text}"
+            + (f" | sem duplicados no sistema: {', '.join(report['deduplicated'])}" if report["deduplicated"] else "")
+            + ("" if report["fits"] else " | EXCEDE A JANELA"))